@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
+from tweeter.pagination import EstimatedCountPaginator
+
+from .backends import forget_users
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from .models import CustomUser
 
@@ -15,10 +18,36 @@ class CustomUserAdmin(UserAdmin):
         "email",
         "username",
         "date_of_birth",
+        "twit_count",
         "is_staff",
     ]
+    list_select_related = ["stats"]
+    # Prefix matches, which the upper-case indexes on PostgreSQL can serve
+    search_fields = ["^username", "^email"]
     fieldsets = UserAdmin.fieldsets + ((None, {"fields": ("date_of_birth",)}),)
     add_fieldsets = UserAdmin.add_fieldsets + ((None, {"fields": ("date_of_birth",)}),)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ["deactivate_users", "activate_users"]
+
+    @admin.display(description="Twits", ordering="stats__twit_count")
+    def twit_count(self, obj):
+        """Number of twits from the user's stats"""
+        return obj.stats.twit_count
+
+    @admin.action(description="Deactivate selected users")
+    def deactivate_users(self, request, queryset):
+        """Stop the selected users from logging in, in one UPDATE"""
+        user_ids = list(queryset.values_list("pk", flat=True))
+        updated = CustomUser.objects.filter(pk__in=user_ids).update(is_active=False)
+        forget_users(*user_ids)
+        self.message_user(request, f"Deactivated {updated} users.")
+
+    @admin.action(description="Activate selected users")
+    def activate_users(self, request, queryset):
+        """Let the selected users log in again, in one UPDATE"""
+        updated = queryset.update(is_active=True)
+        self.message_user(request, f"Activated {updated} users.")
 
 
 admin.site.register(CustomUser, CustomUserAdmin)
@@ -0,0 +1,44 @@
+"""Authentication that keeps the users of sessions in the cache.
+
+AuthenticationMiddleware loads request.user through the backend on every
+request. CachedModelBackend serves that from the cache, so with cached_db
+sessions an authenticated request makes no auth queries once both are warm.
+
+A cached user is dropped whenever the user is saved or deleted. Columns
+moved with queryset updates, like follower_count, are not refreshed, so
+code that needs them reads them from the database rather than from
+request.user, and updates that must take effect at once, like
+deactivating a user, call forget_users.
+
+With CACHE_SESSIONS off, as in production without a shared cache, users
+are loaded from the database like ModelBackend does.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def user_cache_key(user_id):
+    """Cache key of a user loaded for a session"""
+    return f"auth:user:{user_id}"
+
+
+def forget_users(*user_ids):
+    """Drop cached users so their next request loads them again"""
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend reading the users of sessions through the cache"""
+
+    def get_user(self, user_id):
+        """Get an active user from the cache, or load and cache them"""
+        if not settings.CACHE_SESSIONS:
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.TWEETER_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
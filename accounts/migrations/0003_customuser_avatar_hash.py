@@ -0,0 +1,34 @@
+# Generated by Django 4.1 on 2026-10-18 12:28
+
+from hashlib import md5
+
+from django.db import migrations, models
+
+
+def hash_existing_emails(apps, schema_editor):
+    """Fill in the avatar hash of users that already exist"""
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    batch = []
+    for user in CustomUser.objects.only("pk", "email").iterator(chunk_size=1000):
+        user.avatar_hash = md5(user.email.strip().lower().encode("utf-8")).hexdigest()
+        batch.append(user)
+        if len(batch) >= 1000:
+            CustomUser.objects.bulk_update(batch, ["avatar_hash"])
+            batch = []
+    CustomUser.objects.bulk_update(batch, ["avatar_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_follow"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="avatar_hash",
+            field=models.CharField(default="", editable=False, max_length=32),
+        ),
+        migrations.RunPython(hash_existing_emails, migrations.RunPython.noop),
+    ]
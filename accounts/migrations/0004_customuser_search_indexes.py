@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# The admin searches users by username and email prefix, which PostgreSQL
+# runs as UPPER(column::text) LIKE 'PREFIX%'. Other databases keep scanning.
+INDEXES = {
+    "customuser_username_upper_idx": "username",
+    "customuser_email_upper_idx": "email",
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    """Index the upper-cased username and email on PostgreSQL"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX {name} ON accounts_customuser "
+            f"(UPPER({column}::text) text_pattern_ops)"
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    """Drop the indexes made by create_search_indexes"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_customuser_avatar_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -1,12 +1,68 @@
+from hashlib import md5
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.urls import reverse
 
 
+def gravatar_hash(email):
+    """Gravatar hash of an email address"""
+    return md5((email or "").strip().lower().encode("utf-8")).hexdigest()
+
+
 class CustomUser(AbstractUser):
     """Custom User Model"""
 
     date_of_birth = models.DateField(null=True, blank=True)
+    following = models.ManyToManyField(
+        "self",
+        through="Follow",
+        symmetrical=False,
+        related_name="followers",
+        blank=True,
+    )
+    follower_count = models.PositiveIntegerField(default=0)
+    # Precomputed so avatars never need the email or a hash at render time
+    avatar_hash = models.CharField(max_length=32, editable=False, default="")
 
     def get_absolute_url(self):
         return reverse("profile", kwargs={"pk": self.pk})
+
+    def save(self, *args, **kwargs):
+        """Save the user, refreshing the avatar hash from the email"""
+        self.avatar_hash = gravatar_hash(self.email)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "email" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "avatar_hash"}
+        super().save(*args, **kwargs)
+
+
+class Follow(models.Model):
+    """A user following another user"""
+
+    follower = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="following_links",
+    )
+    followed = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="follower_links",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.follower} follows {self.followed}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "followed"],
+                name="unique_follow",
+            ),
+        ]
+        indexes = [
+            # Fan-out reads every follower of the author of a new twit
+            models.Index(fields=["followed", "follower"], name="follow_followers_idx"),
+        ]
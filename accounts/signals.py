@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import forget_users
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_changed_user(sender, instance, **kwargs):
+    """Drop the cached copy of a user that was saved or deleted"""
+    forget_users(instance.pk)
+    # A request reading the user before the commit may have cached it again
+    transaction.on_commit(lambda: forget_users(instance.pk))
@@ -1,8 +1,14 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from tweeter.models import Twit, Comment
+from tweeter.models import Twit, Comment, TimelineEntry, UserStats
+
+from .models import Follow, gravatar_hash
 
 
 class SignupPageTests(TestCase):
@@ -81,6 +87,91 @@ class ProfilePageTests(TestCase):
         self.assertEqual(self.user.first_name, "testy")
         self.assertEqual(self.user.last_name, "mctester")
 
+    def test_profile_email_change_refreshes_avatar_hash(self):
+        """Test profile email change refreshes avatar hash"""
+        self.assertEqual(self.user.avatar_hash, gravatar_hash("test@email.com"))
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("profile", kwargs={"pk": self.user.pk}),
+            {"username": "testuser", "email": " New@Email.com "},
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_hash, gravatar_hash("new@email.com"))
+
+
+class CachedAuthTests(TestCase):
+    """Cached Session And User Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Cached twit", user=cls.user)
+
+    def setUp(self):
+        """Log in and warm the session and user caches"""
+        cache.clear()
+        self.client.force_login(self.user)
+        self.client.get(reverse("twit_new"))
+
+    def test_no_auth_queries(self):
+        """Test feed and like requests do not query sessions or users"""
+        with CaptureQueriesContext(connection) as queries:
+            feed = self.client.get(reverse("twit_list"))
+            like = self.client.post(
+                reverse("twit_like", kwargs={"pk": self.twit.pk}),
+                {"twit_action": "like"},
+            )
+        self.assertEqual(feed.status_code, 200)
+        self.assertEqual(like.status_code, 200)
+        self.assertTrue(self.twit.likes.filter(pk=self.user.pk).exists())
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn("django_session", tables)
+        self.assertNotIn('FROM "accounts_customuser"', tables)
+
+    @override_settings(CACHE_SESSIONS=False)
+    def test_uncached_without_shared_cache(self):
+        """Test users are loaded from the database when caching is off"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("twit_new"))
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertIn('FROM "accounts_customuser"', tables)
+
+    def test_model_backend_session(self):
+        """Test sessions logged in through ModelBackend stay logged in"""
+        self.client.force_login(
+            self.user, backend="django.contrib.auth.backends.ModelBackend"
+        )
+        response = self.client.get(reverse("twit_new"))
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+    def test_profile_save_refreshes_user(self):
+        """Test saving the profile replaces the cached user"""
+        self.client.post(
+            reverse("profile", kwargs={"pk": self.user.pk}),
+            {"username": "testuser", "email": "test@email.com", "first_name": "New"},
+        )
+        response = self.client.get(reverse("twit_new"))
+        self.assertEqual(response.wsgi_request.user.first_name, "New")
+
+    def test_deactivated_user_is_logged_out(self):
+        """Test deactivating a user in the admin drops the cached user"""
+        admin = get_user_model().objects.create_superuser(
+            username="admin", email="admin@email.com", password="secret"
+        )
+        admin_client = self.client_class()
+        admin_client.force_login(admin)
+        admin_client.post(
+            reverse("admin:accounts_customuser_changelist"),
+            {"action": "deactivate_users", "_selected_action": [self.user.pk]},
+        )
+        response = self.client.get(reverse("twit_new"))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
 
 class PublicProfilePageTests(TestCase):
     """Public Profile Page Tests"""
@@ -162,3 +253,128 @@ class PublicProfilePageTests(TestCase):
         self.assertNotContains(response, "Nice twit content")
         self.assertNotContains(response, "Nice comment content")
         self.assertNotContains(response, "Nice other comment content")
+
+    def test_public_profile_pages(self):
+        """Test the profile is paged and its header read in one lookup"""
+        for i in range(25):
+            Twit.objects.create(body=f"Paged twit {i}", user=self.user)
+        self.client.force_login(self.user)
+        url = reverse("public_profile", kwargs={"pk": self.user.pk})
+
+        response = self.client.get(url)
+        self.assertContains(response, "Twits: 26")
+        self.assertContains(response, "Comments: 1")
+        self.assertEqual(len(response.context["twit_list"]), 20)
+        self.assertContains(response, "Paged twit 24")
+        self.assertNotContains(response, "Nice twit content")
+
+        older = response.context["page_obj"].older_cursor
+        response = self.client.get(url, {"older": older})
+        self.assertEqual(len(response.context["twit_list"]), 6)
+        self.assertContains(response, "Nice twit content")
+
+
+class FollowTests(TestCase):
+    """Follow Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        cls.other_twit = Twit.objects.create(
+            body="Nice other twit content",
+            user=cls.other_user,
+        )
+
+    def test_follow_and_unfollow(self):
+        """Test follow and unfollow keep the timeline and counts in step"""
+        self.client.force_login(self.user)
+        url = reverse("follow", kwargs={"pk": self.other_user.pk})
+
+        response = self.client.post(url, {"action": "follow"})
+        self.assertRedirects(
+            response, reverse("public_profile", kwargs={"pk": self.other_user.pk})
+        )
+        self.client.post(url, {"action": "follow"})
+        self.other_user.refresh_from_db()
+        self.assertEqual(self.other_user.follower_count, 1)
+        self.assertTrue(
+            TimelineEntry.objects.filter(owner=self.user, twit=self.other_twit).exists()
+        )
+
+        self.client.post(url, {"action": "unfollow"})
+        self.other_user.refresh_from_db()
+        self.assertEqual(self.other_user.follower_count, 0)
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+
+    def test_cannot_follow_self(self):
+        """Test cannot follow self"""
+        self.client.force_login(self.user)
+        self.client.post(reverse("follow", kwargs={"pk": self.user.pk}))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_follow_changes_profile_validators(self):
+        """Test the profile is a 304 until the follow button changes"""
+        self.client.force_login(self.user)
+        url = reverse("public_profile", kwargs={"pk": self.other_user.pk})
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post(reverse("follow", kwargs={"pk": self.other_user.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Unfollow")
+
+    def test_activity_changes_profile_validators(self):
+        """Test the profile ETag changes when its user is active again"""
+        self.client.force_login(self.user)
+        url = reverse("public_profile", kwargs={"pk": self.other_user.pk})
+        etag = self.client.get(url)["ETag"]
+        UserStats.objects.filter(user=self.other_user).update(
+            last_active_at=timezone.now()
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class UserAdminTests(TestCase):
+    """User Admin Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser(
+            username="admin",
+            email="admin@email.com",
+            password="secret",
+        )
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+
+    def test_search_by_prefix(self):
+        """Test users are found by the start of their username"""
+        self.client.force_login(self.admin)
+        url = reverse("admin:accounts_customuser_changelist")
+        self.assertContains(self.client.get(url, {"q": "test"}), "test@email.com")
+        self.assertNotContains(self.client.get(url, {"q": "user"}), "test@email.com")
+
+    def test_deactivate_users(self):
+        """Test the selected users are deactivated in one update"""
+        self.client.force_login(self.admin)
+        self.client.post(
+            reverse("admin:accounts_customuser_changelist"),
+            {"action": "deactivate_users", "_selected_action": [self.user.pk]},
+        )
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import SignUpView, ProfileView, PublicProfileView
+from .views import SignUpView, ProfileView, PublicProfileView, FollowView
 
 
 urlpatterns = [
@@ -11,4 +11,5 @@ urlpatterns = [
         PublicProfileView.as_view(),
         name="public_profile",
     ),
+    path("follow/<int:pk>/", FollowView.as_view(), name="follow"),
 ]
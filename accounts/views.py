@@ -1,9 +1,19 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db import transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
+from django.utils.functional import cached_property
+from django.views import View
 from django.views.generic import CreateView, DetailView
 from django.views.generic.edit import UpdateView
 
-from .models import CustomUser
+from tweeter.conditional import ConditionalGetMixin
+from tweeter.models import Twit
+from tweeter.pagination import KeysetPaginationMixin
+from tweeter.timelines import backfill, remove_author
+
+from .models import CustomUser, Follow
 
 from .forms import CustomUserCreationForm
 
@@ -36,8 +46,117 @@ class ProfileView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return obj == self.request.user
 
 
-class PublicProfileView(LoginRequiredMixin, DetailView):
+class PublicProfileView(
+    LoginRequiredMixin, ConditionalGetMixin, KeysetPaginationMixin, DetailView
+):
     """Public Profile View"""
 
     model = CustomUser
+    queryset = CustomUser.objects.select_related("stats")
     template_name = "public_profile.html"
+    paginate_by = 20
+
+    def get_object(self, queryset=None):
+        """Load the profile user once for the validators and the page"""
+        if not hasattr(self, "object"):
+            self.object = super().get_object(queryset)
+        return self.object
+
+    @cached_property
+    def is_following(self):
+        """Whether the current user follows this profile"""
+        return Follow.objects.filter(
+            follower=self.request.user, followed=self.get_object()
+        ).exists()
+
+    def get_validator_twits(self):
+        """Get the metadata of the twits on the requested page"""
+        return self.get_keyset_paginator(self.paginate_by).page(
+            Twit.objects.for_validators(self.request.user).filter(
+                user=self.get_object()
+            ),
+            older=self.request.GET.get(self.older_kwarg),
+            newer=self.request.GET.get(self.newer_kwarg),
+        )
+
+    def get_validator_extra(self, twits):
+        """The profile header, the follow button and the pagination links"""
+        profile = self.get_object()
+        stats = getattr(profile, "stats", None)
+        return (
+            profile.username,
+            profile.first_name,
+            profile.last_name,
+            profile.email,
+            profile.date_of_birth,
+            profile.follower_count,
+            stats
+            and (
+                stats.twit_count,
+                stats.comment_count,
+                stats.likes_received,
+                stats.last_active_at,
+            ),
+            self.is_following,
+            twits.has_older,
+            twits.has_newer,
+        )
+
+    def get_context_data(self, **kwargs):
+        """Add a page of the user's twits loaded for rendering"""
+        context = super().get_context_data(**kwargs)
+        _, page, twits, is_paginated = self.paginate_queryset(
+            Twit.objects.for_feed(self.request.user).filter(user=self.object),
+            self.paginate_by,
+        )
+        context.update(
+            {
+                "twit_list": twits,
+                "page_obj": page,
+                "is_paginated": is_paginated,
+                "is_following": self.is_following,
+            }
+        )
+        return context
+
+
+class FollowView(LoginRequiredMixin, View):
+    """Follow / Unfollow View"""
+
+    def post(self, request, *args, **kwargs):
+        """POST Request"""
+        followed = get_object_or_404(CustomUser, pk=kwargs["pk"])
+
+        if followed != request.user:
+            if request.POST.get("action") == "unfollow":
+                self.unfollow(request.user, followed)
+            else:
+                self.follow(request.user, followed)
+
+        return redirect("public_profile", pk=followed.pk)
+
+    @staticmethod
+    def follow(follower, followed):
+        """Follow a user and copy their recent twits into the timeline"""
+        with transaction.atomic():
+            _, created = Follow.objects.get_or_create(
+                follower=follower, followed=followed
+            )
+            if created:
+                CustomUser.objects.filter(pk=followed.pk).update(
+                    follower_count=F("follower_count") + 1
+                )
+                backfill(follower, followed)
+
+    @staticmethod
+    def unfollow(follower, followed):
+        """Unfollow a user and take their twits out of the timeline"""
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                follower=follower, followed=followed
+            ).delete()
+            if deleted:
+                CustomUser.objects.filter(pk=followed.pk).update(
+                    follower_count=F("follower_count") - 1
+                )
+                remove_author(follower, followed)
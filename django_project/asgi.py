@@ -2,6 +2,8 @@
 ASGI config for django_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests for the live event stream go to tweeter.live.LiveEventsApp, which
+holds them open, and everything else to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -13,4 +15,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from tweeter.live import LiveEventsApp  # noqa: E402
+
+live_events = LiveEventsApp()
+
+
+async def application(scope, receive, send):
+    """Serve the live event stream beside the Django app"""
+    if scope["type"] == "http" and scope["path"] == live_events.path:
+        return await live_events(scope, receive, send)
+    return await django_application(scope, receive, send)
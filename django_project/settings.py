@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
 from environs import Env
 
 # Set up ENV
@@ -52,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "tweeter.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -80,7 +83,16 @@ TEMPLATES = [
     },
 ]
 
+# "production" keeps database connections open and has gunicorn.conf.py
+# preload and warm up the app before workers take traffic. Templates need no
+# setting: without explicit loaders, Django 4.1 always uses the cached loader.
+SERVER_PROFILE = env.str("SERVER_PROFILE", default="development")
+
 WSGI_APPLICATION = "django_project.wsgi.application"
+ASGI_APPLICATION = "django_project.asgi.application"
+
+# "wsgi" or "asgi", also read by gunicorn.conf.py to pick the worker class
+SERVER_MODE = env.str("SERVER_MODE", default="wsgi")
 
 
 # Database
@@ -90,6 +102,35 @@ DATABASES = {
     "default": env.dj_db_url("DATABASE_URL"),
 }
 
+# Sync workers reuse their warmed up connection between requests. Async views
+# query from other threads, so ASGI still connects once per request.
+if SERVER_PROFILE == "production" and SERVER_MODE == "wsgi":
+    DATABASES["default"]["CONN_MAX_AGE"] = env.int("CONN_MAX_AGE", default=600)
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Fragments, buffered likes, sessions and the users of sessions live here.
+# Point CACHE_URL at a shared cache, like redis:// or pymemcache://, when
+# running more than one worker process so they all see the same entries.
+
+CACHES = {
+    "default": env.dj_cache_url("CACHE_URL", default="locmem://"),
+}
+# Whether every worker process sees the same cache entries
+SHARED_CACHE = not CACHES["default"]["BACKEND"].endswith(("LocMemCache", "DummyCache"))
+
+# Sessions and the users of sessions are only cached where a logout, a
+# password change or a deactivation in one worker reaches all the others.
+# Production with a per-process cache reads both from the database.
+CACHE_SESSIONS = env.bool(
+    "CACHE_SESSIONS", default=SHARED_CACHE or SERVER_PROFILE != "production"
+)
+if CACHE_SESSIONS:
+    # Read from the cache and written through to the database
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -111,6 +152,14 @@ AUTH_PASSWORD_VALIDATORS = [
 
 # Auth User
 AUTH_USER_MODEL = "accounts.CustomUser"
+# ModelBackend stays listed so sessions that logged in through it before
+# the cached backend was added stay logged in, loading their user uncached
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+# Seconds the user of a session stays cached between saves of the user
+TWEETER_USER_CACHE_TIMEOUT = env.int("TWEETER_USER_CACHE_TIMEOUT", default=300)
 
 
 # Internationalization
@@ -131,7 +180,14 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static/"]
 STATIC_ROOT = BASE_DIR / "staticfiles"
+# Fingerprints and gzips static files, and writes .br files too when the
+# Brotli package from requirements.txt is installed
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# In production every bundle must have been built by bundle_assets, see
+# bin/post_compile, instead of pages linking its parts from the CDNs
+TWEETER_REQUIRE_BUNDLES = env.bool(
+    "TWEETER_REQUIRE_BUNDLES", default=SERVER_PROFILE == "production"
+)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -155,3 +211,95 @@ EMAIL_USE_SSL = False
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
+
+# Tweeter
+# Authors with more followers than this are not fanned out on write. Their
+# twits are pulled into followers' home timelines when those are read.
+TWEETER_FANOUT_FOLLOWER_LIMIT = env.int("TWEETER_FANOUT_FOLLOWER_LIMIT", default=10000)
+TWEETER_FANOUT_BATCH_SIZE = env.int("TWEETER_FANOUT_BATCH_SIZE", default=1000)
+# Number of recent twits copied into a timeline when following someone
+TWEETER_TIMELINE_BACKFILL = env.int("TWEETER_TIMELINE_BACKFILL", default=50)
+# Seconds the shared part of a rendered twit box stays cached
+TWEETER_FRAGMENT_CACHE_TIMEOUT = env.int("TWEETER_FRAGMENT_CACHE_TIMEOUT", default=3600)
+# Latest comments shown under each twit in feeds, and the page size of the
+# earlier comments fetched on demand
+TWEETER_COMMENT_PREVIEW = env.int("TWEETER_COMMENT_PREVIEW", default=3)
+TWEETER_COMMENT_PAGE_SIZE = env.int("TWEETER_COMMENT_PAGE_SIZE", default=20)
+# Admin lists of bigger unfiltered tables show an estimated count, and
+# twits show their latest comments inline, linking to the rest
+TWEETER_ADMIN_EXACT_COUNT_LIMIT = env.int(
+    "TWEETER_ADMIN_EXACT_COUNT_LIMIT", default=10000
+)
+TWEETER_ADMIN_INLINE_COMMENTS = env.int("TWEETER_ADMIN_INLINE_COMMENTS", default=20)
+# Most search results the twit admin lists, read from the index in pages
+TWEETER_ADMIN_SEARCH_LIMIT = env.int("TWEETER_ADMIN_SEARCH_LIMIT", default=1000)
+# Buffer likes in the cache and write them with flush_like_buffer, run as
+# a process of its own next to the web processes, for example with a
+# Procfile line like
+#     likeflusher: python manage.py flush_like_buffer --interval 2
+# Both must see the same cache, so a shared CACHE_URL is required.
+TWEETER_LIKE_BUFFER = env.bool("TWEETER_LIKE_BUFFER", default=False)
+if TWEETER_LIKE_BUFFER and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        "TWEETER_LIKE_BUFFER needs a CACHE_URL shared by the web processes "
+        "and flush_like_buffer, such as a redis:// or db:// URL."
+    )
+TWEETER_LIKE_BUFFER_TIMEOUT = env.int("TWEETER_LIKE_BUFFER_TIMEOUT", default=86400)
+# Rows fetched per server-side cursor round trip by the NDJSON exports
+TWEETER_EXPORT_CHUNK_SIZE = env.int("TWEETER_EXPORT_CHUNK_SIZE", default=2000)
+# Route the feed, like and comment pages to their async views
+TWEETER_ASYNC_VIEWS = env.bool("TWEETER_ASYNC_VIEWS", default=SERVER_MODE == "asgi")
+# Postgres text search configuration used for the search index
+TWEETER_SEARCH_CONFIG = env.str("TWEETER_SEARCH_CONFIG", default="english")
+# Requests slower than this are logged as warnings with all their queries,
+# others with just the slowest few
+TWEETER_SLOW_REQUEST_MS = env.int("TWEETER_SLOW_REQUEST_MS", default=500)
+TWEETER_SLOWEST_QUERIES = env.int("TWEETER_SLOWEST_QUERIES", default=3)
+# Push new twits, comments and like counts to open feeds as Server-Sent
+# Events. The stream is served by django_project.asgi, so this needs ASGI.
+TWEETER_LIVE_UPDATES = env.bool("TWEETER_LIVE_UPDATES", default=SERVER_MODE == "asgi")
+# The local broker only reaches streams held by the publishing process, so
+# run a single ASGI worker with it or plug in a shared broker
+TWEETER_LIVE_BROKER = env.str("TWEETER_LIVE_BROKER", default="tweeter.live.LocalBroker")
+# Events kept for reconnecting streams, events queued for a slow stream
+# before it is dropped, and seconds between keep-alive comments
+TWEETER_LIVE_HISTORY = env.int("TWEETER_LIVE_HISTORY", default=500)
+TWEETER_LIVE_QUEUE_SIZE = env.int("TWEETER_LIVE_QUEUE_SIZE", default=100)
+TWEETER_LIVE_KEEPALIVE = env.int("TWEETER_LIVE_KEEPALIVE", default=15)
+# Twit images are fetched once into this disk cache and served from it,
+# dropping the least recently used files once it is over the size limit
+TWEETER_IMAGE_CACHE_DIR = env.path(
+    "TWEETER_IMAGE_CACHE_DIR", default=BASE_DIR / "image_cache"
+)
+TWEETER_IMAGE_CACHE_MAX_MB = env.int("TWEETER_IMAGE_CACHE_MAX_MB", default=512)
+# Class fetching the originals, with the largest original accepted
+TWEETER_IMAGE_FETCHER = env.str(
+    "TWEETER_IMAGE_FETCHER", default="tweeter.images.HttpFetcher"
+)
+TWEETER_IMAGE_MAX_MB = env.int("TWEETER_IMAGE_MAX_MB", default=10)
+TWEETER_IMAGE_FETCH_TIMEOUT = env.int("TWEETER_IMAGE_FETCH_TIMEOUT", default=10)
+# Fetch on a background thread when a twit is saved, instead of after commit
+# in the request itself
+TWEETER_IMAGE_FETCH_IN_BACKGROUND = env.bool(
+    "TWEETER_IMAGE_FETCH_IN_BACKGROUND", default=True
+)
+# Width feed images are shrunk to, when Pillow is installed
+TWEETER_IMAGE_WIDTH = env.int("TWEETER_IMAGE_WIDTH", default=640)
+
+# Logging
+# Only slow requests are logged by default, set TWEETER_REQUEST_LOG_LEVEL to
+# INFO to log a line for every request
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "tweeter.requests": {
+            "handlers": ["console"],
+            "level": env.str("TWEETER_REQUEST_LOG_LEVEL", default="WARNING"),
+            "propagate": False,
+        },
+    },
+}
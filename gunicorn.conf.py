@@ -0,0 +1,68 @@
+"""
+Gunicorn config, loaded automatically from the project root.
+
+SERVER_MODE=wsgi (the default) runs the usual sync workers. SERVER_MODE=asgi
+serves django_project.asgi with uvicorn workers so one process can hold many
+concurrent requests on the async views.
+
+SERVER_PROFILE=production preloads the app in the master and warms it up
+there, compiling every template and URL pattern once for all the forked
+workers. Each worker then opens its database connections before it accepts
+connections. The master and every worker log how long they took to boot.
+"""
+
+import os
+import time
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+SERVER_PROFILE = os.environ.get("SERVER_PROFILE", "development")
+
+# When the master started reading this config
+BOOT_STARTED = time.monotonic()
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "django_project.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "django_project.wsgi:application"
+    worker_class = "sync"
+
+errorlog = "-"
+preload_app = SERVER_PROFILE == "production"
+
+
+def when_ready(server):
+    """Warm up the preloaded app before the first worker is forked"""
+    if preload_app:
+        from django.db import connections
+
+        from tweeter.warmup import describe, warm_up
+
+        server.log.info(
+            "Warmed up the master: %s", describe(warm_up(["templates", "urls"]))
+        )
+        # Workers must not inherit connections opened by the master
+        connections.close_all()
+    server.log.info("Master booted in %.0fms", (time.monotonic() - BOOT_STARTED) * 1000)
+
+
+def post_fork(server, worker):
+    """Note when the worker was forked"""
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    """Finish warming up the worker before it accepts connections"""
+    if SERVER_PROFILE == "production":
+        from tweeter.warmup import describe, warm_up
+
+        # Async views query from a thread pool, not from this thread
+        steps = [] if SERVER_MODE == "asgi" else ["database"]
+        timings = warm_up(steps)
+        if timings:
+            worker.log.info("Warmed up worker %s: %s", worker.pid, describe(timings))
+    worker.log.info(
+        "Worker %s booted in %.0fms",
+        worker.pid,
+        (time.monotonic() - worker.forked_at) * 1000,
+    )
@@ -1,10 +1,163 @@
+// Same units and wording as Django's timesince filter
+const TIMESINCE_CHUNKS = [
+    [60 * 60 * 24 * 365, 'year'],
+    [60 * 60 * 24 * 30, 'month'],
+    [60 * 60 * 24 * 7, 'week'],
+    [60 * 60 * 24, 'day'],
+    [60 * 60, 'hour'],
+    [60, 'minute'],
+];
+
+function timesince(date) {
+    // Describe how long ago a date was, like "2 hours, 5 minutes"
+    let seconds = Math.max(0, Math.floor((Date.now() - date.getTime()) / 1000));
+    let units = function (count, name) {
+        return count + '\u00a0' + name + (count === 1 ? '' : 's');
+    };
+
+    for (let i = 0; i < TIMESINCE_CHUNKS.length; i++) {
+        let [chunk, name] = TIMESINCE_CHUNKS[i];
+        let count = Math.floor(seconds / chunk);
+        if (count === 0) {
+            continue;
+        }
+        let result = units(count, name);
+        // Like Django, add the next smaller unit if it is not zero
+        if (i + 1 < TIMESINCE_CHUNKS.length) {
+            let [next_chunk, next_name] = TIMESINCE_CHUNKS[i + 1];
+            let next_count = Math.floor((seconds - count * chunk) / next_chunk);
+            if (next_count > 0) {
+                result += ', ' + units(next_count, next_name);
+            }
+        }
+        return result;
+    }
+    return units(0, 'minute');
+}
+
+function refreshTimesince(root) {
+    // Twit boxes come from a cache, so relative times are redone on the client
+    $(root).find('time.timesince').each(function () {
+        let date = new Date($(this).attr('datetime'));
+        if (!isNaN(date)) {
+            $(this).text(timesince(date) + ' ago');
+        }
+    });
+}
+
+function addComment(box, data) {
+    // Add a comment row to a twit box once and show the new comment count
+    box.find('.comment_count').text(data.comment_count);
+    let comment_list = box.find('.comment_list');
+    if (comment_list.find('[data-comment-id="' + data.id + '"]').length) {
+        return;
+    }
+    let comment = $($.parseHTML(data.html));
+    refreshTimesince(comment);
+    comment_list.append(comment);
+}
+
+function followLiveUpdates(feed) {
+    // Add new twits and comments and update like counts as they happen
+    if (!feed.data('live-url') || !window.EventSource) {
+        return;
+    }
+    let source = new EventSource(feed.data('live-url'));
+    let twitBox = function (id) {
+        return feed.find('.twit-box[data-twit-id="' + id + '"]');
+    };
+
+    source.addEventListener('twit', function (event) {
+        let data = JSON.parse(event.data);
+        if (!feed.data('live-new-twits') || twitBox(data.id).length) {
+            return;
+        }
+        // The box comes without edit buttons, which only the author gets
+        let buttons = data.user === feed.data('user-id') ? data.owner_buttons : '';
+        let box = $($.parseHTML(data.html.replace('<!--twit-owner-buttons-->', buttons)));
+        refreshTimesince(box);
+        feed.prepend(box);
+    });
+
+    source.addEventListener('comment', function (event) {
+        let data = JSON.parse(event.data);
+        addComment(twitBox(data.twit), data);
+    });
+
+    source.addEventListener('like', function (event) {
+        let data = JSON.parse(event.data);
+        twitBox(data.twit).find('.like_count').text(data.like_count);
+    });
+}
+
 $(document).ready(function () {
-    $(".like_button").click(function (event) {
+    refreshTimesince(document);
+    followLiveUpdates($('#twit_feed'));
+
+    $(document).on('click', '.earlier_comments', function (event) {
+        // Load the next page of earlier comments above the ones shown.
+        event.preventDefault();
+
+        let target = $(event.currentTarget);
+        let comment_list = target.closest('.twit-box').find('.comment_list');
+
+        $.ajax({
+            url: target.data('comments-url'),
+        }).done(function (data) {
+            let comments = $($.parseHTML(data.html));
+            refreshTimesince(comments);
+            comment_list.prepend(comments);
+            if (data.older_url) {
+                target.data('comments-url', data.older_url);
+            } else {
+                target.closest('.row').remove();
+            }
+        });
+    });
+
+    $(document).on('click', '.twit-box .comment_button', function (event) {
+        // Comment in place under the twit instead of on a page of its own
+        event.preventDefault();
+        let form = $(event.currentTarget).closest('.twit-box').find('.comment_form');
+        form.toggleClass('d-none');
+        form.find('input[name="text"]').trigger('focus');
+    });
+
+    $(document).on('submit', '.comment_form', function (event) {
+        // Post the comment and add the row the server answers with
+        event.preventDefault();
+
+        let form = $(event.currentTarget);
+        let input = form.find('input[name="text"]');
+        let button = form.find('button[type="submit"]');
+        button.prop('disabled', true);
+
+        $.ajax({
+            url: form.attr('action'),
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': $('meta[name="csrf-token"]').attr('content'),
+            },
+            data: form.serialize(),
+        }).done(function (data) {
+            addComment(form.closest('.twit-box'), data);
+            input.val('').removeClass('is-invalid');
+            form.addClass('d-none');
+        }).fail(function (xhr) {
+            let errors = (xhr.responseJSON && xhr.responseJSON.errors) || {};
+            let message = (errors.text || ['The comment could not be saved.'])[0];
+            input.addClass('is-invalid');
+            form.find('.invalid-feedback').text(message);
+        }).always(function () {
+            button.prop('disabled', false);
+        });
+    });
+
+    $(document).on('click', '.like_button', function (event) {
         // The work we want to do on click.
 
         // Get required data
         let target = $(event.currentTarget);
-        let twit_id = target.data('id');
         let twit_action = target.data('action');
         let twit_like_url = target.data('like-url');
 
@@ -14,21 +167,23 @@ $(document).ready(function () {
 
         $.ajax({
             url: twit_like_url,
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': $('meta[name="csrf-token"]').attr('content'),
+            },
             data: {
-                twit_id: twit_id,
                 twit_action: twit_action,
             },
         }).done(function (data) {
             // Do completion work here.
             if (data.success) {
-                // If we liked, update elements to match.
-                if (twit_action === 'like') {
+                // Show the like state and count the server answered with.
+                if (data.liked) {
                     // Do like
                     target.removeClass('btn-outline-primary');
                     target.addClass('btn-primary');
                     like_icon.removeClass('bi-hand-thumbs-up');
                     like_icon.addClass('bi-hand-thumbs-up-fill');
-                    like_count.html(Number(like_count.html()) + 1);
                     target.data('action', 'unlike');
                 } else {
                     // Do unlike
@@ -36,9 +191,9 @@ $(document).ready(function () {
                     target.addClass('btn-outline-primary');
                     like_icon.removeClass('bi-hand-thumbs-up-fill');
                     like_icon.addClass('bi-hand-thumbs-up');
-                    like_count.html(Number(like_count.html()) - 1);
                     target.data('action', 'like');
                 }
+                like_count.html(data.like_count);
             }
         });
     });
@@ -0,0 +1,7 @@
+$(document).ready(function () {
+    // Pick dates in the format Django parses first
+    $('input[name="date_of_birth"]').datepicker({
+        format: 'yyyy-mm-dd',
+        autoclose: true,
+    });
+});
@@ -1,17 +1,183 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.text import capfirst
 
-from .models import Twit, Comment
+from .models import Twit, Comment, TimelineEntry
+from .pagination import EstimatedCountPaginator
+from .search import index_twits, search_twits
+
+
+class LatestCommentsFormSet(BaseInlineFormSet):
+    """Only the latest TWEETER_ADMIN_INLINE_COMMENTS comments of a twit"""
+
+    def get_queryset(self):
+        """Get the latest comments, newest first"""
+        if not hasattr(self, "_latest"):
+            self._latest = (
+                super()
+                .get_queryset()
+                .order_by("-created_at", "-id")[
+                    : settings.TWEETER_ADMIN_INLINE_COMMENTS
+                ]
+            )
+        return self._latest
 
 
 class CommentInline(admin.TabularInline):
+    """Comment Inline"""
+
     model = Comment
+    formset = LatestCommentsFormSet
+    fields = ("user", "text", "created_at")
+    readonly_fields = ("created_at",)
+    autocomplete_fields = ("user",)
+    extra = 0
 
 
 class TwitAdmin(admin.ModelAdmin):
+    """Twit Admin.
+
+    Deleting goes through TwitQuerySet.bulk_delete, so the confirmation page
+    counts the related rows instead of listing them.
+    """
+
+    list_display = ("__str__", "user", "like_count", "comment_count", "created_at")
+    list_select_related = ("user",)
+    # Searched through the full-text index, see get_search_results
+    search_fields = ("body",)
+    autocomplete_fields = ("user",)
+    fields = (
+        "user",
+        "body",
+        "image_url",
+        "like_count",
+        "comments",
+        "created_at",
+        "updated_at",
+    )
+    readonly_fields = ("like_count", "comments", "created_at", "updated_at")
     inlines = [
         CommentInline,
     ]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ["remove_images"]
+
+    @admin.display(description="Comments")
+    def comments(self, obj):
+        """Link to every comment of the twit"""
+        url = reverse("admin:tweeter_comment_changelist")
+        return format_html(
+            '<a href="{}?twit__id__exact={}">{} comments</a>',
+            url,
+            obj.pk,
+            obj.comment_count,
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        """Find twits by their body and comments in the search index.
+
+        Pages of results are read up to TWEETER_ADMIN_SEARCH_LIMIT twits,
+        with a warning on the change list when there were more.
+        """
+        if not search_term:
+            return queryset, False
+        limit = settings.TWEETER_ADMIN_SEARCH_LIMIT
+        twit_ids, cursor = [], None
+        while len(twit_ids) < limit:
+            rows, cursor = search_twits(
+                search_term,
+                min(self.list_max_show_all, limit - len(twit_ids)),
+                after=cursor,
+            )
+            twit_ids.extend(twit_id for twit_id, _ in rows)
+            if cursor is None:
+                break
+        if cursor is not None and request.path == reverse(
+            "admin:tweeter_twit_changelist"
+        ):
+            self.message_user(
+                request,
+                f"Only the best {limit} matches are listed. "
+                "Refine the search to see the others.",
+                messages.WARNING,
+            )
+        return queryset.filter(pk__in=twit_ids), False
+
+    def get_deleted_objects(self, objs, request):
+        """Count what goes with the twits instead of listing every row"""
+        twit_ids = [obj.pk for obj in objs]
+        deleted_objects = [
+            format_html(
+                '{}: <a href="{}">{}</a>',
+                capfirst(Twit._meta.verbose_name),
+                reverse("admin:tweeter_twit_change", args=[obj.pk]),
+                obj,
+            )
+            for obj in objs
+        ]
+        model_count = {
+            Twit._meta.verbose_name_plural: len(twit_ids),
+            Comment._meta.verbose_name_plural: Comment.objects.filter(
+                twit__in=twit_ids
+            ).count(),
+            "timeline entries": TimelineEntry.objects.filter(twit__in=twit_ids).count(),
+            "likes": Twit.likes.through.objects.filter(twit__in=twit_ids).count(),
+        }
+        perms_needed = set()
+        if model_count[Comment._meta.verbose_name_plural] and not (
+            request.user.has_perm("tweeter.delete_comment")
+        ):
+            perms_needed.add(Comment._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, []
+
+    def delete_queryset(self, request, queryset):
+        """Delete the selected twits with a few set-based statements"""
+        queryset.bulk_delete()
+
+    def delete_model(self, request, obj):
+        """Delete one twit the same way as a selection"""
+        self.delete_queryset(request, Twit.objects.filter(pk=obj.pk))
+
+    @admin.action(description="Remove the images of selected twits")
+    def remove_images(self, request, queryset):
+        """Clear the image of every selected twit in one UPDATE.
+
+        updated_at is moved too, since it versions the cached twit boxes and
+        the validators of the pages showing them.
+        """
+        updated = queryset.update(
+            image_url="", image_digest="", updated_at=timezone.now()
+        )
+        self.message_user(request, f"Removed the images of {updated} twits.")
+
+
+class CommentAdmin(admin.ModelAdmin):
+    """Comment Admin"""
+
+    list_display = ("__str__", "twit", "user", "created_at")
+    list_select_related = ("twit", "user")
+    search_fields = ("^user__username",)
+    autocomplete_fields = ("twit", "user")
+    # Newest first along the primary key instead of sorting the whole table
+    ordering = ("-pk",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def delete_queryset(self, request, queryset):
+        """Delete the selected comments in one statement"""
+        twit_ids = queryset.bulk_delete()
+        if twit_ids:
+            index_twits(*twit_ids)
+
+    def delete_model(self, request, obj):
+        """Delete one comment the same way as a selection"""
+        self.delete_queryset(request, Comment.objects.filter(pk=obj.pk))
 
 
 admin.site.register(Twit, TwitAdmin)
-admin.site.register(Comment)
+admin.site.register(Comment, CommentAdmin)
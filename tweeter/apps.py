@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TweeterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tweeter'
+
+    def ready(self):
+        """Connect the signal handlers that maintain denormalized counters"""
+        from . import signals  # noqa: F401
@@ -0,0 +1,126 @@
+"""Self-hosted front-end assets, bundled into a few files.
+
+VENDOR lists the third party files the pages use, each with the CDN URL it
+comes from and, where known, its Subresource Integrity hash. BUNDLES lists
+the files concatenated into each bundle under static/dist. The bundle_assets
+command downloads the vendor files into static/vendor, recording the hashes
+it was not given in static/vendor/integrity.json, and builds the bundles.
+Neither directory is in the repository: bin/post_compile runs bundle_assets
+as a build step before collectstatic, which then fingerprints and compresses
+the bundles like any other static file, so a deploy fails when a vendor file
+cannot be downloaded or does not match its hash. WhiteNoise only writes .br
+files when Brotli is installed, otherwise just .gz ones.
+
+Until a bundle has been built, as in a fresh checkout, the asset_bundle tag
+links its parts instead, the vendor files from their CDNs. In production,
+where TWEETER_REQUIRE_BUNDLES is on, a missing bundle raises instead.
+"""
+import base64
+import hashlib
+import posixpath
+import re
+
+# Static path of each vendor file: (CDN URL, integrity or None)
+VENDOR = {
+    "vendor/bootstrap/bootstrap.min.css": (
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css",
+        "sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3",
+    ),
+    "vendor/bootstrap/bootstrap.bundle.min.js": (
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js",
+        "sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p",
+    ),
+    "vendor/bootstrap-icons/bootstrap-icons.css": (
+        "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.5.0/font/bootstrap-icons.css",
+        None,
+    ),
+    "vendor/bootstrap-icons/fonts/bootstrap-icons.woff2": (
+        "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.5.0/font/fonts/"
+        "bootstrap-icons.woff2",
+        None,
+    ),
+    "vendor/bootstrap-icons/fonts/bootstrap-icons.woff": (
+        "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.5.0/font/fonts/"
+        "bootstrap-icons.woff",
+        None,
+    ),
+    "vendor/bootstrap-datepicker/bootstrap-datepicker.min.css": (
+        "https://cdnjs.cloudflare.com/ajax/libs/bootstrap-datepicker/1.9.0/css/"
+        "bootstrap-datepicker.min.css",
+        None,
+    ),
+    "vendor/bootstrap-datepicker/bootstrap-datepicker.min.js": (
+        "https://cdnjs.cloudflare.com/ajax/libs/bootstrap-datepicker/1.9.0/js/"
+        "bootstrap-datepicker.min.js",
+        None,
+    ),
+}
+
+# jQuery 3.6.0 already ships with the admin, so it is bundled from there
+JQUERY = "admin/js/vendor/jquery/jquery.min.js"
+
+# Bundle name to the static paths it is made of, in order. Popper is part
+# of the Bootstrap bundle, so it is not loaded separately.
+BUNDLES = {
+    "site.css": [
+        "vendor/bootstrap/bootstrap.min.css",
+        "vendor/bootstrap-icons/bootstrap-icons.css",
+        "css/base.css",
+    ],
+    "site.js": [
+        JQUERY,
+        "vendor/bootstrap/bootstrap.bundle.min.js",
+        "js/base.js",
+    ],
+    "datepicker.css": [
+        "vendor/bootstrap-datepicker/bootstrap-datepicker.min.css",
+    ],
+    "datepicker.js": [
+        "vendor/bootstrap-datepicker/bootstrap-datepicker.min.js",
+        "js/datepicker.js",
+    ],
+}
+
+# Source map comments would point at maps that are not vendored
+SOURCE_MAP_RE = re.compile(rb"^\s*(/\*#|//#) sourceMappingURL=.*$", re.MULTILINE)
+CSS_URL_RE = re.compile(rb"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+
+
+def bundle_path(name):
+    """Static path of a built bundle"""
+    return f"dist/{name}"
+
+
+def integrity(data):
+    """Subresource Integrity hash of some bytes"""
+    digest = base64.b64encode(hashlib.sha384(data).digest()).decode("ascii")
+    return f"sha384-{digest}"
+
+
+def rebase_css_urls(css, source, target):
+    """Make the relative url()s in a stylesheet at `source` work from `target`"""
+
+    def rebase(match):
+        quote, url = match.groups()
+        if url.startswith((b"data:", b"http:", b"https:", b"/", b"#")):
+            return match.group(0)
+        resolved = posixpath.normpath(
+            posixpath.join(posixpath.dirname(source), url.decode("utf-8"))
+        )
+        relative = posixpath.relpath(resolved, posixpath.dirname(target))
+        return b"url(" + quote + relative.encode("utf-8") + quote + b")"
+
+    return CSS_URL_RE.sub(rebase, css)
+
+
+def build_bundle(name, read):
+    """Concatenate the parts of a bundle, reading each with read(path)"""
+    parts = []
+    for path in BUNDLES[name]:
+        data = SOURCE_MAP_RE.sub(b"", read(path)).strip()
+        if name.endswith(".css"):
+            data = rebase_css_urls(data, path, bundle_path(name))
+        parts.append(f"/* {path} */\n".encode("utf-8") + data)
+    # A statement left open by one script must not run into the next
+    separator = b"\n" if name.endswith(".css") else b"\n;\n"
+    return separator.join(parts) + b"\n"
@@ -0,0 +1,110 @@
+"""Conditional GET for pages made of twit boxes.
+
+Validators are built from the metadata of the twits a page shows, read with
+TwitQuerySet.for_validators, so a client polling an unchanged page gets a 304
+without the page being loaded or rendered.
+"""
+import abc
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import salted_hmac
+from django.utils.http import http_date, quote_etag
+
+from .fragments import profiles_version
+from .likebuffer import apply_pending
+
+
+class ConditionalGetMixin(abc.ABC):
+    """Answer GET requests with 304 Not Modified when the page is unchanged.
+
+    The ETag covers the viewer, the twits on the page with their like and
+    comment counters, the names and avatars of their authors and commenters
+    and anything added by get_validator_extra. Last-Modified is the newest
+    edit or comment on the page; it does not see likes, so the ETag takes
+    precedence whenever a client sends both.
+
+    Pages showing flash messages are always rendered and carry no
+    validators, since a copy with the messages must not be reused later.
+    """
+
+    @abc.abstractmethod
+    def get_validator_twits(self):
+        """Get the twits shown on the page, loaded with for_validators"""
+
+    def get_validator_extra(self, twits):
+        """Get anything else the page shows that the twits do not cover"""
+        return ()
+
+    def get_validators(self):
+        """Build the (etag, last_modified) validators of the page"""
+        twits = self.get_validator_twits()
+        if settings.TWEETER_LIKE_BUFFER:
+            apply_pending(twits, self.request.user)
+
+        # Checked here as the session storage may not be read once async
+        self.shows_messages = bool(get_messages(self.request))
+
+        # Every page carries a csrf token, so make sure the secret exists
+        # now rather than when the page is first rendered. The token itself
+        # is masked differently on every call, so its secret is hashed.
+        get_token(self.request)
+        csrf_secret = self.request.META["CSRF_COOKIE"]
+        parts = [
+            self.request.user.pk,
+            salted_hmac("tweeter.conditional", csrf_secret).hexdigest(),
+            profiles_version(),
+            *self.get_validator_extra(twits),
+        ]
+        last_modified = None
+        for twit in twits:
+            parts.append(
+                (
+                    twit.pk,
+                    twit.image_digest,
+                    twit.updated_at.isoformat(),
+                    twit.latest_comment_at and twit.latest_comment_at.isoformat(),
+                    twit.like_count,
+                    twit.comment_count,
+                    twit.viewer_liked,
+                )
+            )
+            for moment in (twit.updated_at, twit.latest_comment_at):
+                if moment and (last_modified is None or moment > last_modified):
+                    last_modified = moment
+
+        etag = hashlib.md5(repr(parts).encode("utf-8")).hexdigest()
+        return quote_etag(etag), last_modified
+
+    def get_not_modified(self, etag, last_modified):
+        """Get a 304 response if the client's copy is current, else None"""
+        if self.shows_messages:
+            return None
+        return get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=last_modified and int(last_modified.timestamp()),
+        )
+
+    def set_validators(self, response, etag, last_modified):
+        """Add the validators to a response and make clients revalidate"""
+        patch_cache_control(response, private=True, no_cache=True)
+        if self.shows_messages:
+            return response
+        response.headers.setdefault("ETag", etag)
+        if last_modified:
+            response.headers.setdefault(
+                "Last-Modified", http_date(last_modified.timestamp())
+            )
+        return response
+
+    def get(self, request, *args, **kwargs):
+        """GET Request"""
+        validators = self.get_validators()
+        response = self.get_not_modified(*validators)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.set_validators(response, *validators)
@@ -0,0 +1,130 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .likebuffer import apply_pending
+from .models import Comment
+from .pagination import encode_cursor
+
+# Marker left in the cached fragment where the owner's edit buttons go
+OWNER_BUTTONS_SLOT = "<!--twit-owner-buttons-->"
+# Version of the names and avatars shown in every cached fragment
+PROFILES_VERSION_KEY = "twit-box:profiles"
+
+
+def twit_box_key(twit):
+    """Cache key of the shared part of a twit box.
+
+    The version changes whenever the twit is edited or commented on and
+    when its image has been fetched. Likes are not part of it because the
+    like button is rendered per viewer. Names and avatars of the author and
+    commenters are versioned by PROFILES_VERSION_KEY instead.
+    """
+    version = (
+        f"{twit.updated_at.timestamp():.6f}.{twit.comment_count}"
+        f".{twit.image_digest[:12]}"
+    )
+    return f"twit-box:{twit.pk}:{version}"
+
+
+def discard_twit_box(twit):
+    """Drop the cached fragment of a twit that is about to change"""
+    cache.delete(twit_box_key(twit))
+
+
+def profiles_version():
+    """Get the current profiles version, starting a new one if it is gone"""
+    version = cache.get(PROFILES_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(PROFILES_VERSION_KEY, version, None):
+            version = cache.get(PROFILES_VERSION_KEY, version)
+    return version
+
+
+def bump_profiles_version():
+    """Stop using fragments made before a name or avatar changed"""
+    cache.set(PROFILES_VERSION_KEY, time.time_ns(), None)
+
+
+def attach_comment_previews(twits):
+    """Load the latest few comments of every twit in one query.
+
+    Each twit gets a comment_preview list in display order and, when it has
+    more comments than that, an earlier_comments_cursor for fetching them.
+    """
+    previews = {twit.pk: [] for twit in twits}
+    commented = [twit.pk for twit in twits if twit.comment_count]
+    if commented:
+        comments = (
+            Comment.objects.latest_per_twit(commented, settings.TWEETER_COMMENT_PREVIEW)
+            .select_related("user")
+            .order_by("created_at", "id")
+        )
+        for comment in comments:
+            previews[comment.twit_id].append(comment)
+
+    for twit in twits:
+        twit.comment_preview = previews[twit.pk]
+        twit.earlier_comments_cursor = None
+        # The counter may run ahead of the rows, as when the only comment
+        # was deleted and the counter not yet updated
+        if twit.comment_preview and twit.comment_count > len(twit.comment_preview):
+            oldest = twit.comment_preview[0]
+            twit.earlier_comments_cursor = encode_cursor(oldest.created_at, oldest.pk)
+
+
+def render_twit_boxes(twits, viewer):
+    """Render the twit boxes of a page for a viewer.
+
+    The part of each box that is the same for everyone comes from the cache
+    in a single round trip and only missing fragments are rendered, along
+    with their comment previews. The edit buttons and like button are then
+    filled in for the viewer. Without a viewer the edit buttons are left as
+    OWNER_BUTTONS_SLOT for the page to fill in.
+    """
+    if settings.TWEETER_LIKE_BUFFER:
+        apply_pending(twits, viewer)
+
+    keys = {twit.pk: twit_box_key(twit) for twit in twits}
+    cached = cache.get_many([*keys.values(), PROFILES_VERSION_KEY])
+    # When the version is gone, nothing cached before can be trusted
+    version = cached.pop(PROFILES_VERSION_KEY, None) or profiles_version()
+    cached = {
+        key: shared
+        for key, (shared_version, shared) in cached.items()
+        if shared_version == version
+    }
+    attach_comment_previews([twit for twit in twits if keys[twit.pk] not in cached])
+    rendered = {}
+    box_template = get_template("partials/_twit_box.html")
+    buttons_template = get_template("partials/_twit_owner_buttons.html")
+
+    boxes = []
+    for twit in twits:
+        key = keys[twit.pk]
+        shared = cached.get(key)
+        if shared is None:
+            shared = render_to_string("partials/_twit_box_shared.html", {"twit": twit})
+            rendered[key] = (version, shared)
+
+        buttons = ""
+        if viewer is None:
+            buttons = OWNER_BUTTONS_SLOT
+        elif twit.user_id == viewer.pk:
+            buttons = buttons_template.render({"twit": twit})
+        boxes.append(
+            box_template.render(
+                {
+                    "twit": twit,
+                    "shared": mark_safe(shared.replace(OWNER_BUTTONS_SLOT, buttons)),
+                }
+            )
+        )
+
+    if rendered:
+        cache.set_many(rendered, settings.TWEETER_FRAGMENT_CACHE_TIMEOUT)
+    return mark_safe("".join(boxes))
@@ -0,0 +1,401 @@
+"""Local caching proxy for the images linked from twits.
+
+Feeds used to embed twit.image_url directly, so every page pulled full-size
+originals from whatever host they were on. Now each image is fetched once,
+in the background after its twit is saved, and kept in a disk cache under
+the SHA-256 of its bytes. The digest is stored on the twit, and pages link
+to resized variants served from the cache by TwitImageView with long-lived
+cache headers. The cache drops its least recently used files once it grows
+past TWEETER_IMAGE_CACHE_MAX_MB.
+
+Resizing and WebP need Pillow. Without it the variants are the original
+bytes, still served from the local cache.
+"""
+import hashlib
+import http.client
+import ipaddress
+import logging
+import os
+import re
+import socket
+import ssl
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Twit
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger("tweeter.images")
+
+# Variant name to the format it is saved in, None keeping the original's
+VARIANTS = {"feed": None, "feed-webp": "WEBP"}
+
+# Leading bytes of the image formats that are served, SVG being left out
+# since it can carry scripts
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+# Images are cached under the hex SHA-256 of their bytes
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class ImageFetchError(Exception):
+    """The image could not be fetched or is not an image"""
+
+
+def is_digest(value):
+    """Whether a value is an image digest, and so safe in a cache path"""
+    return DIGEST_RE.fullmatch(value) is not None
+
+
+def sniff_content_type(data):
+    """Get the content type of image bytes, or None if not a served format"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, content_type in SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    return None
+
+
+def _check_address(host, address):
+    """Refuse an address that is not on the public internet"""
+    # Scoped IPv6 addresses end in %interface
+    if not ipaddress.ip_address(address.split("%")[0]).is_global:
+        raise ImageFetchError(f"{host} is not a public host")
+
+
+def connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, *args):
+    """Open a connection to a host, but only on a public address.
+
+    The host is resolved once and the connection goes to the address that
+    was checked, so the name cannot be rebound to a private one in between.
+    """
+    host, port = address
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as exc:
+        raise ImageFetchError(f"Cannot resolve {host}") from exc
+    for *_, sockaddr in addresses:
+        _check_address(host, sockaddr[0])
+    return socket.create_connection((addresses[0][4][0], port), timeout, *args)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to public addresses only"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection to public addresses only, still verifying the host"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    """Open http URLs with PublicHTTPConnection"""
+
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    """Open https URLs with PublicHTTPSConnection"""
+
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class PublicOnlyRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to http(s) URLs"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        HttpFetcher.check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class HttpFetcher:
+    """Fetch images over HTTP(S) from public addresses.
+
+    Every connection, redirects included, checks the addresses it connects
+    to. Proxies are not used, as they would hide the final address.
+    """
+
+    def __init__(self):
+        self.opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({}),
+            PublicHTTPHandler,
+            PublicHTTPSHandler(context=ssl.create_default_context()),
+            PublicOnlyRedirectHandler,
+        )
+
+    @staticmethod
+    def check_url(url):
+        """Refuse URLs that are not http(s) or name a private address"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ImageFetchError(f"Not an http(s) URL: {url}")
+        try:
+            ipaddress.ip_address(parts.hostname)
+        except ValueError:
+            # A name, checked once it is resolved for the connection
+            return
+        _check_address(parts.hostname, parts.hostname)
+
+    def fetch(self, url):
+        """Get the bytes at a URL, up to TWEETER_IMAGE_MAX_MB"""
+        self.check_url(url)
+        limit = settings.TWEETER_IMAGE_MAX_MB * 1024 * 1024
+        request = urllib.request.Request(url, headers={"User-Agent": "Tweeter"})
+        try:
+            with self.opener.open(
+                request, timeout=settings.TWEETER_IMAGE_FETCH_TIMEOUT
+            ) as response:
+                data = response.read(limit + 1)
+        except (URLError, OSError, ValueError) as exc:
+            raise ImageFetchError(f"Cannot fetch {url}: {exc}") from exc
+        if len(data) > limit:
+            raise ImageFetchError(f"{url} is over {settings.TWEETER_IMAGE_MAX_MB}MB")
+        return data
+
+
+@lru_cache(maxsize=None)
+def _load_fetcher(path):
+    return import_string(path)()
+
+
+def get_fetcher():
+    """Get the fetcher named by TWEETER_IMAGE_FETCHER"""
+    return _load_fetcher(settings.TWEETER_IMAGE_FETCHER)
+
+
+class ImageCache:
+    """Content-addressed files on disk, evicted least recently used first.
+
+    Reading a file bumps its modification time, which eviction sorts on.
+    The size of the cache is only checked once another 5% of its limit has
+    been written, rather than walking every file on each store.
+    """
+
+    # Bytes stored under each cache root since its size was last checked
+    _written = {}
+    _written_lock = threading.Lock()
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _check_name(digest, variant=None):
+        """Refuse names that are not a digest and a variant"""
+        if not is_digest(digest):
+            raise ValueError(f"Not an image digest: {digest!r}")
+        if variant is not None and variant not in VARIANTS:
+            raise ValueError(f"Not an image variant: {variant!r}")
+
+    def original_path(self, digest):
+        """Path of an original image"""
+        self._check_name(digest)
+        return self.root / "originals" / digest[:2] / digest
+
+    def variant_path(self, digest, variant):
+        """Path of a variant of an image"""
+        self._check_name(digest, variant)
+        return self.root / "variants" / digest[:2] / f"{digest}-{variant}"
+
+    def store(self, path, data):
+        """Write a file atomically, then evict if the cache may be too big"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(descriptor, "wb") as stream:
+            stream.write(data)
+        os.replace(temp_path, path)
+        if self._due_for_eviction(len(data)):
+            self.evict()
+
+    def _due_for_eviction(self, size):
+        """Count bytes stored and say whether the size should be checked"""
+        with self._written_lock:
+            written = self._written.get(self.root, 0) + size
+            due = written >= self.max_bytes * 0.05
+            self._written[self.root] = 0 if due else written
+        return due
+
+    def read(self, path):
+        """Read a file and mark it as recently used, or return None"""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self.touch(path)
+        return data
+
+    @staticmethod
+    def touch(path):
+        """Mark a file as recently used"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def files(self):
+        """Every cached file as (modified, size, path)"""
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = Path(directory) / name
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Drop the least recently used files until under 90% of the limit"""
+        files = sorted(self.files())
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+
+def get_cache():
+    """Get the image cache configured in settings"""
+    return ImageCache(
+        settings.TWEETER_IMAGE_CACHE_DIR,
+        settings.TWEETER_IMAGE_CACHE_MAX_MB * 1024 * 1024,
+    )
+
+
+def resize(data, variant):
+    """Shrink an original to TWEETER_IMAGE_WIDTH in the variant's format.
+
+    Animated GIFs, images Pillow cannot read and everything when Pillow
+    is missing are left as they are.
+    """
+    if Image is None or sniff_content_type(data) == "image/gif":
+        return data
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image_format = VARIANTS[variant] or image.format
+            image = ImageOps.exif_transpose(image)
+            width = settings.TWEETER_IMAGE_WIDTH
+            image.thumbnail((width, width * 4))
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = BytesIO()
+            image.save(output, image_format, quality=82, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning("Cannot resize an image: %s", exc)
+        return data
+    resized = output.getvalue()
+    return resized if len(resized) < len(data) or VARIANTS[variant] else data
+
+
+def variant_bytes(digest, variant):
+    """Get a variant from the cache, making it from the original if needed.
+
+    Returns None when neither the variant nor its original is cached.
+    """
+    cache = get_cache()
+    path = cache.variant_path(digest, variant)
+    data = cache.read(path)
+    if data is None:
+        original = cache.read(cache.original_path(digest))
+        if original is None:
+            return None
+        data = resize(original, variant)
+        cache.store(path, data)
+    return data
+
+
+def fetch_twit_image(pk):
+    """Fetch a twit's image into the cache and record its digest.
+
+    Returns the digest, or None when the image could not be fetched.
+    """
+    url = Twit.objects.filter(pk=pk).values_list("image_url", flat=True).first()
+    if not url:
+        return None
+    try:
+        data = get_fetcher().fetch(url)
+    except ImageFetchError as exc:
+        logger.warning("Twit %s: %s", pk, exc)
+        return None
+    if sniff_content_type(data) is None:
+        logger.warning("Twit %s: %s is not a JPEG, PNG, GIF or WebP", pk, url)
+        return None
+
+    digest = hashlib.sha256(data).hexdigest()
+    cache = get_cache()
+    path = cache.original_path(digest)
+    if path.exists():
+        cache.touch(path)
+    else:
+        cache.store(path, data)
+    for variant in VARIANTS:
+        variant_bytes(digest, variant)
+    # The twit may have been given another image in the meantime
+    Twit.objects.filter(pk=pk, image_url=url).update(image_digest=digest)
+    return digest
+
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="twit-images")
+
+
+def _fetch_in_background(pk):
+    """Fetch a twit's image on an executor thread"""
+    try:
+        fetch_twit_image(pk)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Twit %s: fetching the image failed", pk)
+    finally:
+        connection.close()
+
+
+def queue_twit_image_fetch(pk):
+    """Fetch a twit's image after commit, in the background unless disabled"""
+    if settings.TWEETER_IMAGE_FETCH_IN_BACKGROUND:
+        transaction.on_commit(lambda: _executor.submit(_fetch_in_background, pk))
+    else:
+        transaction.on_commit(lambda: fetch_twit_image(pk))
+
+
+def fetch_twit_image_later(twit):
+    """Forget a twit's cached image and fetch its image after commit"""
+    if twit.image_digest:
+        Twit.objects.filter(pk=twit.pk).update(image_digest="")
+        twit.image_digest = ""
+    if twit.image_url:
+        queue_twit_image_fetch(twit.pk)
@@ -0,0 +1,304 @@
+"""Write-behind buffer for likes, used when TWEETER_LIKE_BUFFER is on.
+
+Likes are appended to an event log in the cache together with a pending
+per-twit delta, and flush_like_buffer later applies them in bulk. The web
+processes and the single flusher must share one cache with signed incr,
+such as Redis or the database cache.
+
+The log and the pending state belong to an epoch. Once the sequence or an
+event of an epoch is evicted, its pending deltas can never be taken back,
+so the next epoch is started: readers stop adding the old deltas and the
+flusher writes whatever is left of the old log. Likes whose events were
+lost are dropped rather than counted forever.
+"""
+import time
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from .models import Twit, UserStats
+
+EPOCH_KEY = "likes:epoch"
+FLUSHED_KEY = "likes:flushed"
+STALLED_KEY = "likes:stalled"
+# Seconds a request may hold the lock on one user's like of one twit
+LOCK_TIMEOUT = 5
+
+
+def _sequence_key(epoch):
+    return f"likes:{epoch}:sequence"
+
+
+def _next_key(epoch):
+    return f"likes:{epoch}:next"
+
+
+def _event_key(epoch, seq):
+    return f"likes:{epoch}:event:{seq}"
+
+
+def _state_key(epoch, twit_id, user_id):
+    return f"likes:{epoch}:state:{twit_id}:{user_id}"
+
+
+def _delta_key(epoch, twit_id):
+    return f"likes:{epoch}:delta:{twit_id}"
+
+
+def _lock_key(twit_id, user_id):
+    return f"likes:lock:{twit_id}:{user_id}"
+
+
+def _add(key, delta):
+    """Atomically add to a counter in the cache, creating it if needed"""
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key, delta)
+
+
+def _through_filter(twit_id, user_id):
+    """Lookup kwargs for one row of the likes through-table"""
+    return {
+        f"{Twit.likes.field.m2m_field_name()}_id": twit_id,
+        f"{Twit.likes.field.m2m_reverse_field_name()}_id": user_id,
+    }
+
+
+def _new_epoch():
+    """Create an epoch with an empty log"""
+    epoch = time.time_ns()
+    cache.add(_sequence_key(epoch), 0, timeout=None)
+    return epoch
+
+
+def current_epoch():
+    """Get the epoch likes are buffered in, starting one if there is none"""
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        epoch = _new_epoch()
+        if cache.add(EPOCH_KEY, epoch, timeout=None):
+            # The flusher starts here unless an older epoch is left
+            cache.add(FLUSHED_KEY, (epoch, 0), timeout=None)
+        else:
+            epoch = cache.get(EPOCH_KEY, epoch)
+    return epoch
+
+
+def _retire(epoch):
+    """Start the epoch after one whose log lost entries and return it"""
+    following = _new_epoch()
+    if not cache.add(_next_key(epoch), following, timeout=None):
+        # Another process retired it first
+        following = cache.get(_next_key(epoch), following)
+    if cache.get(EPOCH_KEY) in (epoch, None):
+        cache.set(EPOCH_KEY, following, timeout=None)
+    return following
+
+
+def _lock(key):
+    """Take a short lock with cache.add, waiting a little for its holder"""
+    for _ in range(50):
+        if cache.add(key, True, LOCK_TIMEOUT):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def buffer_like(twit_id, user_id, liked):
+    """Buffer a like or unlike and return the like count readers will see.
+
+    Changes to one user's like of one twit are made under a lock, so a
+    double click is buffered once. Raises Twit.DoesNotExist for an unknown
+    twit.
+    """
+    like_count = (
+        Twit.objects.filter(pk=twit_id).values_list("like_count", flat=True).first()
+    )
+    if like_count is None:
+        raise Twit.DoesNotExist(f"No twit with id {twit_id}")
+
+    lock_key = _lock_key(twit_id, user_id)
+    if not _lock(lock_key):
+        # Left to the request holding the lock
+        return like_count + cache.get(_delta_key(current_epoch(), twit_id), 0)
+    try:
+        return like_count + _buffer_change(current_epoch(), twit_id, user_id, liked)
+    finally:
+        cache.delete(lock_key)
+
+
+def _buffer_change(epoch, twit_id, user_id, liked):
+    """Log a change of a like in an epoch and return the pending delta"""
+    state_key = _state_key(epoch, twit_id, user_id)
+    current = cache.get(state_key)
+    if current is None:
+        current = Twit.likes.through.objects.filter(
+            **_through_filter(twit_id, user_id)
+        ).exists()
+    if liked == current:
+        return cache.get(_delta_key(epoch, twit_id), 0)
+
+    try:
+        seq = cache.incr(_sequence_key(epoch))
+    except ValueError:
+        # The sequence was evicted, so nothing logged now would be flushed
+        return _buffer_change(_retire(epoch), twit_id, user_id, liked)
+    delta = 1 if liked else -1
+    timeout = settings.TWEETER_LIKE_BUFFER_TIMEOUT
+    cache.set(state_key, liked, timeout)
+    cache.set(_event_key(epoch, seq), (twit_id, user_id, liked, delta), timeout)
+    return _add(_delta_key(epoch, twit_id), delta)
+
+
+def apply_pending(twits, viewer):
+    """Add buffered likes to the counts and liked flags of loaded twits"""
+    epoch = current_epoch()
+    delta_keys = {twit.pk: _delta_key(epoch, twit.pk) for twit in twits}
+    state_keys = {}
+    if viewer is not None and viewer.is_authenticated:
+        state_keys = {twit.pk: _state_key(epoch, twit.pk, viewer.pk) for twit in twits}
+
+    pending = cache.get_many([*delta_keys.values(), *state_keys.values()])
+    for twit in twits:
+        twit.like_count += pending.get(delta_keys[twit.pk], 0)
+        if twit.pk in state_keys and state_keys[twit.pk] in pending:
+            twit.viewer_liked = pending[state_keys[twit.pk]]
+
+
+def _apply(epoch, states, deltas):
+    """Write the final (twit, user) -> liked states to the database.
+
+    Only rows that really change are counted, with per-twit and per-author
+    deltas. The pending deltas of the events are taken back as the last
+    step of the transaction, and put back if it fails.
+    """
+    through = Twit.likes.through
+    twit_field = Twit.likes.field.m2m_field_name()
+    user_field = Twit.likes.field.m2m_reverse_field_name()
+    taken_back = False
+    try:
+        with transaction.atomic():
+            existing = set(
+                through.objects.filter(
+                    reduce(or_, (Q(**_through_filter(t, u)) for t, u in states))
+                ).values_list(f"{twit_field}_id", f"{user_field}_id")
+            )
+            likes = [
+                key for key, liked in states.items() if liked and key not in existing
+            ]
+            unlikes = [
+                key for key, liked in states.items() if not liked and key in existing
+            ]
+            through.objects.bulk_create(
+                [
+                    through(**{f"{twit_field}_id": t, f"{user_field}_id": u})
+                    for t, u in likes
+                ],
+                ignore_conflicts=True,
+            )
+            if unlikes:
+                through.objects.filter(
+                    reduce(or_, (Q(**_through_filter(t, u)) for t, u in unlikes))
+                ).delete()
+
+            changes = Counter(t for t, _ in likes)
+            changes.subtract(t for t, _ in unlikes)
+            by_change = {}
+            for twit_id, change in changes.items():
+                if change:
+                    by_change.setdefault(change, []).append(twit_id)
+            for change, twit_ids in by_change.items():
+                Twit.objects.filter(pk__in=twit_ids).update(
+                    like_count=Greatest(F("like_count") + change, 0)
+                )
+            UserStats.objects.add_likes_received(changes)
+            UserStats.objects.record_activity({u for _, u in states})
+
+            for twit_id, delta in deltas.items():
+                _add(_delta_key(epoch, twit_id), -delta)
+            taken_back = True
+    except Exception:
+        if taken_back:
+            for twit_id, delta in deltas.items():
+                _add(_delta_key(epoch, twit_id), delta)
+        raise
+
+
+def _flush_epoch(epoch, start, batch_size):
+    """Apply the events of an epoch logged after sequence number start.
+
+    Returns the number of events applied, the sequence number reached and
+    whether the epoch is over and its log has been written.
+    """
+    applied = 0
+    while True:
+        retired = cache.get(EPOCH_KEY) != epoch
+        last = cache.get(_sequence_key(epoch))
+        if last is None and not retired:
+            _retire(epoch)
+            retired = True
+        # Without a sequence the log is read until a batch finds nothing
+        end_of_batch = (
+            start + batch_size if last is None else min(start + batch_size, last)
+        )
+        seqs = range(start + 1, end_of_batch + 1)
+        if not seqs:
+            return applied, start, retired
+        events = cache.get_many([_event_key(epoch, seq) for seq in seqs])
+        if last is None and not events:
+            return applied, start, True
+
+        states = {}
+        deltas = Counter()
+        end = start
+        for seq in seqs:
+            event = events.get(_event_key(epoch, seq))
+            if event is None and not retired:
+                # The event may still be being written. Wait one flush for
+                # it before treating it as lost.
+                if cache.get(STALLED_KEY) != (epoch, seq):
+                    cache.set(STALLED_KEY, (epoch, seq), None)
+                    break
+                _retire(epoch)
+                retired = True
+            elif event is not None:
+                twit_id, user_id, liked, delta = event
+                states[(twit_id, user_id)] = liked
+                deltas[twit_id] += delta
+                applied += 1
+            end = seq
+
+        if states:
+            _apply(epoch, states, deltas)
+        cache.set(FLUSHED_KEY, (epoch, end), None)
+        cache.delete_many([_event_key(epoch, seq) for seq in range(start + 1, end + 1)])
+
+        if end < seqs[-1]:
+            return applied, end, False
+        start = end
+
+
+def flush(batch_size=1000):
+    """Apply buffered like events to the database.
+
+    Epochs are written in order, so a retired epoch is finished before the
+    next one. Returns the number of events applied.
+    """
+    epoch, start = cache.get(FLUSHED_KEY) or (current_epoch(), 0)
+    applied = 0
+
+    while True:
+        count, start, finished = _flush_epoch(epoch, start, batch_size)
+        applied += count
+        if not finished:
+            break
+        following = cache.get(_next_key(epoch)) or current_epoch()
+        cache.delete_many([_sequence_key(epoch), _next_key(epoch)])
+        epoch, start = following, 0
+        cache.set(FLUSHED_KEY, (epoch, start), None)
+    return applied
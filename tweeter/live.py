@@ -0,0 +1,275 @@
+"""Live updates of open feeds, pushed as Server-Sent Events.
+
+The create, comment and like code paths publish small events to a broker
+once their transaction commits: new twits with their rendered box, new
+comments with their rendered row and changed like counts. LiveEventsApp is
+a plain ASGI app, mounted beside Django in django_project.asgi, that holds
+one stream per open feed and writes the events to it.
+
+The broker is chosen with TWEETER_LIVE_BROKER. LocalBroker only reaches
+streams held by the same process, so it suits a single ASGI worker. A
+shared broker has to offer the same publish, subscribe and unsubscribe.
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from functools import lru_cache, partial
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, transaction
+from django.http import parse_cookie
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .fragments import render_twit_boxes
+from .models import Twit
+
+
+class Subscription:
+    """Events waiting to be written to one stream"""
+
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+
+    def deliver(self, event):
+        """Queue an event, run on the subscriber's event loop.
+
+        A stream that falls too far behind gets None instead, which closes
+        it. The browser reconnects and catches up from the broker history.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class LocalBroker:
+    """Hand events to the streams held by this process.
+
+    Events get increasing ids and the latest TWEETER_LIVE_HISTORY of them
+    are kept, so a reconnecting stream can be sent what it missed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.history = deque(maxlen=settings.TWEETER_LIVE_HISTORY)
+        self.subscriptions = set()
+
+    def publish(self, kind, data):
+        """Send an event to every subscriber, from any thread"""
+        with self.lock:
+            self.last_id += 1
+            event = (self.last_id, kind, json.dumps(data))
+            self.history.append(event)
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The loop of the stream has closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, after=None):
+        """Subscribe the running event loop.
+
+        Returns the subscription and the events after the id `after` that
+        are still in the history.
+        """
+        subscription = Subscription(
+            asyncio.get_running_loop(), settings.TWEETER_LIVE_QUEUE_SIZE
+        )
+        with self.lock:
+            self.subscriptions.add(subscription)
+            missed = [] if after is None else [e for e in self.history if e[0] > after]
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        """Stop sending events to a subscription"""
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+@lru_cache(maxsize=None)
+def _load_broker(path):
+    return import_string(path)()
+
+
+def get_broker():
+    """Get the broker named by TWEETER_LIVE_BROKER"""
+    return _load_broker(settings.TWEETER_LIVE_BROKER)
+
+
+def publish_on_commit(render):
+    """Render and publish an event once the current transaction commits"""
+    if settings.TWEETER_LIVE_UPDATES:
+        transaction.on_commit(lambda: get_broker().publish(*render()))
+
+
+def _twit_event(pk):
+    """A new twit, with its box as anyone but its author sees it"""
+    twit = Twit.objects.for_feed().get(pk=pk)
+    return "twit", {
+        "id": twit.pk,
+        "user": twit.user_id,
+        "html": render_twit_boxes([twit], None),
+        "owner_buttons": render_to_string(
+            "partials/_twit_owner_buttons.html", {"twit": twit}
+        ),
+    }
+
+
+def _comment_event(comment):
+    """A new comment, with its row and the comment count of its twit"""
+    comment_count = (
+        Twit.objects.filter(pk=comment.twit_id)
+        .values_list("comment_count", flat=True)
+        .get()
+    )
+    return "comment", {
+        "id": comment.pk,
+        "twit": comment.twit_id,
+        "html": render_to_string("partials/_comment.html", {"comments": [comment]}),
+        "comment_count": comment_count,
+    }
+
+
+def twit_created(twit):
+    """Push a new twit to open feeds"""
+    publish_on_commit(partial(_twit_event, twit.pk))
+
+
+def comment_created(comment):
+    """Push a new comment to open feeds"""
+    publish_on_commit(partial(_comment_event, comment))
+
+
+def like_count_changed(twit_id, like_count):
+    """Push the new like count of a twit to open feeds"""
+    publish_on_commit(lambda: ("like", {"twit": twit_id, "like_count": like_count}))
+
+
+class LiveUpdatesMixin:
+    """Have a feed page follow the live event stream.
+
+    New twits are only added on top of the newest page, and only when
+    live_new_twits is set, as feeds showing a selection of twits leave it
+    off to get just comments and like counts.
+    """
+
+    live_new_twits = False
+
+    def get_context_data(self, **kwargs):
+        """Add the stream url and whether to add new twits"""
+        context = super().get_context_data(**kwargs)
+        if settings.TWEETER_LIVE_UPDATES:
+            context["live_url"] = reverse("twit_live")
+            context["live_new_twits"] = (
+                self.live_new_twits and not context["page_obj"].has_newer
+            )
+        return context
+
+
+def _scope_user(scope):
+    """Load the user of the session cookie sent with a request"""
+    try:
+        cookies = {}
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                cookies.update(parse_cookie(value.decode("latin-1")))
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+        return get_user(SimpleNamespace(session=session))
+    finally:
+        close_old_connections()
+
+
+def format_event(event):
+    """Encode an (id, kind, data) event as Server-Sent Events"""
+    event_id, kind, data = event
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n".encode("utf-8")
+
+
+class LiveEventsApp:
+    """ASGI app streaming live events to logged in users"""
+
+    @property
+    def path(self):
+        """Path the stream is served at"""
+        return reverse("twit_live")
+
+    async def __call__(self, scope, receive, send):
+        """Stream events until the client goes away"""
+        user = await sync_to_async(_scope_user)(scope)
+        if not user.is_authenticated:
+            await send({"type": "http.response.start", "status": 403, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        headers = dict(scope["headers"])
+        after = headers.get(b"last-event-id", b"").decode("latin-1")
+        broker = get_broker()
+        subscription, missed = broker.subscribe(int(after) if after.isdigit() else None)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no"),
+                    ],
+                }
+            )
+            await self.send_body(send, b"retry: 3000\n\n")
+            for event in missed:
+                await self.send_body(send, format_event(event))
+            await self.stream(subscription, receive, send)
+        finally:
+            broker.unsubscribe(subscription)
+
+    async def stream(self, subscription, receive, send):
+        """Write queued events, with keep-alive comments in between"""
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            while True:
+                event = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {event, disconnected},
+                    timeout=settings.TWEETER_LIVE_KEEPALIVE,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if event not in done:
+                    event.cancel()
+                    if disconnected in done:
+                        return
+                    await self.send_body(send, b": keep-alive\n\n")
+                elif event.result() is None:
+                    # Fell behind, let the browser reconnect and catch up
+                    return
+                else:
+                    await self.send_body(send, format_event(event.result()))
+        finally:
+            disconnected.cancel()
+            await self.send_body(send, b"", more_body=False)
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        """Wait until the client closes the connection"""
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def send_body(send, body, more_body=True):
+        """Send part of the response body"""
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
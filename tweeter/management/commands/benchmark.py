@@ -0,0 +1,289 @@
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+
+from tweeter.models import Twit
+from tweeter.pagination import KeysetPaginator
+
+# Apps whose routes should all be benchmarked
+BENCHMARKED_URLCONFS = ("tweeter.urls", "accounts.urls")
+
+
+class Command(BaseCommand):
+    """Benchmark the routes of the site against the current database"""
+
+    help = (
+        "Request every tweeter and accounts route through the test client "
+        "as one user, and report p50/p95/p99 latency, queries per request "
+        "and peak memory per route. Writes are rolled back afterwards. "
+        "Seed a database with seed_data first."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=50,
+            help="Timed requests per route.",
+        )
+        parser.add_argument(
+            "--user",
+            default=None,
+            help="Username to browse as, by default the one following most users.",
+        )
+        parser.add_argument(
+            "--output",
+            default="benchmark.json",
+            help="File the results are written to.",
+        )
+        parser.add_argument(
+            "--compare",
+            default=None,
+            help="Earlier results file to compare with.",
+        )
+
+    def handle(self, *args, **options):
+        """Run the benchmark in a transaction that is rolled back"""
+        if options["requests"] < 2:
+            raise CommandError("--requests must be at least 2")
+
+        with transaction.atomic():
+            user = self.get_user(options["user"])
+            client = Client(SERVER_NAME="localhost")
+            client.force_login(user)
+
+            meta = self.meta(options["requests"], user)
+            routes = self.routes(user)
+            results = {}
+            for name, method, url, data in routes:
+                results[name] = self.measure(
+                    client, method, url, data, options["requests"]
+                )
+                self.stdout.write(self.format_row(name, results[name]))
+            transaction.set_rollback(True)
+
+        covered = {name.split()[0] for name, *_ in routes}
+        missing = sorted(self.route_names() - covered)
+        if missing:
+            self.stdout.write(f"Not benchmarked: {', '.join(missing)}")
+
+        with open(options["output"], "w", encoding="utf-8") as stream:
+            json.dump({"meta": meta, "routes": results}, stream, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as stream:
+                self.compare(json.load(stream)["routes"], results)
+
+    @staticmethod
+    def get_user(username):
+        """Get the user the benchmark browses as"""
+        users = get_user_model().objects
+        if username:
+            try:
+                return users.get(username=username)
+            except users.model.DoesNotExist as exc:
+                raise CommandError(f"No user named {username}") from exc
+        user = (
+            users.annotate(following_total=Count("following_links"))
+            .order_by("-following_total", "pk")
+            .first()
+        )
+        if user is None:
+            raise CommandError("There are no users, run seed_data first")
+        return user
+
+    @staticmethod
+    def route_names():
+        """Names of every route in the benchmarked url confs"""
+        return {
+            pattern.name
+            for urlconf in BENCHMARKED_URLCONFS
+            for pattern in get_resolver(urlconf).url_patterns
+            if isinstance(pattern, URLPattern) and pattern.name
+        }
+
+    @staticmethod
+    def routes(user):
+        """Get (name, method, url, data) for every request benchmarked.
+
+        Names start with the url name, so coverage can be checked.
+        """
+        own = Twit.objects.filter(user=user).order_by("-comment_count").first()
+        if own is None:
+            own = Twit.objects.create(user=user, body="Benchmark twit")
+        busy = Twit.objects.order_by("-comment_count", "-like_count").first()
+        popular = (
+            get_user_model()
+            .objects.exclude(pk=user.pk)
+            .order_by("-follower_count")
+            .first()
+        ) or user
+        older = KeysetPaginator(20).page(Twit.objects.all()).older_cursor or ""
+        # Images are only served once fetched with fetch_twit_images
+        pictured = Twit.objects.exclude(image_digest="").first() or own
+
+        return [
+            ("twit_list", "get", reverse("twit_list"), None),
+            (
+                "twit_list older page",
+                "get",
+                f"{reverse('twit_list')}?older={older}",
+                None,
+            ),
+            ("home_timeline", "get", reverse("home_timeline"), None),
+            ("twit_live", "get", reverse("twit_live"), None),
+            ("twit_search", "get", f"{reverse('twit_search')}?q=coffee+code", None),
+            ("twit_new", "get", reverse("twit_new"), None),
+            ("twit_new post", "post", reverse("twit_new"), {"body": "Benchmark"}),
+            ("twit_edit", "get", reverse("twit_edit", args=[own.pk]), None),
+            (
+                "twit_edit post",
+                "post",
+                reverse("twit_edit", args=[own.pk]),
+                {"body": own.body, "image_url": own.image_url},
+            ),
+            ("twit_delete", "get", reverse("twit_delete", args=[own.pk]), None),
+            ("comment_new", "get", reverse("comment_new", args=[busy.pk]), None),
+            (
+                "comment_new post",
+                "post",
+                reverse("comment_new", args=[busy.pk]),
+                {"text": "Benchmark comment"},
+            ),
+            ("twit_comments", "get", reverse("twit_comments", args=[busy.pk]), None),
+            (
+                "twit_image",
+                "get",
+                f"{reverse('twit_image', args=[pictured.pk, 'feed'])}"
+                f"?v={pictured.image_digest}",
+                None,
+            ),
+            (
+                "twit_like",
+                "post",
+                reverse("twit_like", args=[busy.pk]),
+                {"twit_action": "like"},
+            ),
+            ("twit_export", "get", f"{reverse('twit_export')}?user={user.pk}", None),
+            (
+                "comment_export",
+                "get",
+                f"{reverse('comment_export')}?twit={busy.pk}",
+                None,
+            ),
+            ("profile", "get", reverse("profile", args=[user.pk]), None),
+            (
+                "public_profile",
+                "get",
+                reverse("public_profile", args=[popular.pk]),
+                None,
+            ),
+            (
+                "follow",
+                "post",
+                reverse("follow", args=[popular.pk]),
+                {"action": "follow"},
+            ),
+            ("signup", "get", reverse("signup"), None),
+        ]
+
+    @staticmethod
+    def request(client, method, url, data):
+        """Make one request and read the whole response"""
+        response = getattr(client, method)(url, data)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response
+
+    def measure(self, client, method, url, data, count):
+        """Time `count` requests after one counting queries and memory"""
+        # The query log is reset on every request, so count with a wrapper
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            tracemalloc.start()
+            response = self.request(client, method, url, data)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            self.request(client, method, url, data)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        cuts = statistics.quantiles(timings, n=100, method="inclusive")
+        return {
+            "status": response.status_code,
+            "p50_ms": round(cuts[49], 3),
+            "p95_ms": round(cuts[94], 3),
+            "p99_ms": round(cuts[98], 3),
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "queries": len(queries),
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+
+    @staticmethod
+    def meta(requests, user):
+        """Describe what the results were measured against"""
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "measured_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "users": get_user_model().objects.count(),
+            "twits": Twit.objects.count(),
+            "user": user.username,
+            "requests": requests,
+        }
+
+    @staticmethod
+    def format_row(name, result):
+        """One line of results"""
+        return (
+            f"{name:<24} {result['status']:>3} "
+            f"p50 {result['p50_ms']:>8.2f}ms p95 {result['p95_ms']:>8.2f}ms "
+            f"p99 {result['p99_ms']:>8.2f}ms {result['queries']:>4} queries "
+            f"{result['peak_memory_kb']:>9.1f}KB"
+        )
+
+    def compare(self, before, after):
+        """Print the change of every route against earlier results"""
+        self.stdout.write("Compared with the earlier results:")
+        for name, result in after.items():
+            if name not in before:
+                continue
+            old = before[name]
+            changes = [
+                f"{key[:3]} {(result[key] - old[key]) / old[key]:+.0%}"
+                for key in ("p50_ms", "p95_ms", "p99_ms")
+                if old[key]
+            ]
+            changes.append(f"queries {result['queries'] - old['queries']:+d}")
+            self.stdout.write(f"{name:<24} {' '.join(changes)}")
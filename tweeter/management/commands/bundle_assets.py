@@ -0,0 +1,74 @@
+import json
+import urllib.request
+from pathlib import Path
+from urllib.error import URLError
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+
+from tweeter.assets import BUNDLES, VENDOR, build_bundle, bundle_path, integrity
+
+
+class Command(BaseCommand):
+    """Vendor the front-end libraries and build the asset bundles"""
+
+    help = (
+        "Download the vendor files missing from static/vendor, check them "
+        "against their integrity hashes and concatenate the bundles into "
+        "static/dist. Run by bin/post_compile before collectstatic."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="Only use vendor files that are already downloaded.",
+        )
+
+    def handle(self, *args, **options):
+        """Vendor the files, then build every bundle"""
+        static_dir = Path(settings.STATICFILES_DIRS[0])
+        lock_path = static_dir / "vendor" / "integrity.json"
+        lock = json.loads(lock_path.read_text()) if lock_path.exists() else {}
+
+        for path, (url, expected) in VENDOR.items():
+            target = static_dir / path
+            if target.exists():
+                data = target.read_bytes()
+            elif options["offline"]:
+                raise CommandError(f"{path} has not been downloaded yet")
+            else:
+                data = self.download(url)
+            expected = expected or lock.get(path)
+            if expected and integrity(data) != expected:
+                raise CommandError(f"{path} does not match its integrity hash")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            lock[path] = integrity(data)
+        lock_path.write_text(json.dumps(lock, indent=2, sort_keys=True) + "\n")
+
+        for name in BUNDLES:
+            target = static_dir / bundle_path(name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(build_bundle(name, self.read))
+            self.stdout.write(f"Built {bundle_path(name)}")
+        self.stdout.write(self.style.SUCCESS(f"Built {len(BUNDLES)} bundles."))
+
+    def download(self, url):
+        """Download a vendor file"""
+        self.stdout.write(f"Downloading {url}")
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                return response.read()
+        except (URLError, OSError) as exc:
+            raise CommandError(f"Cannot download {url}: {exc}") from exc
+
+    @staticmethod
+    def read(path):
+        """Read a static file from wherever the finders find it"""
+        found = finders.find(path)
+        if found is None:
+            raise CommandError(f"Cannot find the static file {path}")
+        return Path(found).read_bytes()
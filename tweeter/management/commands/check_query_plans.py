@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tweeter.models import Comment, Twit
+from tweeter.pagination import KeysetPaginator, encode_cursor
+
+
+class Command(BaseCommand):
+    """Check the feed, profile and comment queries use their indexes"""
+
+    help = (
+        "EXPLAIN the queries behind the feed, profile, comment and liked "
+        "twit pages and fail if a plan does not use the index made for it."
+    )
+
+    def plans(self):
+        """Get (name, index, queryset) for every access path checked"""
+        viewer = get_user_model()(pk=1)
+        paginator = KeysetPaginator(20)
+        cursor = encode_cursor(timezone.now(), 1)
+        feed = Twit.objects.for_feed(viewer)
+        comments = Comment.objects.filter(twit_id=1).select_related("user")
+        likes = Twit.likes.through.objects
+
+        # pylint: disable=protected-access
+        return [
+            ("feed", "twit_created_idx", paginator._page_query(feed, None, None)),
+            (
+                "feed older page",
+                "twit_created_idx",
+                paginator._page_query(feed, cursor, None),
+            ),
+            ("profile", "twit_user_created_idx", feed.filter(user=viewer)),
+            (
+                "comments",
+                "comment_twit_created_idx",
+                paginator._page_query(comments, cursor, None),
+            ),
+            (
+                "liked twits",
+                "twit_likes_user_twit_idx",
+                likes.filter(customuser=viewer).values("twit"),
+            ),
+        ]
+
+    def handle(self, *args, **options):
+        """Explain every query and compare the plans"""
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # Small tables are cheaper to scan, so make the planner show
+                # the plan it would pick once they have grown
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for name, index, queryset in self.plans():
+                plan = queryset.explain()
+                if index in plan:
+                    self.stdout.write(f"{name}: uses {index}")
+                else:
+                    failures.append(name)
+                    self.stdout.write(f"{name}: does not use {index}\n{plan}")
+
+        if failures:
+            raise CommandError(f"Index not used by: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("All query plans use their indexes."))
@@ -0,0 +1,40 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tweeter.transfer import ExportEncoder, export_rows
+
+
+class Command(BaseCommand):
+    """Export users, twits, comments and likes as JSON lines"""
+
+    help = (
+        "Stream every user, twit, comment and like out as one JSON object "
+        "per line, readable by import_jsonl. Rows are read through "
+        "server-side cursors, so memory use does not grow with the data."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default="-",
+            help="File to write to, or - for standard output.",
+        )
+
+    def handle(self, *args, **options):
+        """Write the rows of every model in import order"""
+        if options["path"] == "-":
+            self.export(self.stdout)
+        else:
+            with open(options["path"], "w", encoding="utf-8") as stream:
+                self.export(stream)
+
+    def export(self, stream):
+        """Write one line per row to stream"""
+        for model, rows in export_rows():
+            for row in rows.iterator(chunk_size=settings.TWEETER_EXPORT_CHUNK_SIZE):
+                line = json.dumps({"model": model, **row}, cls=ExportEncoder)
+                stream.write(line + "\n")
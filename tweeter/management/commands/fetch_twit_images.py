@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from tweeter.images import fetch_twit_image, get_cache
+from tweeter.models import Twit
+
+
+class Command(BaseCommand):
+    """Fetch twit images into the local image cache"""
+
+    help = (
+        "Fetch the images of twits that do not have one cached yet, such as "
+        "imported or seeded twits, then trim the cache to its size limit."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Refetch every twit image, not just the missing ones.",
+        )
+
+    def handle(self, *args, **options):
+        """Fetch the images one at a time"""
+        twits = Twit.objects.exclude(image_url="")
+        if not options["all"]:
+            twits = twits.filter(image_digest="")
+        fetched = failed = 0
+        for pk in twits.values_list("pk", flat=True).iterator():
+            if fetch_twit_image(pk):
+                fetched += 1
+            else:
+                failed += 1
+        removed = get_cache().evict()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Fetched {fetched} images, {failed} failed, "
+                f"evicted {removed} cached files."
+            )
+        )
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tweeter.likebuffer import flush
+
+
+class Command(BaseCommand):
+    """Flush buffered likes to the database"""
+
+    help = (
+        "Apply the likes buffered while TWEETER_LIKE_BUFFER is on. Run it "
+        "with --interval to keep flushing in the background."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Keep running, flushing every this many seconds.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of buffered events applied per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        """Flush once, or forever with --interval"""
+        while True:
+            applied = flush(batch_size=options["batch_size"])
+            if applied or options["interval"] is None:
+                self.stdout.write(f"Flushed {applied} like events.")
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
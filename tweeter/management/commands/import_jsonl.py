@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tweeter.transfer import Checkpoint, Importer
+
+
+class Command(BaseCommand):
+    """Import users, twits, comments and likes from JSON lines"""
+
+    help = (
+        "Load a file written by export_jsonl in batches. Rows get new ids, "
+        "and the id map and progress are kept in a checkpoint file, so "
+        "running the command again after a failure resumes the import."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument("path", help="File written by export_jsonl.")
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Checkpoint file, by default the path plus .checkpoint.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows inserted per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        """Import the file from the last checkpoint onwards"""
+        checkpoint = Checkpoint(
+            options["checkpoint"] or f"{options['path']}.checkpoint"
+        )
+        importer = Importer(checkpoint)
+        imported = 0
+        try:
+            importer.resume()
+            with open(options["path"], "rb") as stream:
+                offset = checkpoint.offset
+                stream.seek(offset)
+                model, batch = None, []
+                for line in stream:
+                    record = json.loads(line) if line.strip() else None
+                    if batch and (
+                        record is None
+                        or record["model"] != model
+                        or len(batch) >= options["batch_size"]
+                    ):
+                        importer.load(model, batch, offset)
+                        imported += len(batch)
+                        batch = []
+                    if record is not None:
+                        model = record["model"]
+                        batch.append(record)
+                    offset += len(line)
+                if batch:
+                    importer.load(model, batch, offset)
+                    imported += len(batch)
+        finally:
+            checkpoint.close()
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} rows."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from tweeter.search import get_backend
+
+
+class Command(BaseCommand):
+    """Rebuild the full-text search index"""
+
+    help = (
+        "Rebuild the search document of every twit from its body and "
+        "comments, for rows changed outside the views such as in admin."
+    )
+
+    def handle(self, *args, **options):
+        """Reindex every twit in one transaction"""
+        with transaction.atomic(), connection.cursor() as cursor:
+            get_backend().index(cursor)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the search index."))
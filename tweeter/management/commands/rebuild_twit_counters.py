@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from tweeter.models import Twit
+
+
+class Command(BaseCommand):
+    """Rebuild Twit.like_count and Twit.comment_count"""
+
+    help = (
+        "Recount the likes and comments of every twit from the likes "
+        "through-table and the Comment rows."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of twits recounted per UPDATE statement.",
+        )
+
+    def handle(self, *args, **options):
+        """Recount the twits in primary key batches"""
+        batch_size = options["batch_size"]
+        ids = Twit.objects.order_by("pk").values_list("pk", flat=True)
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            total += Twit.objects.filter(
+                pk__gte=batch[0], pk__lte=batch[-1]
+            ).refresh_counters()
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Recounted {total} twits."))
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from tweeter.models import UserStats
+
+
+class Command(BaseCommand):
+    """Rebuild the per-user stats shown in profile headers"""
+
+    help = (
+        "Create missing UserStats rows and recount every user's twits, "
+        "comments, likes received and last activity."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of users recounted per UPDATE statement.",
+        )
+
+    def handle(self, *args, **options):
+        """Recount the users in primary key batches"""
+        batch_size = options["batch_size"]
+        ids = get_user_model().objects.order_by("pk").values_list("pk", flat=True)
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            UserStats.objects.bulk_create(
+                [UserStats(user_id=pk) for pk in batch], ignore_conflicts=True
+            )
+            total += UserStats.objects.filter(
+                user_id__gte=batch[0], user_id__lte=batch[-1]
+            ).refresh(
+                fields=(
+                    "twit_count",
+                    "comment_count",
+                    "likes_received",
+                    "last_active_at",
+                )
+            )
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Recounted {total} users."))
@@ -0,0 +1,234 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import Follow, gravatar_hash
+from tweeter.models import Comment, Twit, UserStats
+from tweeter.search import get_backend
+from tweeter.transfer import bulk_create_with_timestamps
+
+WORDS = (
+    "coffee morning code deploy python django feed garden music weekend "
+    "release bug fix test review train city rain sun lunch book movie "
+    "game team launch idea design cache query index page like"
+).split()
+
+
+class Command(BaseCommand):
+    """Seed the database with a synthetic, realistically skewed data set"""
+
+    help = (
+        "Create users, twits, comments, likes and follows whose sizes follow "
+        "power laws: a few authors write most twits, a few twits get most "
+        "likes and comments and a few users have most followers. Every "
+        "seeded user has the password 'password'."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument("--twits", type=int, default=10000)
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=None,
+            help="Number of users, by default one per 20 twits.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="Spread the twits over this many days up to now.",
+        )
+        parser.add_argument("--prefix", default="seed", help="Username prefix.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of twits created per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        """Create the users first, then the twits in batches"""
+        self.rng = random.Random(options["seed"])
+        user_count = options["users"] or max(options["twits"] // 20, 2)
+        self.prefix = prefix = options["prefix"]
+        if get_user_model().objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"There are already users named {prefix}*")
+
+        user_ids = self.create_users(prefix, user_count)
+        # Rank i gets weight 1 / (i + 1)^s, so authorship and popularity
+        # follow a Zipf distribution over the shuffled users
+        self.rng.shuffle(user_ids)
+        self.user_ids = user_ids
+        self.weights = list(
+            accumulate(1 / (rank + 1) ** 1.1 for rank in range(user_count))
+        )
+
+        self.create_follows()
+
+        start = timezone.now() - timedelta(days=options["days"])
+        step = timedelta(days=options["days"]) / max(options["twits"], 1)
+        for first in range(0, options["twits"], options["batch_size"]):
+            count = min(options["batch_size"], options["twits"] - first)
+            with transaction.atomic():
+                self.create_twits([start + step * (first + i) for i in range(count)])
+            self.stdout.write(f"Created {first + count} twits.")
+
+        self.finish()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {user_count} users and {options['twits']} twits."
+            )
+        )
+
+    def popular(self, count):
+        """Pick `count` users, skewed towards the popular ones"""
+        return self.rng.choices(self.user_ids, cum_weights=self.weights, k=count)
+
+    def heavy_tail(self, alpha, cap):
+        """A count from a Pareto distribution, mostly 0 or 1"""
+        return min(int(self.rng.paretovariate(alpha)) - 1, cap)
+
+    def create_users(self, prefix, count):
+        """Create the users in batches and return their ids"""
+        user_model = get_user_model()
+        password = make_password("password")
+        user_ids = []
+        for first in range(0, count, 1000):
+            users = user_model.objects.bulk_create(
+                [
+                    user_model(
+                        username=f"{prefix}{i}",
+                        email=f"{prefix}{i}@example.com",
+                        password=password,
+                        avatar_hash=gravatar_hash(f"{prefix}{i}@example.com"),
+                    )
+                    for i in range(first, min(first + 1000, count))
+                ]
+            )
+            UserStats.objects.bulk_create([UserStats(user=user) for user in users])
+            user_ids.extend(user.pk for user in users)
+        return user_ids
+
+    def create_follows(self):
+        """Make every user follow a few users, mostly popular ones"""
+        follows = set()
+        for follower in self.user_ids:
+            for followed in self.popular(self.heavy_tail(1.0, 200) + 1):
+                if followed != follower:
+                    follows.add((follower, followed))
+            if len(follows) >= 5000:
+                self.save_follows(follows)
+                follows = set()
+        self.save_follows(follows)
+
+    @staticmethod
+    def save_follows(follows):
+        """Insert a batch of (follower, followed) pairs"""
+        Follow.objects.bulk_create(
+            [
+                Follow(follower_id=follower, followed_id=followed)
+                for follower, followed in follows
+            ],
+            ignore_conflicts=True,
+        )
+
+    def create_twits(self, timestamps):
+        """Create twits at the given times with their comments and likes"""
+        with transaction.atomic():
+            twits = bulk_create_with_timestamps(
+                Twit,
+                [
+                    Twit(
+                        user_id=user_id,
+                        body=" ".join(
+                            self.rng.choices(WORDS, k=self.rng.randint(3, 25))
+                        ),
+                        created_at=created_at,
+                        updated_at=created_at,
+                    )
+                    for user_id, created_at in zip(
+                        self.popular(len(timestamps)), timestamps
+                    )
+                ],
+            )
+
+            comments, likes = [], set()
+            for twit in twits:
+                for i in range(self.heavy_tail(1.5, 500)):
+                    created_at = twit.created_at + timedelta(minutes=i + 1)
+                    comments.append(
+                        Comment(
+                            twit_id=twit.pk,
+                            user_id=self.rng.choice(self.user_ids),
+                            text=" ".join(self.rng.choices(WORDS, k=6)),
+                            created_at=created_at,
+                            updated_at=created_at,
+                        )
+                    )
+                for user_id in self.popular(self.heavy_tail(1.3, 5000)):
+                    likes.add((twit.pk, user_id))
+            bulk_create_with_timestamps(Comment, comments, batch_size=1000)
+
+        through = Twit.likes.through
+        through.objects.bulk_create(
+            [through(twit_id=twit, customuser_id=user) for twit, user in likes],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        Twit.objects.filter(pk__in=[twit.pk for twit in twits]).refresh_counters()
+
+    def finish(self):
+        """Fill in follower counts, user stats, timelines and the search index"""
+        user_model = get_user_model()
+        followers = (
+            Follow.objects.filter(followed=OuterRef("pk"))
+            .order_by()
+            .values("followed")
+            .annotate(total=Count("*"))
+            .values("total")
+        )
+        user_model.objects.filter(username__startswith=self.prefix).update(
+            follower_count=Coalesce(Subquery(followers), 0)
+        )
+        UserStats.objects.filter(user__username__startswith=self.prefix).refresh(
+            fields=("twit_count", "comment_count", "likes_received", "last_active_at")
+        )
+
+        # Like following everyone afterwards: the latest few twits of every
+        # followed author who is not too popular to fan out to
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO tweeter_timelineentry (owner_id, twit_id, twit_created_at)
+                SELECT follow.follower_id, ranked.id, ranked.created_at
+                FROM accounts_follow follow
+                JOIN accounts_customuser owner ON owner.id = follow.follower_id
+                JOIN accounts_customuser author ON author.id = follow.followed_id
+                JOIN (
+                    SELECT id, user_id, created_at, ROW_NUMBER() OVER (
+                        PARTITION BY user_id ORDER BY created_at DESC, id DESC
+                    ) AS position
+                    FROM tweeter_twit
+                ) ranked ON ranked.user_id = follow.followed_id
+                WHERE owner.username LIKE %s
+                AND ranked.position <= %s
+                AND author.follower_count <= %s
+                """,
+                [
+                    f"{self.prefix}%",
+                    settings.TWEETER_TIMELINE_BACKFILL,
+                    settings.TWEETER_FANOUT_FOLLOWER_LIMIT,
+                ],
+            )
+            get_backend().index(cursor)
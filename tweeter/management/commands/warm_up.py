@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tweeter.warmup import STEPS, describe, warm_up
+
+
+class Command(BaseCommand):
+    """Run the worker warm-up and report how long each step took"""
+
+    help = (
+        "Compile every template, resolve every named URL and open the "
+        "database connections, as gunicorn does before workers take traffic."
+    )
+
+    def add_arguments(self, parser):
+        """Add command arguments"""
+        parser.add_argument(
+            "steps",
+            nargs="*",
+            help=f"Steps to run out of {', '.join(STEPS)}, by default all of them.",
+        )
+
+    def handle(self, *args, **options):
+        """Warm up and print the timings"""
+        steps = options["steps"] or list(STEPS)
+        unknown = [step for step in steps if step not in STEPS]
+        if unknown:
+            raise CommandError(f"Unknown steps: {', '.join(unknown)}")
+        timings = warm_up(steps)
+        self.stdout.write(self.style.SUCCESS(f"Warmed up {describe(timings)}."))
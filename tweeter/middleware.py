@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger("tweeter.requests")
+
+# Stats of the request being handled, if it is being measured
+_current_stats = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """Where the time of one request went"""
+
+    def __init__(self):
+        self.queries = []
+        self.timings = {}
+
+    def add(self, name, duration):
+        """Add `duration` seconds to a named timing"""
+        self.timings[name] = self.timings.get(name, 0) + duration
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every statement"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    @property
+    def db_time(self):
+        """Seconds spent running statements"""
+        return sum(duration for duration, _ in self.queries)
+
+    def slowest(self, count=None):
+        """The slowest statements as (milliseconds, sql), slowest first"""
+        queries = sorted(self.queries, key=lambda query: query[0], reverse=True)
+        return [(round(duration * 1000, 3), sql) for duration, sql in queries[:count]]
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper timing the statements of measured requests.
+
+    The stats are found through a context variable, which sync_to_async
+    carries into its threads, so queries of async views are counted too.
+    """
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.record_query(execute, sql, params, many, context)
+
+
+def wrap_connection(connection):
+    """Install record_query on a connection, once"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def wrap_new_connection(sender, connection, **kwargs):
+    """Install record_query on every connection as it opens"""
+    wrap_connection(connection)
+
+
+@contextmanager
+def timed(name):
+    """Add the time of the block to the current request's timings"""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add(name, time.perf_counter() - started)
+
+
+class RequestTimingMiddleware:
+    """Measure the SQL, template and avatar time of every request.
+
+    The totals are logged as one JSON line on the tweeter.requests logger
+    and, for staff or in DEBUG, go back in a Server-Timing header. Requests
+    slower than TWEETER_SLOW_REQUEST_MS are logged as warnings with every
+    statement they ran. It runs natively in both sync and async stacks, so
+    it does not force ASGI requests through a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Let Django see this instance as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        # Connections opened before this module was imported
+        for connection in connections.all():
+            wrap_connection(connection)
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        self.finish(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        """Measure a request handled by the async stack"""
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        total = time.perf_counter() - started
+        # request.user may still have to be loaded from the database
+        await sync_to_async(self.finish)(request, response, stats, total)
+        return response
+
+    def finish(self, request, response, stats, total):
+        """Report the timings of a handled request"""
+        if self.show_timing(request):
+            response.headers["Server-Timing"] = self.server_timing(stats, total)
+        self.log(request, response, stats, total)
+
+    @staticmethod
+    def show_timing(request):
+        """Whether the client may see where the time went"""
+        if settings.DEBUG:
+            return True
+        user = getattr(request, "user", None)
+        return user is not None and user.is_staff
+
+    def process_template_response(self, request, response):
+        """Time the rendering of the response template"""
+        stats = _current_stats.get()
+        if stats is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: stats.add("template", time.perf_counter() - started)
+            )
+        return response
+
+    @staticmethod
+    def server_timing(stats, total):
+        """Build the Server-Timing header value"""
+        metrics = [
+            f'db;dur={stats.db_time * 1000:.1f};desc="{len(stats.queries)} queries"',
+            *(
+                f"{name};dur={duration * 1000:.1f}"
+                for name, duration in sorted(stats.timings.items())
+            ),
+            f"total;dur={total * 1000:.1f}",
+        ]
+        return ", ".join(metrics)
+
+    @staticmethod
+    def log(request, response, stats, total):
+        """Log the request as one JSON line"""
+        slow = total * 1000 >= settings.TWEETER_SLOW_REQUEST_MS
+        level = logging.WARNING if slow else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+
+        match = request.resolver_match
+        line = {
+            "method": request.method,
+            "path": request.path,
+            "url_name": match.view_name if match else None,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 3),
+            "db_ms": round(stats.db_time * 1000, 3),
+            "queries": len(stats.queries),
+            **{
+                f"{name}_ms": round(duration * 1000, 3)
+                for name, duration in stats.timings.items()
+            },
+            "slowest_queries": stats.slowest(
+                None if slow else settings.TWEETER_SLOWEST_QUERIES
+            ),
+        }
+        logger.log(level, json.dumps(line))
@@ -0,0 +1,41 @@
+# Generated by Django 4.1 on 2026-10-18 12:24
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_rows(apps, schema_editor):
+    """Fill in the counters for twits that already exist"""
+    Twit = apps.get_model("tweeter", "Twit")
+    Comment = apps.get_model("tweeter", "Comment")
+
+    def count_of(queryset):
+        counts = queryset.order_by().values("twit").annotate(total=Count("*"))
+        return Coalesce(Subquery(counts.values("total")), 0)
+
+    Twit.objects.update(
+        like_count=count_of(Twit.likes.through.objects.filter(twit=OuterRef("pk"))),
+        comment_count=count_of(Comment.objects.filter(twit=OuterRef("pk"))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweeter", "0003_remove_twit_users_like_twit_likes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="twit",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="twit",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
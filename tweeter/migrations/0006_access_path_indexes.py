@@ -0,0 +1,36 @@
+# Generated by Django 4.1 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweeter", "0005_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["twit", "created_at", "id"], name="comment_twit_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="twit",
+            index=models.Index(fields=["created_at", "id"], name="twit_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="twit",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="twit_user_created_idx"
+            ),
+        ),
+        # The auto-created likes table only has a (twit, user) unique index,
+        # so "twits liked by user" gets a covering index of its own
+        migrations.RunSQL(
+            "CREATE INDEX twit_likes_user_twit_idx "
+            "ON tweeter_twit_likes (customuser_id, twit_id)",
+            "DROP INDEX twit_likes_user_twit_idx",
+        ),
+    ]
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db import migrations
+
+# The statements are copied from tweeter.search as they were when this
+# migration was written, so later changes there do not change history
+CREATE_SQL = {
+    "postgresql": [
+        """
+        CREATE TABLE tweeter_twit_search (
+            twit_id bigint PRIMARY KEY
+                REFERENCES tweeter_twit (id)
+                ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+            document tsvector NOT NULL
+        )
+        """,
+        "CREATE INDEX tweeter_twit_search_document_idx "
+        "ON tweeter_twit_search USING GIN (document)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE tweeter_twit_search "
+        "USING fts5(body, comments, tokenize='porter unicode61')",
+    ],
+}
+INDEX_SQL = {
+    "postgresql": """
+        INSERT INTO tweeter_twit_search (twit_id, document)
+        SELECT
+            twit.id,
+            setweight(to_tsvector(%s::regconfig, twit.body), 'A')
+            || setweight(
+                to_tsvector(
+                    %s::regconfig, coalesce(string_agg(comment.text, ' '), '')
+                ),
+                'B'
+            )
+        FROM tweeter_twit twit
+        LEFT JOIN tweeter_comment comment ON comment.twit_id = twit.id
+        GROUP BY twit.id
+        """,
+    "sqlite": """
+        INSERT INTO tweeter_twit_search (rowid, body, comments)
+        SELECT twit.id, twit.body, coalesce(group_concat(comment.text, ' '), '')
+        FROM tweeter_twit twit
+        LEFT JOIN tweeter_comment comment ON comment.twit_id = twit.id
+        GROUP BY twit.id
+        """,
+}
+
+
+def create_search_index(apps, schema_editor):
+    """Create the search table for this database and index every twit"""
+    vendor = schema_editor.connection.vendor
+    for sql in CREATE_SQL[vendor]:
+        schema_editor.execute(sql)
+    params = []
+    if vendor == "postgresql":
+        params = [settings.TWEETER_SEARCH_CONFIG] * 2
+    schema_editor.execute(INDEX_SQL[vendor], params)
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the search table"""
+    schema_editor.execute("DROP TABLE tweeter_twit_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweeter", "0006_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
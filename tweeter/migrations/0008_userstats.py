@@ -0,0 +1,77 @@
+# Generated by Django 4.1 on 2026-10-18 12:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+import django.db.models.deletion
+
+
+def count_existing_rows(apps, schema_editor):
+    """Create the stats of every existing user"""
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    Twit = apps.get_model("tweeter", "Twit")
+    Comment = apps.get_model("tweeter", "Comment")
+    UserStats = apps.get_model("tweeter", "UserStats")
+
+    def count_of(queryset, group_field):
+        counts = queryset.order_by().values(group_field).annotate(total=Count("*"))
+        return Coalesce(Subquery(counts.values("total")), 0)
+
+    def latest(queryset):
+        return Subquery(queryset.order_by("-created_at").values("created_at")[:1])
+
+    UserStats.objects.bulk_create(
+        [
+            UserStats(user_id=pk)
+            for pk in CustomUser.objects.values_list("pk", flat=True)
+        ]
+    )
+    latest_twit = latest(Twit.objects.filter(user=OuterRef("user")))
+    latest_comment = latest(Comment.objects.filter(user=OuterRef("user")))
+    UserStats.objects.update(
+        twit_count=count_of(Twit.objects.filter(user=OuterRef("user")), "user"),
+        comment_count=count_of(Comment.objects.filter(user=OuterRef("user")), "user"),
+        likes_received=count_of(
+            Twit.likes.through.objects.filter(twit__user=OuterRef("user")),
+            "twit__user",
+        ),
+        last_active_at=Greatest(
+            Coalesce(latest_twit, latest_comment),
+            Coalesce(latest_comment, latest_twit),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_customuser_avatar_hash"),
+        ("tweeter", "0007_twit_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("twit_count", models.PositiveIntegerField(default=0)),
+                ("comment_count", models.PositiveIntegerField(default=0)),
+                ("likes_received", models.PositiveIntegerField(default=0)),
+                ("last_active_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "user stats",
+            },
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweeter", "0008_userstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="twit",
+            name="image_digest",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
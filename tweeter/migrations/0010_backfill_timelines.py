@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def backfill_timelines(apps, schema_editor):
+    """Materialize the timelines of the twits written before they existed.
+
+    Like tweeter.timelines.backfill as it was when this migration was
+    written, every user gets their own latest TWEETER_TIMELINE_BACKFILL
+    twits and as many of each author they follow, except authors over
+    TWEETER_FANOUT_FOLLOWER_LIMIT, whose twits are pulled in when reading.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Follow = apps.get_model("accounts", "Follow")
+    Twit = apps.get_model("tweeter", "Twit")
+    TimelineEntry = apps.get_model("tweeter", "TimelineEntry")
+    limit = settings.TWEETER_TIMELINE_BACKFILL
+    batch_size = settings.TWEETER_FANOUT_BATCH_SIZE
+
+    entries = []
+    for owner_id in User.objects.values_list("pk", flat=True).iterator():
+        author_ids = [
+            owner_id,
+            *Follow.objects.filter(
+                follower_id=owner_id,
+                followed__follower_count__lte=settings.TWEETER_FANOUT_FOLLOWER_LIMIT,
+            ).values_list("followed_id", flat=True),
+        ]
+        for author_id in author_ids:
+            recent = (
+                Twit.objects.filter(user_id=author_id)
+                .order_by("-created_at", "-id")
+                .values_list("pk", "created_at")
+            )
+            for pk, created_at in recent[:limit]:
+                entries.append(
+                    TimelineEntry(
+                        owner_id=owner_id, twit_id=pk, twit_created_at=created_at
+                    )
+                )
+            if len(entries) >= batch_size:
+                TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_follow"),
+        ("tweeter", "0009_twit_image_digest"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
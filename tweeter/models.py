@@ -1,6 +1,169 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (
+    Count,
+    Exists,
+    F,
+    Max,
+    OuterRef,
+    Subquery,
+    Value,
+    Window,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest, RowNumber
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
+
+from .search import get_backend
+
+
+class TwitQuerySet(models.QuerySet):
+    """Twit QuerySet"""
+
+    def for_feed(self, viewer=None):
+        """Twits with everything a twit box renders loaded up front.
+
+        Authors and whether `viewer` likes each twit are fetched with the
+        twits themselves. Like and comment counts are columns on Twit and
+        comments are loaded a bounded page or preview at a time.
+        """
+        return self.select_related("user").annotate(
+            viewer_liked=self._viewer_liked(viewer)
+        )
+
+    def for_validators(self, viewer=None):
+        """Twits with only the metadata that decides how their boxes render.
+
+        Used to build conditional GET validators, so it loads no authors or
+        comments, just the latest comment time of each twit.
+        """
+        return self.only(
+            "id",
+            "user",
+            "image_digest",
+            "created_at",
+            "updated_at",
+            "like_count",
+            "comment_count",
+        ).annotate(
+            viewer_liked=self._viewer_liked(viewer),
+            latest_comment_at=Max("comments__updated_at"),
+        )
+
+    def _viewer_liked(self, viewer):
+        """Expression for whether `viewer` likes each twit"""
+        if viewer is None or not viewer.is_authenticated:
+            return Value(False)
+
+        likes = self.model.likes.through.objects
+        user_field = self.model.likes.field.m2m_reverse_field_name()
+        return Exists(likes.filter(twit=OuterRef("pk"), **{user_field: viewer.pk}))
+
+    def set_like(self, twit_id, user_id, liked):
+        """Like or unlike a twit and return its like count afterwards.
+
+        Writes straight to the likes through-table with a conflict ignoring
+        insert or a delete, so repeating a request changes nothing. The
+        counter is only moved when a row really changed and is read back
+        under the same row lock, making the returned count authoritative.
+        Raises Twit.DoesNotExist for an unknown twit.
+        """
+        through = self.model.likes.through
+        twit_field = self.model.likes.field.m2m_field_name()
+        user_field = self.model.likes.field.m2m_reverse_field_name()
+        connection = connections[self.db]
+
+        with transaction.atomic(using=self.db):
+            row = (
+                self.select_for_update()
+                .filter(pk=twit_id)
+                .values_list("like_count", "user_id")
+                .first()
+            )
+            if row is None:
+                raise self.model.DoesNotExist(f"No twit with id {twit_id}")
+            like_count, author_id = row
+
+            if liked:
+                quote = connection.ops.quote_name
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO {table} ({twit}, {user}) VALUES (%s, %s) "
+                        "ON CONFLICT DO NOTHING".format(
+                            table=quote(through._meta.db_table),
+                            twit=quote(through._meta.get_field(twit_field).column),
+                            user=quote(through._meta.get_field(user_field).column),
+                        ),
+                        [twit_id, user_id],
+                    )
+                    delta = cursor.rowcount
+            else:
+                deleted, _ = through.objects.filter(
+                    **{f"{twit_field}_id": twit_id, f"{user_field}_id": user_id}
+                ).delete()
+                delta = -deleted
+
+            if delta:
+                self.filter(pk=twit_id).update(like_count=F("like_count") + delta)
+                UserStats.objects.filter(user_id=author_id).update(
+                    likes_received=Greatest(F("likes_received") + delta, 0)
+                )
+                UserStats.objects.record_activity([user_id])
+        return like_count + delta
+
+    def refresh_counters(self, fields=("like_count", "comment_count")):
+        """Recount like_count and comment_count from the related rows"""
+        counts = {
+            "like_count": _count_of(
+                self.model.likes.through.objects.filter(twit=OuterRef("pk")),
+                "twit",
+            ),
+            "comment_count": _count_of(
+                Comment.objects.filter(twit=OuterRef("pk")),
+                "twit",
+            ),
+        }
+        return self.update(**{field: counts[field] for field in fields})
+
+    def bulk_delete(self):
+        """Delete the twits and their rows in other tables, one statement each.
+
+        Unlike delete(), no rows are loaded and no signals are sent, so the
+        stats of the authors and commenters are recounted afterwards and the
+        search documents are removed here. Returns the ids of the deleted
+        twits.
+        """
+        with transaction.atomic(using=self.db):
+            twit_ids = list(self.values_list("pk", flat=True))
+            twits = self.model.objects.using(self.db).filter(pk__in=twit_ids)
+            user_ids = {
+                *twits.values_list("user", flat=True),
+                *Comment.objects.filter(twit__in=twit_ids).values_list(
+                    "user", flat=True
+                ),
+            }
+            for related in (Comment, TimelineEntry, self.model.likes.through):
+                related.objects.using(self.db).filter(twit__in=twit_ids)._raw_delete(
+                    self.db
+                )
+            twits._raw_delete(self.db)
+            search = get_backend(connections[self.db])
+            if twit_ids and not search.cascades:
+                with connections[self.db].cursor() as cursor:
+                    search.remove(cursor, twit_ids)
+            UserStats.objects.using(self.db).filter(user__in=user_ids).refresh()
+        return twit_ids
+
+
+def _count_of(queryset, group_field):
+    """Correlated subquery counting the rows of `queryset`"""
+    counts = queryset.order_by().values(group_field).annotate(total=Count("*"))
+    return Coalesce(
+        Subquery(counts.values("total")),
+        0,
+        output_field=models.IntegerField(),
+    )
 
 
 class Twit(models.Model):
@@ -13,23 +176,103 @@ class Twit(models.Model):
     )
     body = models.TextField()
     image_url = models.URLField(blank=True)
+    # SHA-256 of the image once tweeter.images has fetched it into its cache
+    image_digest = models.CharField(max_length=64, blank=True, editable=False)
     likes = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
         related_name="liked_twits",
         blank=True,
     )
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TwitQuerySet.as_manager()
+
+    # Only ever changed with F() updates, never written from a stale instance
+    COUNTER_FIELDS = ("like_count", "comment_count")
+    # Set by the background image fetch, so also left out of saves
+    BACKGROUND_FIELDS = ("image_digest",)
+
     def __str__(self):
         return self.body[:30]
 
+    def save(self, *args, **kwargs):
+        """Save the twit without overwriting the counters in the database"""
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in (*self.COUNTER_FIELDS, *self.BACKGROUND_FIELDS)
+            ]
+        super().save(*args, **kwargs)
+
     def get_like_url(self):
         """Get like url based on pk"""
         return reverse("twit_like", kwargs={"pk": self.pk})
 
     class Meta:
         ordering = ("-created_at",)
+        indexes = [
+            # The feed, newest first and paged on (created_at, id)
+            models.Index(fields=["created_at", "id"], name="twit_created_idx"),
+            # A user's twits on their profile, newest first
+            models.Index(
+                fields=["user", "created_at", "id"],
+                name="twit_user_created_idx",
+            ),
+        ]
+
+
+class CommentQuerySet(models.QuerySet):
+    """Comment QuerySet"""
+
+    def latest_per_twit(self, twit_ids, limit):
+        """The latest `limit` comments of each of the given twits.
+
+        The comments are ranked per twit with a window function, so every
+        twit on a page gets its preview from one query.
+        """
+        ranked = (
+            self.filter(twit_id__in=twit_ids)
+            .annotate(
+                position=Window(
+                    RowNumber(),
+                    partition_by=F("twit_id"),
+                    order_by=(F("created_at").desc(), F("id").desc()),
+                )
+            )
+            .order_by()
+            .values("id", "position")
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(
+            pk__in=RawSQL(
+                f"SELECT ranked.id FROM ({sql}) ranked WHERE ranked.position <= %s",
+                (*params, limit),
+            )
+        )
+
+    def bulk_delete(self):
+        """Delete the comments in one statement and recount what they counted.
+
+        Returns the ids of the twits that lost comments.
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.values_list("pk", "twit", "user"))
+            self.model.objects.using(self.db).filter(
+                pk__in=[pk for pk, _, _ in rows]
+            )._raw_delete(self.db)
+            twit_ids = sorted({twit_id for _, twit_id, _ in rows})
+            Twit.objects.using(self.db).filter(pk__in=twit_ids).refresh_counters(
+                fields=("comment_count",)
+            )
+            UserStats.objects.using(self.db).filter(
+                user__in={user_id for _, _, user_id in rows}
+            ).refresh(fields=("comment_count",))
+        return twit_ids
 
 
 class Comment(models.Model):
@@ -49,8 +292,138 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CommentQuerySet.as_manager()
+
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [
+            # The comments of a twit in order and the latest few per twit
+            models.Index(
+                fields=["twit", "created_at", "id"],
+                name="comment_twit_created_idx",
+            ),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """A twit materialized into a user's home timeline"""
+
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+    )
+    twit = models.ForeignKey(
+        Twit,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+    )
+    # Copy of twit.created_at so a timeline page is one index range scan
+    twit_created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.twit} for {self.owner}"
+
+    class Meta:
+        ordering = ("-twit_created_at", "-twit")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "twit"],
+                name="unique_timeline_entry",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "-twit_created_at", "-twit"],
+                name="timeline_owner_recent_idx",
+            ),
+        ]
+
+
+class UserStatsQuerySet(models.QuerySet):
+    """User Stats QuerySet"""
+
+    def record_activity(self, user_ids, **deltas):
+        """Add deltas to the counters of users and mark them as active now"""
+        return self.filter(user_id__in=user_ids).update(
+            last_active_at=timezone.now(),
+            **{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()},
+        )
+
+    def add_likes_received(self, twit_deltas):
+        """Add the likes each twit gained or lost to the stats of its author.
+
+        twit_deltas maps twit ids to the likes they gained, or lost when
+        negative. Authors whose likes change by the same amount are updated
+        together.
+        """
+        authors = {}
+        for twit_id, user_id in (
+            Twit.objects.using(self.db)
+            .filter(pk__in=twit_deltas)
+            .values_list("pk", "user")
+        ):
+            authors[user_id] = authors.get(user_id, 0) + twit_deltas[twit_id]
+        by_delta = {}
+        for user_id, delta in authors.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(user_id)
+        for delta, user_ids in by_delta.items():
+            self.filter(user_id__in=user_ids).update(
+                likes_received=Greatest(F("likes_received") + delta, 0)
+            )
+
+    def refresh(self, fields=("twit_count", "comment_count", "likes_received")):
+        """Recount the stats from the twits, comments and likes of each user"""
+        latest_twit = Subquery(
+            Twit.objects.filter(user=OuterRef("user"))
+            .order_by("-created_at")
+            .values("created_at")[:1]
+        )
+        latest_comment = Subquery(
+            Comment.objects.filter(user=OuterRef("user"))
+            .order_by("-created_at")
+            .values("created_at")[:1]
+        )
+        values = {
+            "twit_count": _count_of(Twit.objects.filter(user=OuterRef("user")), "user"),
+            "comment_count": _count_of(
+                Comment.objects.filter(user=OuterRef("user")), "user"
+            ),
+            "likes_received": _count_of(
+                Twit.likes.through.objects.filter(twit__user=OuterRef("user")),
+                "twit__user",
+            ),
+            # Greatest is NULL on SQLite as soon as one side is NULL
+            "last_active_at": Greatest(
+                Coalesce(latest_twit, latest_comment),
+                Coalesce(latest_comment, latest_twit),
+            ),
+        }
+        return self.update(**{field: values[field] for field in fields})
+
+
+class UserStats(models.Model):
+    """Counters shown in a user's profile header, kept up to date on write"""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+    )
+    twit_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    likes_received = models.PositiveIntegerField(default=0)
+    last_active_at = models.DateTimeField(null=True, blank=True)
+
+    objects = UserStatsQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Stats of {self.user}"
+
+    class Meta:
+        verbose_name_plural = "user stats"
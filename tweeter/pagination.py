@@ -0,0 +1,186 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+def encode_cursor(created_at, pk):
+    """Encode a (created_at, pk) position as an opaque url safe cursor"""
+    raw = f"{created_at.isoformat()}|{pk}".encode("utf-8")
+    return urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor back into (created_at, pk)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = urlsafe_b64decode(padded).decode("utf-8").split("|")
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(cursor)
+        return created_at, int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error) as exc:
+        raise Http404("Invalid page cursor") from exc
+
+
+class KeysetPage:
+    """A single page of results from a KeysetPaginator"""
+
+    def __init__(self, object_list, paginator, has_older, has_newer):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        """Whether there is a page on either side of this one"""
+        return self.has_older or self.has_newer
+
+    @property
+    def older_cursor(self):
+        """Cursor pointing at the last (oldest) row of this page"""
+        if not self.has_older or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def newer_cursor(self):
+        """Cursor pointing at the first (newest) row of this page"""
+        if not self.has_newer or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class KeysetPaginator:
+    """Paginate a queryset newest first on (created_at, id).
+
+    Unlike OFFSET pagination every page is a single bounded range scan
+    starting at the cursor, so the cost of a page does not depend on how
+    deep into the feed it is or on how big the table is.
+    """
+
+    def __init__(self, per_page, date_field="created_at", pk_field="id"):
+        self.per_page = int(per_page)
+        self.date_field = date_field
+        self.pk_field = pk_field
+
+    def cursor_for(self, obj):
+        """Build the cursor for a row of the paginated queryset"""
+        return encode_cursor(
+            getattr(obj, self.date_field),
+            getattr(obj, self.pk_field),
+        )
+
+    def _after(self, created_at, pk, lookup):
+        """Filter for rows strictly before / after a cursor position"""
+        return Q(**{f"{self.date_field}__{lookup}": created_at}) | Q(
+            **{
+                self.date_field: created_at,
+                f"{self.pk_field}__{lookup}": pk,
+            }
+        )
+
+    def _page_query(self, queryset, older, newer):
+        """Build the query that fetches one row more than a page"""
+        if newer:
+            created_at, pk = decode_cursor(newer)
+            queryset = queryset.filter(self._after(created_at, pk, "gt")).order_by(
+                self.date_field, self.pk_field
+            )
+        else:
+            if older:
+                created_at, pk = decode_cursor(older)
+                queryset = queryset.filter(self._after(created_at, pk, "lt"))
+            queryset = queryset.order_by(f"-{self.date_field}", f"-{self.pk_field}")
+        return queryset[: self.per_page + 1]
+
+    def _make_page(self, rows, older, newer):
+        """Turn the fetched rows into a page, newest first"""
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if newer:
+            return KeysetPage(rows[::-1], self, True, has_more)
+        return KeysetPage(rows, self, has_more, bool(older))
+
+    def page(self, queryset, older=None, newer=None):
+        """Get the page older than the `older` cursor or newer than `newer`.
+
+        With neither cursor the newest page is returned.
+        """
+        rows = list(self._page_query(queryset, older, newer))
+        return self._make_page(rows, older, newer)
+
+    async def apage(self, queryset, older=None, newer=None):
+        """Asynchronous version of page"""
+        rows = [row async for row in self._page_query(queryset, older, newer)]
+        return self._make_page(rows, older, newer)
+
+
+class KeysetPaginationMixin:
+    """Use keyset pagination in a ListView instead of page numbers"""
+
+    older_kwarg = "older"
+    newer_kwarg = "newer"
+
+    def get_keyset_paginator(self, page_size):
+        """Get the keyset paginator used by this view"""
+        return KeysetPaginator(page_size)
+
+    def paginate_queryset(self, queryset, page_size):
+        """Paginate the queryset using the cursors in the query string"""
+        paginator = self.get_keyset_paginator(page_size)
+        page = paginator.page(
+            queryset,
+            older=self.request.GET.get(self.older_kwarg),
+            newer=self.request.GET.get(self.newer_kwarg),
+        )
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+def estimate_row_count(model, using="default"):
+    """Estimate the number of rows in a model's table without counting them.
+
+    PostgreSQL keeps an estimate in its statistics, which is -1 until the
+    table has been analyzed. Elsewhere the highest primary key is used, read
+    from the end of its index.
+    """
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else 0
+    return model._default_manager.using(using).aggregate(last=Max("pk"))["last"] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Page numbers without a COUNT(*) of whole tables.
+
+    The unfiltered list of a table past TWEETER_ADMIN_EXACT_COUNT_LIMIT rows
+    gets an estimated count. Filtered lists are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        """Estimate the count of a big unfiltered table, or count it"""
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate > settings.TWEETER_ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
@@ -0,0 +1,226 @@
+"""Full-text search over twits and their comments.
+
+Every twit has one search document made of its body and the text of its
+comments, keyed by the twit id. On Postgres the documents are tsvectors with
+a GIN index, elsewhere they live in an SQLite FTS5 table. Documents are
+rebuilt from the twit and comment rows by index_twits, which the views call
+whenever a twit is created, edited or commented on. Postgres drops the
+document of a deleted twit through its foreign key; FTS5 tables have none,
+so on SQLite deletes take the documents out themselves.
+"""
+import binascii
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404
+
+SEARCH_TABLE = "tweeter_twit_search"
+
+
+def encode_search_cursor(score, pk):
+    """Encode a (score, pk) position in search results as a cursor"""
+    raw = f"{score!r}|{pk}".encode("utf-8")
+    return urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    """Decode a cursor made by encode_search_cursor into (score, pk)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, pk = urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return float(score), int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error) as exc:
+        raise Http404("Invalid page cursor") from exc
+
+
+def _placeholders(values):
+    """One query parameter placeholder per value"""
+    return ", ".join(["%s"] * len(values))
+
+
+class PostgresSearch:
+    """tsvector documents with a GIN index, ranked with ts_rank"""
+
+    # Documents go with their twits through ON DELETE CASCADE
+    cascades = True
+
+    create_sql = [
+        f"""
+        CREATE TABLE {SEARCH_TABLE} (
+            twit_id bigint PRIMARY KEY
+                REFERENCES tweeter_twit (id)
+                ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+            document tsvector NOT NULL
+        )
+        """,
+        f"CREATE INDEX {SEARCH_TABLE}_document_idx "
+        f"ON {SEARCH_TABLE} USING GIN (document)",
+    ]
+    drop_sql = [f"DROP TABLE {SEARCH_TABLE}"]
+
+    def index(self, cursor, twit_ids=None):
+        """Rebuild the documents of the given twits, or of every twit"""
+        config = settings.TWEETER_SEARCH_CONFIG
+        where, params = "", [config, config]
+        if twit_ids is not None:
+            where = f"WHERE twit.id IN ({_placeholders(twit_ids)})"
+            params.extend(twit_ids)
+        cursor.execute(
+            f"""
+            INSERT INTO {SEARCH_TABLE} (twit_id, document)
+            SELECT
+                twit.id,
+                setweight(to_tsvector(%s::regconfig, twit.body), 'A')
+                || setweight(
+                    to_tsvector(
+                        %s::regconfig, coalesce(string_agg(comment.text, ' '), '')
+                    ),
+                    'B'
+                )
+            FROM tweeter_twit twit
+            LEFT JOIN tweeter_comment comment ON comment.twit_id = twit.id
+            {where}
+            GROUP BY twit.id
+            ON CONFLICT (twit_id) DO UPDATE SET document = EXCLUDED.document
+            """,
+            params,
+        )
+
+    def remove(self, cursor, twit_ids):
+        """Drop the documents of the given twits"""
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} "
+            f"WHERE twit_id IN ({_placeholders(twit_ids)})",
+            twit_ids,
+        )
+
+    def search(self, cursor, terms, limit, after=None):
+        """Get (twit_id, score) rows matching every term, best first"""
+        where, params = "", [settings.TWEETER_SEARCH_CONFIG, " ".join(terms)]
+        if after:
+            where = "WHERE score < %s OR (score = %s AND twit_id < %s)"
+            params.extend((after[0], after[0], after[1]))
+        cursor.execute(
+            f"""
+            SELECT twit_id, score FROM (
+                SELECT twit_id, ts_rank(document, query)::float8 AS score
+                FROM {SEARCH_TABLE}, plainto_tsquery(%s::regconfig, %s) query
+                WHERE document @@ query
+            ) ranked
+            {where}
+            ORDER BY score DESC, twit_id DESC
+            LIMIT %s
+            """,
+            [*params, limit],
+        )
+        return cursor.fetchall()
+
+
+class SqliteSearch:
+    """An FTS5 table with the rowid as twit id, ranked with bm25"""
+
+    cascades = False
+
+    create_sql = [
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} "
+        f"USING fts5(body, comments, tokenize='porter unicode61')"
+    ]
+    drop_sql = [f"DROP TABLE {SEARCH_TABLE}"]
+
+    def index(self, cursor, twit_ids=None):
+        """Rebuild the documents of the given twits, or of every twit"""
+        where, params = "", []
+        if twit_ids is not None:
+            self.remove(cursor, twit_ids)
+            where = f"WHERE twit.id IN ({_placeholders(twit_ids)})"
+            params.extend(twit_ids)
+        else:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(
+            f"""
+            INSERT INTO {SEARCH_TABLE} (rowid, body, comments)
+            SELECT twit.id, twit.body, coalesce(group_concat(comment.text, ' '), '')
+            FROM tweeter_twit twit
+            LEFT JOIN tweeter_comment comment ON comment.twit_id = twit.id
+            {where}
+            GROUP BY twit.id
+            """,
+            params,
+        )
+
+    def remove(self, cursor, twit_ids):
+        """Drop the documents of the given twits"""
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({_placeholders(twit_ids)})",
+            twit_ids,
+        )
+
+    def search(self, cursor, terms, limit, after=None):
+        """Get (twit_id, score) rows matching every term, best first"""
+        # Quoting every term keeps FTS5 query syntax out of user input
+        params = [" ".join(f'"{term}"' for term in terms)]
+        where = ""
+        if after:
+            where = "WHERE score < %s OR (score = %s AND twit_id < %s)"
+            params.extend((after[0], after[0], after[1]))
+        cursor.execute(
+            f"""
+            SELECT twit_id, score FROM (
+                SELECT rowid AS twit_id, -bm25({SEARCH_TABLE}, 2.0, 1.0) AS score
+                FROM {SEARCH_TABLE}
+                WHERE {SEARCH_TABLE} MATCH %s
+            )
+            {where}
+            ORDER BY score DESC, twit_id DESC
+            LIMIT %s
+            """,
+            [*params, limit],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    "postgresql": PostgresSearch,
+    "sqlite": SqliteSearch,
+}
+
+
+def get_backend(using=connection):
+    """Get the search backend for a database connection"""
+    return BACKENDS[using.vendor]()
+
+
+def index_twits(*twit_ids):
+    """Rebuild the search documents of twits after they changed"""
+    with connection.cursor() as cursor:
+        get_backend().index(cursor, list(twit_ids))
+
+
+def remove_twits(*twit_ids):
+    """Take deleted twits out of the search index"""
+    with connection.cursor() as cursor:
+        get_backend().remove(cursor, list(twit_ids))
+
+
+def search_twits(query, limit, after=None):
+    """Search twits and their comments, best match first.
+
+    Returns the (twit_id, score) rows of one page and the cursor of the next
+    page, or None when this is the last one.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return [], None
+
+    position = decode_search_cursor(after) if after else None
+    with connection.cursor() as cursor:
+        rows = get_backend().search(cursor, terms, limit + 1, position)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        twit_id, score = rows[-1]
+        next_cursor = encode_search_cursor(score, twit_id)
+    return rows, next_cursor
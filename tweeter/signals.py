@@ -0,0 +1,154 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .fragments import bump_profiles_version
+from .models import Comment, Twit, UserStats
+from .search import get_backend, remove_twits
+
+# User fields shown in the cached twit fragments
+PROFILE_FIELDS = {"username", "first_name", "last_name", "email", "avatar_hash"}
+
+
+def _bump(twit_ids, field, delta):
+    """Atomically add delta to a counter column on the given twits"""
+    Twit.objects.filter(pk__in=twit_ids).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_user_stats(sender, instance, created, **kwargs):
+    """Give every new user their stats row"""
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def expire_profile_fragments(sender, instance, created, update_fields, **kwargs):
+    """Render twit fragments again after a name or avatar may have changed"""
+    if created or (update_fields is not None and not PROFILE_FIELDS & update_fields):
+        return
+    bump_profiles_version()
+    # A request reading the user before the commit may have cached fragments
+    transaction.on_commit(bump_profiles_version)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def collect_likes_of_deleted_user(sender, instance, **kwargs):
+    """Remember the twits a user liked before the likes go with them"""
+    user_field = Twit.likes.field.m2m_reverse_field_name()
+    instance._liked_twit_ids = list(
+        Twit.likes.through.objects.filter(**{user_field: instance.pk}).values_list(
+            "twit", flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def uncount_likes_of_deleted_user(sender, instance, **kwargs):
+    """Take the likes of a deleted user off the twits and their authors.
+
+    The cascade deletes the likes without sending m2m_changed. Twits the
+    user wrote are gone by now, so only other authors are updated.
+    """
+    twit_ids = instance.__dict__.pop("_liked_twit_ids", [])
+    if twit_ids:
+        _bump(twit_ids, "like_count", -1)
+        UserStats.objects.add_likes_received({twit_id: -1 for twit_id in twit_ids})
+
+
+@receiver(post_save, sender=Twit)
+def count_new_twit(sender, instance, created, **kwargs):
+    """Count a newly created twit for its author"""
+    if created:
+        UserStats.objects.record_activity([instance.user_id], twit_count=1)
+
+
+@receiver(pre_delete, sender=Twit)
+def count_likes_of_deleted_twit(sender, instance, **kwargs):
+    """Remember how many likes a twit has before they are deleted with it"""
+    # The instance's like_count may be stale, so count the rows themselves
+    instance._deleted_like_count = Twit.likes.through.objects.filter(
+        twit=instance
+    ).count()
+
+
+@receiver(post_delete, sender=Twit)
+def uncount_deleted_twit(sender, instance, **kwargs):
+    """Stop counting a deleted twit and its likes for its author"""
+    likes = instance.__dict__.pop("_deleted_like_count", instance.like_count)
+    UserStats.objects.filter(user_id=instance.user_id).update(
+        twit_count=Greatest(F("twit_count") - 1, 0),
+        likes_received=Greatest(F("likes_received") - likes, 0),
+    )
+
+
+@receiver(post_delete, sender=Twit)
+def remove_deleted_twit(sender, instance, **kwargs):
+    """Take a deleted twit out of a search index without foreign keys"""
+    if not get_backend().cascades:
+        remove_twits(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    """Count a newly created comment on its twit and for its author"""
+    if created:
+        _bump([instance.twit_id], "comment_count", 1)
+        UserStats.objects.record_activity([instance.user_id], comment_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    """Stop counting a deleted comment on its twit and for its author"""
+    _bump([instance.twit_id], "comment_count", -1)
+    UserStats.objects.filter(user_id=instance.user_id).update(
+        comment_count=Greatest(F("comment_count") - 1, 0)
+    )
+
+
+@receiver(m2m_changed, sender=Twit.likes.through)
+def count_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep Twit.like_count and the likes received in step with the likes.
+
+    On add, pk_set only holds the rows that were really inserted, so the
+    counters can be bumped directly. pk_set of a remove may name rows that
+    never existed, so the rows really there are looked up before they go,
+    like the rows of a clear. Twit counters are then recounted, while the
+    likes received by the authors are taken away one per deleted row.
+    """
+    likes = Twit.likes.through.objects
+    user_field = Twit.likes.field.m2m_reverse_field_name()
+    if action in ("pre_remove", "pre_clear"):
+        # Remember which twits lose a like before the rows are gone
+        if reverse:
+            rows = likes.filter(**{user_field: instance.pk})
+        else:
+            rows = likes.filter(twit=instance)
+        if action == "pre_remove":
+            rows = rows.filter(
+                **{"twit__in" if reverse else f"{user_field}__in": pk_set}
+            )
+        instance._unliked_twit_ids = list(rows.values_list("twit", flat=True))
+        return
+
+    if action == "post_add" and pk_set:
+        if reverse:
+            twit_ids = list(pk_set)
+            _bump(twit_ids, "like_count", 1)
+        else:
+            twit_ids = [instance.pk] * len(pk_set)
+            _bump([instance.pk], "like_count", len(pk_set))
+        UserStats.objects.add_likes_received(Counter(twit_ids))
+    elif action in ("post_remove", "post_clear"):
+        twit_ids = instance.__dict__.pop("_unliked_twit_ids", [])
+        Twit.objects.filter(pk__in=set(twit_ids)).refresh_counters()
+        UserStats.objects.add_likes_received(
+            {twit_id: -count for twit_id, count in Counter(twit_ids).items()}
+        )
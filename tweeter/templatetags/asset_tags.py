@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import ImproperlyConfigured
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from tweeter.assets import BUNDLES, VENDOR, bundle_path
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def is_built(name):
+    """Whether bundle_assets has built a bundle"""
+    return finders.find(bundle_path(name)) is not None
+
+
+def part_url(path):
+    """Get the (url, integrity) a part of a bundle is linked with on its own"""
+    if path in VENDOR:
+        return VENDOR[path]
+    return static(path), None
+
+
+@register.simple_tag
+def asset_bundle(name):
+    """Link a bundle, or each of its parts until the bundle is built.
+
+    With TWEETER_REQUIRE_BUNDLES on, a missing bundle is an error instead.
+
+    Scripts are deferred, so they download alongside the page and run in
+    order once it has been parsed.
+    """
+    if is_built(name):
+        urls = [(static(bundle_path(name)), None)]
+    elif settings.TWEETER_REQUIRE_BUNDLES:
+        raise ImproperlyConfigured(
+            f"{bundle_path(name)} has not been built, run bundle_assets "
+            "before collectstatic"
+        )
+    else:
+        urls = [part_url(path) for path in BUNDLES[name]]
+
+    tags = []
+    for url, integrity in urls:
+        attributes = ""
+        if integrity:
+            attributes = format_html(
+                ' integrity="{}" crossorigin="anonymous"', integrity
+            )
+        if name.endswith(".css"):
+            tags.append(
+                format_html('<link href="{}" rel="stylesheet"{}>', url, attributes)
+            )
+        else:
+            tags.append(
+                format_html('<script src="{}" defer{}></script>', url, attributes)
+            )
+    return mark_safe("\n".join(tags))
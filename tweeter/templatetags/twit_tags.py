@@ -1,30 +1,62 @@
-from hashlib import md5
+from functools import lru_cache
+
 from django import template
 
+from accounts.models import gravatar_hash
+from tweeter.fragments import render_twit_boxes
+from tweeter.images import Image
+from tweeter.middleware import timed
+
 register = template.Library()
 
 
+@register.simple_tag(takes_context=True)
+def twit_boxes(context, twits):
+    """Render the twit boxes of a feed page through the fragment cache"""
+    return render_twit_boxes(twits, context["request"].user)
+
+
+@register.inclusion_tag("partials/_twit_image.html")
+def twit_image(twit):
+    """Show a twit's image from the local image cache once it is fetched"""
+    return {
+        "twit": twit,
+        # Without Pillow every variant is the original, so skip the WebP one
+        "webp": Image is not None,
+    }
+
+
+@lru_cache(maxsize=4096)
+def _gravatar_url(avatar_hash, size, default):
+    """Build a gravatar url, memoized since the same few authors repeat"""
+    return "https://www.gravatar.com/avatar/{hash}?s={size}&d={default}".format(
+        hash=avatar_hash,
+        size=size or "",
+        default=default,
+    )
+
+
 @register.simple_tag(takes_context=True)
 def get_avatar_url(context, user=None, email=None, size=None, default="mp"):
     """Get a gravatar image url.
     If no image is found, gravatar will return an image based on the 'default'
     keyword. See http://en.gravatar.com/site/implement/images/ for more info.
 
-    This function will get the profile email in this order:
-        The 'email' argument,
-        The 'user' argument if it has an 'email' attribute,
+    This function will get the profile hash in this order:
+        The hash of the 'email' argument,
+        The 'user' argument's precomputed 'avatar_hash',
+        The hash of the 'user' argument's 'email'.
 
     NOTE: Method does not work if context is not taken in despite it not using it.
     """
-    if not size:
-        size = 25
-
-    email = email or ""
+    with timed("avatar"):
+        if not size:
+            size = 25
 
-    if not email and user and hasattr(user, "email"):
-        email = user.email or ""
-    return "https://www.gravatar.com/avatar/{hash}?s={size}&d={default}".format(
-        hash=md5(email.encode("utf-8")).hexdigest(),
-        size=size or "",
-        default=default,
-    )
+        if email:
+            avatar_hash = gravatar_hash(email)
+        elif user and getattr(user, "avatar_hash", None):
+            avatar_hash = user.avatar_hash
+        else:
+            avatar_hash = gravatar_hash(getattr(user, "email", ""))
+        return _gravatar_url(avatar_hash, size, default)
@@ -1,8 +1,50 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.template import engines
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .models import Twit, Comment
+from accounts.models import Follow
+
+from .models import Twit, Comment, TimelineEntry, UserStats
+from .admin import TwitAdmin
+from .assets import VENDOR
+from .fragments import OWNER_BUTTONS_SLOT, twit_box_key
+from .images import HttpFetcher, ImageCache, ImageFetchError, connect_public
+from .likebuffer import current_epoch, flush
+from .live import LiveEventsApp, get_broker
+from .middleware import RequestTimingMiddleware
+from .search import index_twits, search_twits
+from .templatetags.asset_tags import is_built
+from .templatetags.twit_tags import get_avatar_url
+from .timelines import home_page
+from .transfer import Checkpoint
+from .warmup import named_urls, template_names, warm_up
+from .views import (
+    AsyncTwitDetailCommentCreateView,
+    AsyncTwitLikeView,
+    AsyncTwitListView,
+)
 
 
 class TwitTests(TestCase):
@@ -53,6 +95,18 @@ class TwitTests(TestCase):
         self.assertEqual(str(self.twit), "Nice twit content")
         self.assertEqual(self.twit.get_like_url(), "/twits/1/like/")
 
+    def test_avatar_url_uses_stored_hash(self):
+        """Test avatar url uses the stored hash instead of the email"""
+        self.user.avatar_hash = "0" * 32
+        self.assertEqual(
+            get_avatar_url({}, user=self.user, size=50),
+            f"https://www.gravatar.com/avatar/{'0' * 32}?s=50&d=mp",
+        )
+        self.assertIn(
+            "/avatar/93942e96f5acd83e2e047ad8fe03114d?s=25",
+            get_avatar_url({}, email="Test@Email.com "),
+        )
+
     def test_comment_model(self):
         """Test Comment Model"""
         self.assertEqual(self.comment.text, "Nice comment content")
@@ -140,6 +194,33 @@ class TwitTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(Comment.objects.last().text, "New comment")
 
+    def test_comment_createview_xhr(self):
+        """Test comments posted by the feed's scripts get their row back"""
+        self.client.force_login(self.user)
+        url = reverse("comment_new", args=[self.twit.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, {"text": "Inline comment"}, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+            )
+        data = response.json()
+        comment = Comment.objects.get(text="Inline comment")
+        self.assertEqual(data["id"], comment.pk)
+        self.twit.refresh_from_db()
+        self.assertEqual(data["comment_count"], self.twit.comment_count)
+        self.assertIn(f'data-comment-id="{comment.pk}"', data["html"])
+        # The twit's other comments are not loaded
+        self.assertFalse(
+            any('FROM "tweeter_comment"' in query["sql"] for query in queries)
+        )
+
+        response = self.client.post(
+            url, {"text": "x" * 141}, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("text", response.json()["errors"])
+        response = self.client.post(url, {"text": ""})
+        self.assertContains(response, "Add New Comment")
+
     def test_established_user_like_shows_up(self):
         """Test established user like shows up"""
         self.client.force_login(self.user)
@@ -163,3 +244,1694 @@ class TwitTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, '<span class="like_count">1</span>')
         self.assertNotContains(response, '<span class="like_count">0</span>')
+
+
+class TwitPaginationTests(TestCase):
+    """Twit Pagination Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twits = [
+            Twit.objects.create(body=f"Twit number {i}", user=cls.user)
+            for i in range(25)
+        ]
+        # Give a run of twits the same timestamp to exercise the id tie break
+        Twit.objects.filter(pk__in=[t.pk for t in cls.twits[15:25]]).update(
+            created_at=cls.twits[15].created_at
+        )
+
+    def page_bodies(self, response):
+        """Get the twit bodies on a page in display order"""
+        return [twit.body for twit in response.context["twit_list"]]
+
+    def test_first_page_is_newest(self):
+        """Test first page is newest"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertEqual(response.status_code, 200)
+        bodies = self.page_bodies(response)
+        self.assertEqual(len(bodies), 20)
+        self.assertEqual(bodies[0], "Twit number 24")
+        self.assertFalse(response.context["page_obj"].has_newer)
+        self.assertTrue(response.context["page_obj"].has_older)
+
+    def test_older_and_newer_cursors(self):
+        """Test older and newer cursors walk the feed without gaps"""
+        self.client.force_login(self.user)
+        first = self.client.get(reverse("twit_list"))
+        older_cursor = first.context["page_obj"].older_cursor
+        self.assertContains(first, f"?older={older_cursor}")
+
+        second = self.client.get(reverse("twit_list"), {"older": older_cursor})
+        self.assertEqual(
+            self.page_bodies(second), [f"Twit number {i}" for i in range(4, -1, -1)]
+        )
+        self.assertFalse(second.context["page_obj"].has_older)
+
+        back = self.client.get(
+            reverse("twit_list"),
+            {"newer": second.context["page_obj"].newer_cursor},
+        )
+        self.assertEqual(self.page_bodies(back), self.page_bodies(first))
+
+    def test_invalid_cursor_is_404(self):
+        """Test invalid cursor is 404"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"), {"older": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TwitFeedQueryTests(TestCase):
+    """Twit Feed Query Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Lonely twit", user=cls.user)
+        Comment.objects.create(twit=cls.twit, user=cls.user, text="Lonely reply")
+
+    def setUp(self):
+        """Start every test with an empty cache"""
+        cache.clear()
+
+    def add_busy_twits(self, count):
+        """Add twits from several users each with comments and likes"""
+        for i in range(count):
+            author = get_user_model().objects.create_user(
+                username=f"author{i}",
+                email=f"author{i}@email.com",
+                password="secret",
+            )
+            twit = Twit.objects.create(body=f"Busy twit {i}", user=author)
+            twit.likes.add(self.user, author)
+            Comment.objects.create(twit=twit, user=author, text=f"Reply {i}")
+            Comment.objects.create(twit=twit, user=self.user, text=f"Thanks {i}")
+
+    def count_queries(self, url):
+        """Count the queries run to render a page"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_query_count_is_constant(self):
+        """Test feed query count does not grow with the page"""
+        self.client.force_login(self.user)
+        # Warm the session and user caches, but not the twit boxes
+        self.count_queries(reverse("twit_new"))
+        baseline = self.count_queries(reverse("twit_list"))
+        self.add_busy_twits(5)
+        self.assertEqual(self.count_queries(reverse("twit_list")), baseline)
+
+    def test_profile_query_count_is_constant(self):
+        """Test public profile query count does not grow with the page"""
+        self.client.force_login(self.user)
+        url = reverse("public_profile", kwargs={"pk": self.user.pk})
+        self.count_queries(reverse("twit_new"))
+        baseline = self.count_queries(url)
+        for i in range(5):
+            twit = Twit.objects.create(body=f"Own twit {i}", user=self.user)
+            Comment.objects.create(twit=twit, user=self.user, text=f"Note {i}")
+        self.assertEqual(self.count_queries(url), baseline)
+
+    def test_query_plans_use_indexes(self):
+        """Test the feed, profile and comment queries use their indexes"""
+        out = StringIO()
+        call_command("check_query_plans", stdout=out)
+        self.assertIn("All query plans use their indexes.", out.getvalue())
+
+    def test_feed_annotations(self):
+        """Test feed annotations match the related rows"""
+        self.add_busy_twits(1)
+        twit = Twit.objects.for_feed(self.user).get(body="Busy twit 0")
+        self.assertEqual(twit.like_count, 2)
+        self.assertEqual(twit.comment_count, 2)
+        self.assertTrue(twit.viewer_liked)
+        self.assertFalse(
+            Twit.objects.for_feed(self.user).get(pk=self.twit.pk).viewer_liked
+        )
+
+
+class ConditionalGetTests(TestCase):
+    """Conditional GET Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Polled twit", user=cls.user)
+
+    def setUp(self):
+        """Log in and start with an empty cache"""
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def revalidate(self, url):
+        """Fetch a page, then fetch it again with its ETag"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_unchanged_feed_is_not_modified(self):
+        """Test an unchanged feed is a 304 that renders nothing"""
+        response = self.revalidate(reverse("twit_list"))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertTemplateNotUsed(response, "twit_list.html")
+
+    def test_likes_and_comments_change_validators(self):
+        """Test likes and comments change the ETag of the feed"""
+        url = reverse("twit_list")
+        etag = self.client.get(url)["ETag"]
+
+        Twit.objects.set_like(self.twit.pk, self.user.pk, True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<span class="like_count">1</span>')
+
+        etag = response["ETag"]
+        Comment.objects.create(twit=self.twit, user=self.user, text="New reply")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "New reply")
+
+    def test_validators_are_per_viewer(self):
+        """Test another user does not match the ETag of the feed"""
+        etag = self.client.get(reverse("twit_list"))["ETag"]
+        other = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        self.client.force_login(other)
+        response = self.client.get(reverse("twit_list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_page_is_not_modified(self):
+        """Test an unchanged comment page is a 304"""
+        url = reverse("comment_new", kwargs={"pk": self.twit.pk})
+        self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_profile_change_changes_validators(self):
+        """Test renaming the author of a twit changes the ETag of the feed"""
+        url = reverse("twit_list")
+        etag = self.client.get(url)["ETag"]
+        self.user.first_name = "Renamed"
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Renamed")
+
+    def test_messages_are_not_validated(self):
+        """Test a page showing messages is rendered and has no ETag"""
+        url = reverse("twit_list")
+        etag = self.client.get(url)["ETag"]
+        with mock.patch(
+            "tweeter.conditional.get_messages", return_value=["Flashed message"]
+        ):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertEqual(self.revalidate(url).status_code, 304)
+
+
+class RequestTimingTests(TestCase):
+    """Request Timing Middleware Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        twit = Twit.objects.create(body="Timed twit", user=cls.user)
+        Comment.objects.create(twit=twit, user=cls.user, text="Timed reply")
+
+    def setUp(self):
+        """Log in and start with an empty cache"""
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        """Test the feed reports its db, template and avatar time to staff"""
+        self.assertNotIn("Server-Timing", self.client.get(reverse("twit_list")))
+
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        cache.clear()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        metrics = [
+            metric.split(";")[0] for metric in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(metrics, ["db", "avatar", "template", "total"])
+
+    def test_async_capable(self):
+        """Test the middleware runs in the async stack without a thread"""
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestTimingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with override_settings(DEBUG=True):
+            response = async_to_sync(middleware)(RequestFactory().get("/"))
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    def test_log_line(self):
+        """Test each request is logged as JSON and slow ones in full"""
+        with self.assertLogs("tweeter.requests", "INFO") as logs:
+            self.client.get(reverse("twit_list"))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        self.assertEqual(line["url_name"], "twit_list")
+        self.assertEqual(line["status"], 200)
+        self.assertLessEqual(len(line["slowest_queries"]), 3)
+        self.assertGreater(line["queries"], 3)
+
+        with override_settings(TWEETER_SLOW_REQUEST_MS=0):
+            with self.assertLogs("tweeter.requests", "WARNING") as logs:
+                self.client.get(reverse("twit_list"))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(len(line["slowest_queries"]), line["queries"])
+
+
+class WarmUpTests(TestCase):
+    """Worker Warm-Up Tests"""
+
+    def test_warm_up(self):
+        """Test every project template is compiled and every URL resolved"""
+        loader = engines["django"].engine.template_loaders[0]
+        loader.reset()
+        timings = warm_up()
+
+        names = template_names()
+        self.assertIn("partials/_twit_box.html", names)
+        self.assertIn("bootstrap5/field.html", names)
+        self.assertFalse(any(name.startswith("admin/") for name in names))
+        self.assertTrue(set(names) <= set(loader.get_template_cache))
+        self.assertEqual(timings["templates"][0], len(names))
+
+        resolved = dict(named_urls())
+        self.assertEqual(resolved["twit_like"], ["pk"])
+        self.assertIn("admin:index", resolved)
+        # Only admin:app_list cannot be reversed, it takes an app label
+        self.assertEqual(timings["urls"][0], len(resolved) - 1)
+        self.assertEqual(timings["database"][0], 1)
+
+    def test_warm_up_command(self):
+        """Test the command runs the chosen steps"""
+        out = StringIO()
+        call_command("warm_up", "urls", stdout=out)
+        self.assertIn("Warmed up urls", out.getvalue())
+        self.assertNotIn("templates", out.getvalue())
+
+        out = StringIO()
+        call_command("warm_up", stdout=out)
+        for step in ("templates", "urls", "database"):
+            self.assertIn(step, out.getvalue())
+        with self.assertRaisesMessage(CommandError, "Unknown steps: caches"):
+            call_command("warm_up", "caches")
+
+
+class AssetBundleTests(TestCase):
+    """Front-End Asset Bundle Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+
+    def setUp(self):
+        """Log in and forget which bundles were found built"""
+        self.client.force_login(self.user)
+        is_built.cache_clear()
+        self.addCleanup(is_built.cache_clear)
+
+    def test_unbuilt_bundles(self):
+        """Test pages link the deferred parts until the bundles are built"""
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, "bootstrap.bundle.min.js")
+        self.assertContains(response, "/static/js/base.")
+        self.assertContains(response, 'defer integrity="sha384-', count=1)
+        self.assertNotContains(response, "popper")
+        self.assertNotContains(response, "datepicker")
+
+        response = self.client.get(reverse("profile", args=[self.user.pk]))
+        self.assertContains(response, "bootstrap-datepicker.min.js")
+        self.assertContains(response, "/static/js/datepicker.")
+
+    @override_settings(TWEETER_REQUIRE_BUNDLES=True)
+    def test_missing_bundle_required(self):
+        """Test pages fail instead of linking the CDNs when bundles are required"""
+        with self.assertRaisesMessage(ImproperlyConfigured, "dist/site.css"):
+            self.client.get(reverse("twit_list"))
+
+    def test_bundle_assets(self):
+        """Test the command checks the vendor files and builds the bundles"""
+        static_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(static_dir.cleanup)
+        root = Path(static_dir.name)
+        for path in ["css/base.css", "js/base.js", "js/datepicker.js"]:
+            (root / path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(settings.BASE_DIR / "static" / path, root / path)
+        for path in VENDOR:
+            (root / path).parent.mkdir(parents=True, exist_ok=True)
+            (root / path).write_bytes(b"/* vendor */\n")
+        (root / "vendor/bootstrap-icons/bootstrap-icons.css").write_bytes(
+            b'@font-face { src: url("./fonts/bootstrap-icons.woff2?1") }\n'
+            b"/*# sourceMappingURL=bootstrap-icons.css.map */\n"
+        )
+
+        with override_settings(
+            STATICFILES_DIRS=[root],
+            STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage",
+        ):
+            # The placeholder Bootstrap files do not match the pinned hashes
+            with self.assertRaisesMessage(CommandError, "integrity hash"):
+                call_command("bundle_assets", "--offline", stdout=StringIO())
+
+            unpinned = {path: (url, None) for path, (url, _) in VENDOR.items()}
+            with mock.patch.dict(VENDOR, unpinned):
+                call_command("bundle_assets", "--offline", stdout=StringIO())
+            site_css = (root / "dist/site.css").read_text()
+            self.assertIn(
+                'url("../vendor/bootstrap-icons/fonts/bootstrap-icons.woff2?1")',
+                site_css,
+            )
+            self.assertNotIn("sourceMappingURL", site_css)
+            self.assertIn("jQuery", (root / "dist/site.js").read_text())
+            lock = json.loads((root / "vendor/integrity.json").read_text())
+            self.assertEqual(set(lock), set(VENDOR))
+
+            is_built.cache_clear()
+            response = self.client.get(reverse("twit_list"))
+            self.assertContains(
+                response, '<script src="/static/dist/site.js" defer></script>'
+            )
+            self.assertNotContains(response, "cdn.jsdelivr.net")
+
+
+class TwitCounterTests(TestCase):
+    """Twit Counter Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Counted twit", user=cls.user)
+
+    def assertCounts(self, like_count, comment_count):
+        """Assert the stored counters of the test twit"""
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.like_count, like_count)
+        self.assertEqual(self.twit.comment_count, comment_count)
+
+    def test_like_counter(self):
+        """Test like counter follows adds and removes from both sides"""
+        self.twit.likes.add(self.user, self.other_user)
+        self.twit.likes.add(self.user)
+        self.assertCounts(2, 0)
+        self.other_user.liked_twits.remove(self.twit)
+        self.assertCounts(1, 0)
+        self.other_user.liked_twits.add(self.twit)
+        self.assertCounts(2, 0)
+        self.user.liked_twits.clear()
+        self.assertCounts(1, 0)
+        self.twit.likes.clear()
+        self.assertCounts(0, 0)
+
+    def test_comment_counter(self):
+        """Test comment counter follows creates and deletes"""
+        comment = Comment.objects.create(twit=self.twit, user=self.user, text="Hi")
+        Comment.objects.create(twit=self.twit, user=self.other_user, text="Hey")
+        self.assertCounts(0, 2)
+        comment.delete()
+        self.assertCounts(0, 1)
+
+    def test_save_keeps_counters(self):
+        """Test saving a stale twit does not overwrite the counters"""
+        stale = Twit.objects.get(pk=self.twit.pk)
+        self.twit.likes.add(self.other_user)
+        stale.body = "Edited twit"
+        stale.save()
+        self.assertCounts(1, 0)
+        self.assertEqual(self.twit.body, "Edited twit")
+
+    def test_like_view_updates_counter(self):
+        """Test like view updates the counter"""
+        self.client.force_login(self.other_user)
+        self.client.post(self.twit.get_like_url(), {"twit_action": "like"})
+        self.assertCounts(1, 0)
+
+    def test_rebuild_twit_counters(self):
+        """Test rebuild_twit_counters repairs drifted counters"""
+        self.twit.likes.add(self.user)
+        Comment.objects.create(twit=self.twit, user=self.user, text="Hi")
+        Twit.objects.update(like_count=7, comment_count=7)
+        call_command("rebuild_twit_counters", batch_size=1, stdout=StringIO())
+        self.assertCounts(1, 1)
+
+    def assertStats(self, user, twit_count, comment_count, likes_received):
+        """Assert the stored stats of a user"""
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.twit_count, stats.comment_count, stats.likes_received),
+            (twit_count, comment_count, likes_received),
+        )
+        return stats
+
+    def test_user_stats(self):
+        """Test user stats follow twits, comments and likes"""
+        self.assertStats(self.user, 1, 0, 0)
+        Twit.objects.set_like(self.twit.pk, self.other_user.pk, True)
+        Twit.objects.set_like(self.twit.pk, self.other_user.pk, True)
+        self.twit.likes.add(self.user)
+        Comment.objects.create(twit=self.twit, user=self.other_user, text="Hi")
+        self.assertStats(self.user, 1, 0, 2)
+        stats = self.assertStats(self.other_user, 0, 1, 0)
+        self.assertIsNotNone(stats.last_active_at)
+
+        self.user.liked_twits.clear()
+        self.assertStats(self.user, 1, 0, 1)
+        self.twit.delete()
+        self.assertStats(self.user, 0, 0, 0)
+        self.assertStats(self.other_user, 0, 0, 0)
+
+    def test_likes_received_deltas(self):
+        """Test removing missing likes leaves the likes received alone"""
+        self.twit.likes.add(self.user, self.other_user)
+        other_twit = Twit.objects.create(body="Other twit", user=self.other_user)
+        other_twit.likes.add(self.user)
+        self.twit.likes.remove(self.other_user)
+        self.twit.likes.remove(self.other_user)
+        self.other_user.liked_twits.remove(self.twit)
+        self.assertStats(self.user, 1, 0, 1)
+        self.user.liked_twits.clear()
+        self.assertStats(self.user, 1, 0, 0)
+        self.assertStats(self.other_user, 1, 0, 0)
+
+    def test_deleted_user_likes(self):
+        """Test deleting a user takes their likes off twits and authors"""
+        self.twit.likes.add(self.user, self.other_user)
+        self.other_user.delete()
+        self.assertCounts(1, 0)
+        self.assertStats(self.user, 1, 0, 1)
+
+    def test_rebuild_user_stats(self):
+        """Test rebuild_user_stats repairs drifted and missing stats"""
+        self.twit.likes.add(self.other_user)
+        UserStats.objects.filter(user=self.user).update(twit_count=7)
+        UserStats.objects.filter(user=self.other_user).delete()
+        call_command("rebuild_user_stats", batch_size=1, stdout=StringIO())
+        self.assertStats(self.user, 1, 0, 1)
+        self.assertStats(self.other_user, 0, 0, 0)
+
+
+class HomeTimelineTests(TestCase):
+    """Home Timeline Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.author = get_user_model().objects.create_user(
+            username="author",
+            email="author@email.com",
+            password="secret",
+        )
+        cls.stranger = get_user_model().objects.create_user(
+            username="stranger",
+            email="stranger@email.com",
+            password="secret",
+        )
+        Follow.objects.create(follower=cls.user, followed=cls.author)
+        get_user_model().objects.filter(pk=cls.author.pk).update(follower_count=1)
+
+    def post_twit(self, user, body):
+        """Post a twit through the create view"""
+        self.client.force_login(user)
+        self.client.post(reverse("twit_new"), {"body": body, "image_url": ""})
+
+    def test_create_fans_out_to_followers(self):
+        """Test creating a twit fans out to followers"""
+        self.post_twit(self.author, "Followed twit")
+        self.post_twit(self.stranger, "Stranger twit")
+        twit = Twit.objects.get(body="Followed twit")
+        self.assertTrue(
+            TimelineEntry.objects.filter(owner=self.user, twit=twit).exists()
+        )
+        self.assertTrue(
+            TimelineEntry.objects.filter(owner=self.author, twit=twit).exists()
+        )
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("home_timeline"))
+        self.assertContains(response, "Followed twit")
+        self.assertNotContains(response, "Stranger twit")
+
+    @override_settings(TWEETER_FANOUT_FOLLOWER_LIMIT=0)
+    def test_high_fanout_authors_are_pulled(self):
+        """Test twits from high fanout authors are pulled on read"""
+        self.post_twit(self.author, "Celebrity twit")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+        self.post_twit(self.user, "Own twit")
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("home_timeline"))
+        self.assertEqual(
+            [twit.body for twit in response.context["twit_list"]],
+            ["Own twit", "Celebrity twit"],
+        )
+
+    @override_settings(TWEETER_TIMELINE_BACKFILL=2)
+    def test_migration_backfills_timelines(self):
+        """Test the backfill migration materializes the existing twits"""
+        for i in range(3):
+            Twit.objects.create(body=f"Old {i}", user=self.author)
+        Twit.objects.create(body="Stranger twit", user=self.stranger)
+        migration = import_module("tweeter.migrations.0010_backfill_timelines")
+        migration.backfill_timelines(django_apps, None)
+
+        timeline = TimelineEntry.objects.filter(owner=self.user)
+        self.assertEqual([entry.twit.body for entry in timeline], ["Old 2", "Old 1"])
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.author).count(), 2)
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.stranger).count(), 1)
+
+    @override_settings(TWEETER_FANOUT_FOLLOWER_LIMIT=0)
+    def test_merged_timeline_pages(self):
+        """Test merged pages keep cursor order across both sources"""
+        for i in range(3):
+            self.post_twit(self.author, f"Pulled {i}")
+            self.post_twit(self.user, f"Pushed {i}")
+
+        first = home_page(self.user, 4)
+        self.assertEqual(
+            [twit.body for twit in first],
+            ["Pushed 2", "Pulled 2", "Pushed 1", "Pulled 1"],
+        )
+        second = home_page(self.user, 4, older=first.older_cursor)
+        self.assertEqual([twit.body for twit in second], ["Pushed 0", "Pulled 0"])
+        self.assertFalse(second.has_older)
+        back = home_page(self.user, 4, newer=second.newer_cursor)
+        self.assertEqual(back.object_list, first.object_list)
+
+
+class TwitFragmentCacheTests(TestCase):
+    """Twit Fragment Cache Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Cached twit", user=cls.user)
+
+    def setUp(self):
+        """Start every test with an empty cache"""
+        cache.clear()
+
+    def cached_fragment(self):
+        """Get the cached fragment of the test twit, if any"""
+        _, shared = cache.get(twit_box_key(Twit.objects.get(pk=self.twit.pk)))
+        return shared
+
+    def test_feed_fills_cache(self):
+        """Test rendering the feed caches the shared twit fragment"""
+        self.client.force_login(self.user)
+        self.client.get(reverse("twit_list"))
+        self.assertIn("Cached twit", self.cached_fragment())
+
+    def test_viewer_parts_are_not_shared(self):
+        """Test edit buttons and like state are rendered per viewer"""
+        self.twit.likes.add(self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, reverse("twit_edit", args=[self.twit.pk]))
+        self.assertContains(response, "bi-hand-thumbs-up-fill")
+
+        self.client.force_login(self.other_user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, "Cached twit")
+        self.assertNotContains(response, reverse("twit_edit", args=[self.twit.pk]))
+        self.assertNotContains(response, "bi-hand-thumbs-up-fill")
+        self.assertContains(response, '<span class="like_count">1</span>')
+
+    def test_edit_and_comment_change_version(self):
+        """Test edits and comments show up instead of the cached fragment"""
+        self.client.force_login(self.user)
+        self.client.get(reverse("twit_list"))
+        self.client.post(
+            reverse("twit_edit", args=[self.twit.pk]),
+            {"body": "Edited twit", "image_url": ""},
+        )
+        self.client.post(
+            reverse("comment_new", args=[self.twit.pk]), {"text": "Fresh comment"}
+        )
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, "Edited twit")
+        self.assertContains(response, "Fresh comment")
+        self.assertNotContains(response, "Cached twit")
+
+    def test_profile_change_expires_fragments(self):
+        """Test new names of authors and commenters replace cached ones"""
+        Comment.objects.create(twit=self.twit, user=self.other_user, text="Hi")
+        self.client.force_login(self.user)
+        self.client.get(reverse("twit_list"))
+        self.user.first_name = "Renamed"
+        self.user.save()
+        self.other_user.username = "commenter"
+        self.other_user.save()
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, "Renamed")
+        self.assertContains(response, "commenter")
+        self.assertNotContains(response, "otheruser")
+
+
+class TwitLikeViewTests(TestCase):
+    """Twit Like View Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Likeable twit", user=cls.user)
+
+    def like(self, action, url=None):
+        """Post a like action and return the response"""
+        self.client.force_login(self.user)
+        return self.client.post(
+            url or self.twit.get_like_url(), {"twit_action": action}
+        )
+
+    def test_like_is_idempotent(self):
+        """Test liking twice counts once and returns the real count"""
+        self.assertEqual(
+            self.like("like").json(),
+            {"success": True, "liked": True, "like_count": 1},
+        )
+        self.assertEqual(self.like("like").json()["like_count"], 1)
+        self.assertTrue(self.twit.likes.filter(pk=self.user.pk).exists())
+
+    def test_unlike_is_idempotent(self):
+        """Test unliking twice uncounts once"""
+        self.like("like")
+        self.assertEqual(
+            self.like("unlike").json(),
+            {"success": True, "liked": False, "like_count": 0},
+        )
+        self.assertEqual(self.like("unlike").json()["like_count"], 0)
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.like_count, 0)
+
+    def test_unknown_twit_is_404(self):
+        """Test liking an unknown twit is a 404"""
+        response = self.like("like", reverse("twit_like", kwargs={"pk": 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_bad_action_and_get_are_rejected(self):
+        """Test bad actions and GET requests are rejected"""
+        self.assertEqual(self.like("love").status_code, 400)
+        self.assertEqual(self.client.get(self.twit.get_like_url()).status_code, 405)
+
+
+@override_settings(TWEETER_LIKE_BUFFER=True)
+class LikeBufferTests(TestCase):
+    """Like Buffer Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Viral twit", user=cls.user)
+
+    def setUp(self):
+        """Start every test with an empty buffer"""
+        cache.clear()
+
+    def like(self, user, action):
+        """Post a like action as a user and return the answered count"""
+        self.client.force_login(user)
+        response = self.client.post(self.twit.get_like_url(), {"twit_action": action})
+        return response.json()["like_count"]
+
+    def test_buffered_like_is_visible_before_flush(self):
+        """Test a buffered like shows up before it is written"""
+        self.assertEqual(self.like(self.user, "like"), 1)
+        self.assertEqual(self.like(self.user, "like"), 1)
+        self.assertEqual(self.like(self.other_user, "like"), 2)
+        self.assertFalse(self.twit.likes.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, '<span class="like_count">2</span>')
+        self.assertContains(response, "bi-hand-thumbs-up-fill")
+
+    def test_flush_coalesces_and_writes(self):
+        """Test flushing coalesces events per user and twit"""
+        self.like(self.user, "like")
+        self.like(self.user, "unlike")
+        self.like(self.user, "like")
+        self.like(self.other_user, "like")
+        self.like(self.other_user, "unlike")
+
+        self.assertEqual(flush(), 5)
+        self.assertEqual(list(self.twit.likes.all()), [self.user])
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.like_count, 1)
+        # Nothing is pending any more, so readers see the stored count
+        self.assertEqual(self.like(self.user, "like"), 1)
+        self.assertEqual(flush(), 0)
+
+    def test_flush_counts_likes_received(self):
+        """Test flushing adds the likes that changed to the author's stats"""
+        self.twit.likes.add(self.other_user)
+        self.like(self.user, "like")
+        self.like(self.other_user, "unlike")
+        self.like(self.other_user, "like")
+        flush()
+        self.assertEqual(UserStats.objects.get(user=self.user).likes_received, 2)
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.like_count, 2)
+
+    def test_evicted_sequence(self):
+        """Test likes buffered around an evicted sequence are all written"""
+        self.like(self.user, "like")
+        cache.delete(f"likes:{current_epoch()}:sequence")
+        self.assertEqual(self.like(self.other_user, "like"), 1)
+        self.assertEqual(flush(), 2)
+        self.assertEqual(self.twit.likes.count(), 2)
+        self.assertEqual(self.like(self.user, "like"), 2)
+
+    def test_evicted_event(self):
+        """Test a lost event stops counting once the flusher gives up on it"""
+        self.like(self.user, "like")
+        self.like(self.other_user, "like")
+        cache.delete(f"likes:{current_epoch()}:event:1")
+        self.assertEqual(flush(), 0)
+        self.assertEqual(flush(), 1)
+        self.assertEqual(list(self.twit.likes.all()), [self.other_user])
+        self.assertEqual(self.like(self.other_user, "like"), 1)
+        self.assertEqual(flush(), 0)
+
+    def test_flush_command(self):
+        """Test flush_like_buffer applies buffered likes"""
+        self.like(self.other_user, "like")
+        out = StringIO()
+        call_command("flush_like_buffer", stdout=out)
+        self.assertIn("Flushed 1 like events.", out.getvalue())
+        self.assertTrue(self.twit.likes.filter(pk=self.other_user.pk).exists())
+
+
+@override_settings(TWEETER_COMMENT_PREVIEW=2, TWEETER_COMMENT_PAGE_SIZE=2)
+class CommentPreviewTests(TestCase):
+    """Comment Preview Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Busy thread", user=cls.user)
+        cls.quiet_twit = Twit.objects.create(body="Quiet thread", user=cls.user)
+        for i in range(5):
+            Comment.objects.create(twit=cls.twit, user=cls.user, text=f"Reply {i}")
+        Comment.objects.create(twit=cls.quiet_twit, user=cls.user, text="Only reply")
+
+    def setUp(self):
+        """Start every test with an empty cache"""
+        cache.clear()
+
+    def test_latest_per_twit(self):
+        """Test the window query picks the latest comments of each twit"""
+        comments = Comment.objects.latest_per_twit(
+            [self.twit.pk, self.quiet_twit.pk], 2
+        ).order_by("pk")
+        self.assertEqual(
+            [comment.text for comment in comments],
+            ["Reply 3", "Reply 4", "Only reply"],
+        )
+
+    def test_feed_shows_preview(self):
+        """Test the feed only shows the latest comments"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, "Reply 3")
+        self.assertContains(response, "Reply 4")
+        self.assertContains(response, "Only reply")
+        self.assertNotContains(response, "Reply 2")
+        self.assertContains(response, "Show earlier comments", count=1)
+
+    def test_stale_comment_count(self):
+        """Test a counter ahead of the comments does not break the feed"""
+        Twit.objects.filter(pk=self.quiet_twit.pk).update(comment_count=3)
+        Comment.objects.filter(twit=self.quiet_twit)._raw_delete(connection.alias)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Show earlier comments", count=1)
+
+    def test_earlier_comments_endpoint(self):
+        """Test earlier comments are paged from the preview cursor"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_list"))
+        url = response.context["twit_list"][1].earlier_comments_cursor
+        response = self.client.get(
+            reverse("twit_comments", args=[self.twit.pk]), {"older": url}
+        )
+        data = response.json()
+        self.assertLess(data["html"].index("Reply 1"), data["html"].index("Reply 2"))
+        self.assertNotIn("Reply 3", data["html"])
+
+        data = self.client.get(data["older_url"]).json()
+        self.assertIn("Reply 0", data["html"])
+        self.assertIsNone(data["older_url"])
+
+    def test_comment_page_pages_thread(self):
+        """Test the comment page shows the latest page and links the rest"""
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("comment_new", args=[self.twit.pk]))
+        self.assertContains(response, "Reply 3")
+        self.assertContains(response, "Reply 4")
+        self.assertNotContains(response, "Reply 2")
+        self.assertContains(response, "Show earlier comments", count=1)
+        comment_queries = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT")
+            and 'FROM "tweeter_comment"' in query["sql"]
+        ]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertIn("LIMIT 3", comment_queries[0])
+
+        response = self.client.get(reverse("comment_new", args=[self.quiet_twit.pk]))
+        self.assertContains(response, "Only reply")
+        self.assertNotContains(response, "Show earlier comments")
+
+
+class ExportViewTests(TestCase):
+    """Export View Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        cls.twits = [
+            Twit.objects.create(body=f"Exported {i}", user=cls.user) for i in range(3)
+        ]
+        cls.other_twit = Twit.objects.create(body="Other export", user=cls.other_user)
+        Comment.objects.create(twit=cls.twits[0], user=cls.other_user, text="Reply")
+
+    def export(self, name, **params):
+        """Stream an export and parse its lines"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_twit_export(self):
+        """Test twit export streams every twit oldest first"""
+        rows = self.export("twit_export")
+        self.assertEqual(
+            [row["body"] for row in rows],
+            ["Exported 0", "Exported 1", "Exported 2", "Other export"],
+        )
+        self.assertEqual(rows[0]["user__username"], "testuser")
+
+    def test_twit_export_filters_and_cursor(self):
+        """Test twit export filters and resumes from a cursor"""
+        rows = self.export("twit_export", user=self.user.pk)
+        self.assertEqual(len(rows), 3)
+        rows = self.export("twit_export", user=self.user.pk, after=rows[1]["cursor"])
+        self.assertEqual([row["body"] for row in rows], ["Exported 2"])
+        rows = self.export("twit_export", until=self.twits[1].created_at.isoformat())
+        self.assertEqual([row["body"] for row in rows], ["Exported 0"])
+
+    def test_comment_export(self):
+        """Test comment export"""
+        rows = self.export("comment_export", twit=self.twits[0].pk)
+        self.assertEqual([row["text"] for row in rows], ["Reply"])
+        self.assertEqual(self.export("comment_export", twit=self.other_twit.pk), [])
+
+    def test_bad_filter_is_400(self):
+        """Test bad filters are rejected before streaming"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("twit_export"), {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(TestCase):
+    """Async View Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Async twit", user=cls.user)
+
+    def call(self, view_class, request, **kwargs):
+        """Run an async view for a request made by the test user"""
+        if not hasattr(request, "user"):
+            request.user = self.user
+        response = async_to_sync(view_class.as_view())(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def test_async_list_view(self):
+        """Test async list view renders the feed"""
+        response = self.call(AsyncTwitListView, RequestFactory().get("/twits/"))
+        self.assertContains(response, "Async twit")
+
+    def test_async_list_view_requires_login(self):
+        """Test async list view redirects anonymous users"""
+        request = RequestFactory().get("/twits/")
+        request.user = AnonymousUser()
+        response = self.call(AsyncTwitListView, request)
+        self.assertEqual(response.status_code, 302)
+
+    def test_async_like_view(self):
+        """Test async like view likes and 404s"""
+        request = RequestFactory().post("/", {"twit_action": "like"})
+        response = self.call(AsyncTwitLikeView, request, pk=self.twit.pk)
+        self.assertEqual(json.loads(response.content)["like_count"], 1)
+        with self.assertRaises(Http404):
+            self.call(AsyncTwitLikeView, request, pk=999)
+
+    def test_async_comment_view(self):
+        """Test async comment view shows the form and saves comments"""
+        response = self.call(
+            AsyncTwitDetailCommentCreateView,
+            RequestFactory().get("/"),
+            pk=self.twit.pk,
+        )
+        self.assertContains(response, "Add New Comment")
+
+        response = self.call(
+            AsyncTwitDetailCommentCreateView,
+            RequestFactory().post("/", {"text": "Async comment"}),
+            pk=self.twit.pk,
+        )
+        self.assertEqual(response.status_code, 302)
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.comment_count, 1)
+
+        response = self.call(
+            AsyncTwitDetailCommentCreateView,
+            RequestFactory().post(
+                "/", {"text": "Async inline"}, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+            ),
+            pk=self.twit.pk,
+        )
+        data = json.loads(response.content)
+        self.assertEqual(data["comment_count"], 2)
+        self.assertIn("Async inline", data["html"])
+
+
+@override_settings(TWEETER_LIVE_UPDATES=True)
+class LiveUpdateTests(TestCase):
+    """Live Update Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Live twit", user=cls.user)
+
+    def setUp(self):
+        """Log in and note the last event published so far"""
+        self.client.force_login(self.user)
+        self.broker = get_broker()
+        self.start = self.broker.last_id
+
+    def published(self):
+        """Events published since the test started as (kind, data)"""
+        return [
+            (kind, json.loads(data))
+            for event_id, kind, data in self.broker.history
+            if event_id > self.start
+        ]
+
+    def stream(self, cookie, last_event_id=None, publish=()):
+        """Run the event stream app, publish events, then disconnect"""
+        headers = [(b"cookie", cookie.encode("latin-1"))]
+        if last_event_id is not None:
+            headers.append((b"last-event-id", str(last_event_id).encode()))
+        scope = {"type": "http", "path": reverse("twit_live"), "headers": headers}
+        sent = []
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            app = asyncio.ensure_future(LiveEventsApp()(scope, receive, send))
+            while not sent and not app.done():
+                await asyncio.sleep(0.01)
+            for kind, data in publish:
+                self.broker.publish(kind, data)
+            await asyncio.sleep(0.05)
+            disconnected.set()
+            await app
+
+        # The test database connection must stay open for the other queries
+        with mock.patch("tweeter.live.close_old_connections"):
+            async_to_sync(run)()
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        return sent[0]["status"], body.decode()
+
+    def test_code_paths_publish(self):
+        """Test new twits, comments and likes are published after commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("twit_new"), {"body": "Pushed twit"})
+            self.client.post(
+                reverse("comment_new", args=[self.twit.pk]), {"text": "Pushed reply"}
+            )
+            self.client.post(
+                reverse("twit_like", args=[self.twit.pk]), {"twit_action": "like"}
+            )
+
+        (_, twit), (_, comment), (_, like) = self.published()
+        self.assertEqual(
+            [kind for kind, _ in self.published()], ["twit", "comment", "like"]
+        )
+        new_twit = Twit.objects.get(body="Pushed twit")
+        self.assertEqual(twit["id"], new_twit.pk)
+        self.assertIn("Pushed twit", twit["html"])
+        self.assertIn(OWNER_BUTTONS_SLOT, twit["html"])
+        self.assertIn(reverse("twit_edit", args=[new_twit.pk]), twit["owner_buttons"])
+        self.assertEqual(comment["twit"], self.twit.pk)
+        self.assertIn("Pushed reply", comment["html"])
+        self.assertEqual(like, {"twit": self.twit.pk, "like_count": 1})
+
+        # Nothing goes out while a transaction is open or when turned off
+        with override_settings(TWEETER_LIVE_UPDATES=False):
+            self.client.post(reverse("twit_new"), {"body": "Quiet twit"})
+        self.client.post(reverse("twit_new"), {"body": "Uncommitted twit"})
+        self.assertEqual(len(self.published()), 3)
+
+    def test_stream(self):
+        """Test the stream sends missed and new events to logged in users"""
+        cookie = self.client.cookies["sessionid"].OutputString()
+        self.broker.publish("like", {"twit": self.twit.pk, "like_count": 3})
+        status, body = self.stream(
+            cookie,
+            last_event_id=self.start,
+            publish=[("like", {"twit": self.twit.pk, "like_count": 4})],
+        )
+        self.assertEqual(status, 200)
+        self.assertIn(f"id: {self.start + 1}\nevent: like\n", body)
+        self.assertIn('"like_count": 3', body)
+        self.assertIn('"like_count": 4', body)
+        self.assertEqual(self.broker.subscriptions, set())
+
+        status, body = self.stream("")
+        self.assertEqual(status, 403)
+
+    def test_feed_pages(self):
+        """Test only the newest page of the feed adds new twits"""
+        response = self.client.get(reverse("twit_list"))
+        self.assertContains(response, 'data-live-new-twits="true"')
+        self.assertContains(response, f'data-live-url="{reverse("twit_live")}"')
+        response = self.client.get(reverse("home_timeline"))
+        self.assertContains(response, "data-live-url")
+        self.assertNotContains(response, "data-live-new-twits")
+
+        # Served by Django the stream is not there, which stops EventSource
+        self.assertEqual(self.client.get(reverse("twit_live")).status_code, 204)
+        with override_settings(TWEETER_LIVE_UPDATES=False):
+            response = self.client.get(reverse("twit_list"))
+        self.assertNotContains(response, "data-live-url")
+
+
+class SearchTests(TestCase):
+    """Search Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twits = [
+            Twit.objects.create(body=f"Gardening tip number {i}", user=cls.user)
+            for i in range(5)
+        ]
+        cls.other = Twit.objects.create(body="Cooking with garlic", user=cls.user)
+        Comment.objects.create(
+            twit=cls.other, user=cls.user, text="Gardening grows garlic too"
+        )
+        index_twits(*[twit.pk for twit in [*cls.twits, cls.other]])
+
+    def setUp(self):
+        """Log in"""
+        self.client.force_login(self.user)
+
+    def test_search_ranks_and_pages(self):
+        """Test body matches rank above comment matches across pages"""
+        rows, cursor = search_twits("gardening", 4)
+        self.assertEqual(len(rows), 4)
+        more, last = search_twits("gardening", 4, after=cursor)
+        self.assertIsNone(last)
+        ids = [twit_id for twit_id, _ in rows + more]
+        self.assertEqual(len(set(ids)), 6)
+        self.assertEqual(ids[-1], self.other.pk)
+
+    def test_search_ignores_query_syntax(self):
+        """Test operators in the query are treated as plain words"""
+        rows, _ = search_twits('"garlic* -(cooking', 10)
+        self.assertEqual([twit_id for twit_id, _ in rows], [self.other.pk])
+        self.assertEqual(search_twits("  *  ", 10), ([], None))
+
+    def test_views_keep_index_current(self):
+        """Test creating, editing and commenting update the index"""
+        self.client.post(reverse("twit_new"), {"body": "Brand new kayak"})
+        twit = Twit.objects.get(body="Brand new kayak")
+        response = self.client.get(reverse("twit_search"), {"q": "kayak"})
+        self.assertContains(response, "Brand new kayak")
+
+        self.client.post(
+            reverse("twit_edit", kwargs={"pk": twit.pk}), {"body": "Brand new canoe"}
+        )
+        self.assertEqual(search_twits("kayak", 10), ([], None))
+        self.client.post(
+            reverse("comment_new", kwargs={"pk": twit.pk}), {"text": "Paddles?"}
+        )
+        self.assertEqual(len(search_twits("paddles", 10)[0]), 1)
+
+        self.client.post(reverse("twit_delete", kwargs={"pk": twit.pk}))
+        self.assertEqual(search_twits("canoe", 10), ([], None))
+
+    def test_deletes_leave_no_documents(self):
+        """Test queryset, bulk and cascading deletes remove documents"""
+        Twit.objects.filter(pk=self.twits[0].pk).delete()
+        Twit.objects.filter(pk=self.twits[1].pk).bulk_delete()
+        self.assertEqual(len(search_twits("gardening", 10)[0]), 4)
+        self.user.delete()
+        self.assertEqual(search_twits("gardening", 10), ([], None))
+
+
+# A 1x1 red PNG
+PNG = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06"
+    b"\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\xcf\xc0\xf0\x1f\x00"
+    b"\x05\x00\x01\xff\x89\x99=\x1d\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+
+
+class LocalFetcher:
+    """Image fetcher serving canned images instead of the network"""
+
+    images = {
+        "https://example.com/red.png": PNG,
+        "https://example.com/page.svg": b"<svg onload='alert(1)'></svg>",
+    }
+
+    def fetch(self, url):
+        """Get a canned image"""
+        try:
+            return self.images[url]
+        except KeyError as exc:
+            raise ImageFetchError(f"No image at {url}") from exc
+
+
+class TwitImageTests(TestCase):
+    """Twit Image Proxy Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+
+    def setUp(self):
+        """Log in and fetch into an empty cache with the local fetcher"""
+        cache.clear()
+        self.client.force_login(self.user)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        overrides = override_settings(
+            TWEETER_IMAGE_CACHE_DIR=cache_dir.name,
+            TWEETER_IMAGE_FETCHER="tweeter.tests.LocalFetcher",
+            TWEETER_IMAGE_FETCH_IN_BACKGROUND=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def post_twit(self, image_url, **kwargs):
+        """Create or edit a twit and run the fetch that follows the commit"""
+        url = reverse("twit_edit", kwargs=kwargs) if kwargs else reverse("twit_new")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {"body": "Picture", "image_url": image_url})
+        return Twit.objects.get(body="Picture")
+
+    def test_image_proxy(self):
+        """Test images are fetched once on save and served from the cache"""
+        twit = self.post_twit("https://example.com/red.png")
+        self.assertEqual(twit.image_digest, hashlib.sha256(PNG).hexdigest())
+        image_url = (
+            f"{reverse('twit_image', args=[twit.pk, 'feed'])}?v={twit.image_digest}"
+        )
+        self.assertContains(self.client.get(reverse("twit_list")), image_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(image_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn("immutable", response["Cache-Control"])
+        # The session and user are cached and the twit is not looked up
+        self.assertEqual(len(queries), 0)
+
+        # Evicted files redirect to the original and are fetched again after
+        # the request, outdated versions redirect to the current one
+        shutil.rmtree(settings.TWEETER_IMAGE_CACHE_DIR)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(image_url)
+        self.assertRedirects(
+            response, "https://example.com/red.png", fetch_redirect_response=False
+        )
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(self.client.get(image_url).status_code, 200)
+        response = self.client.get(reverse("twit_image", args=[twit.pk, "feed"]))
+        self.assertRedirects(response, image_url, fetch_redirect_response=False)
+        response = self.client.get(reverse("twit_image", args=[twit.pk, "huge"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_twit_without_image(self):
+        """Test a twit without an image neither clears nor fetches one"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse("twit_new"), {"body": "Words"})
+        self.assertTrue(Twit.objects.filter(body="Words").exists())
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertFalse([sql for sql in updates if "image_digest" in sql])
+        self.assertFalse(callbacks)
+
+    def test_unfetched_images(self):
+        """Test images that cannot be fetched link to the original"""
+        twit = self.post_twit("https://example.com/red.png")
+        for image_url in (
+            "https://example.com/gone.png",
+            "https://example.com/page.svg",
+        ):
+            with self.assertLogs("tweeter.images", "WARNING"):
+                twit = self.post_twit(image_url, pk=twit.pk)
+            self.assertEqual(twit.image_digest, "")
+            self.assertContains(self.client.get(reverse("twit_list")), image_url)
+            response = self.client.get(reverse("twit_image", args=[twit.pk, "feed"]))
+            self.assertRedirects(response, image_url, fetch_redirect_response=False)
+
+    def test_cache_eviction(self):
+        """Test the least recently used files are evicted over the limit"""
+        image_cache = ImageCache(settings.TWEETER_IMAGE_CACHE_DIR, 100)
+        paths = [image_cache.original_path(f"{i:064x}") for i in range(3)]
+        for age, path in enumerate(paths[:2]):
+            image_cache.store(path, b"x" * 40)
+            os.utime(path, (1000 + age, 1000 + age))
+        image_cache.read(paths[0])
+        image_cache.store(paths[2], b"x" * 40)
+        self.assertEqual([path.exists() for path in paths], [True, False, True])
+
+    def test_http_fetcher_checks_urls(self):
+        """Test the HTTP fetcher only fetches from public hosts"""
+        for url in (
+            "file:///etc/passwd",
+            "http://127.0.0.1/image.png",
+            "http://[::1]/image.png",
+        ):
+            with self.assertRaises(ImageFetchError):
+                HttpFetcher.check_url(url)
+        # Names are checked on the address the connection is made to
+        with self.assertRaisesMessage(ImageFetchError, "not a public host"):
+            connect_public(("localhost", 80))
+
+    def test_version_must_be_a_digest(self):
+        """Test versions that are not digests never reach the cache"""
+        twit = self.post_twit("https://example.com/red.png")
+        secret = Path(settings.TWEETER_IMAGE_CACHE_DIR) / "secret.txt"
+        secret.write_bytes(b"secret")
+        version = str(secret).rjust(64, "/")
+        response = self.client.get(
+            reverse("twit_image", args=[twit.pk, "feed"]), {"v": version}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(b"secret", response.content)
+        self.assertFalse(Path(f"{secret}-feed").exists())
+        with self.assertRaises(ValueError):
+            ImageCache(settings.TWEETER_IMAGE_CACHE_DIR, 100).original_path(version)
+
+
+class AdminTests(TestCase):
+    """Admin Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.admin = get_user_model().objects.create_superuser(
+            username="admin",
+            email="admin@email.com",
+            password="secret",
+        )
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.twit = Twit.objects.create(body="Moderate me", user=cls.user)
+        cls.twit.likes.add(cls.admin)
+        for i in range(3):
+            Comment.objects.create(twit=cls.twit, user=cls.admin, text=f"Reply {i}")
+        index_twits(cls.twit.pk)
+
+    def setUp(self):
+        """Log in as the superuser"""
+        self.client.force_login(self.admin)
+
+    @override_settings(TWEETER_ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_changelists_estimate_counts(self):
+        """Test unfiltered lists are not counted and filtered ones are"""
+        for name in ["tweeter_twit", "tweeter_comment", "accounts_customuser"]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f"admin:{name}_changelist"))
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any("COUNT(*)" in query["sql"] for query in queries), name)
+
+        response = self.client.get(
+            reverse("admin:tweeter_comment_changelist"),
+            {"twit__id__exact": self.twit.pk},
+        )
+        self.assertEqual(response.context["cl"].result_count, 3)
+        response = self.client.get(
+            reverse("admin:tweeter_twit_changelist"), {"q": "reply"}
+        )
+        self.assertContains(response, "Moderate me")
+        self.assertNotContains(response, "Only the best")
+
+    @override_settings(TWEETER_ADMIN_SEARCH_LIMIT=2)
+    def test_search_warns_when_truncated(self):
+        """Test searches past the limit are paged up to it and flagged"""
+        for i in range(3):
+            twit = Twit.objects.create(body=f"Moderate me too {i}", user=self.user)
+            index_twits(twit.pk)
+        with mock.patch.object(TwitAdmin, "list_max_show_all", 1):
+            response = self.client.get(
+                reverse("admin:tweeter_twit_changelist"), {"q": "moderate"}
+            )
+        self.assertEqual(response.context["cl"].result_count, 2)
+        self.assertContains(response, "Only the best 2 matches are listed.")
+
+    @override_settings(TWEETER_ADMIN_INLINE_COMMENTS=2)
+    def test_change_page_caps_comments(self):
+        """Test a twit shows its latest comments and links to the rest"""
+        response = self.client.get(
+            reverse("admin:tweeter_twit_change", args=[self.twit.pk])
+        )
+        self.assertContains(response, "Reply 2")
+        self.assertContains(response, "Reply 1")
+        self.assertNotContains(response, "Reply 0")
+        self.assertContains(response, f"?twit__id__exact={self.twit.pk}")
+        # Users are picked with autocomplete, not listed in a <select>
+        self.assertNotContains(response, '<option value="%s">' % self.user.pk)
+
+    def test_bulk_delete_twits(self):
+        """Test deleting twits removes their rows and recounts the stats"""
+        response = self.client.post(
+            reverse("admin:tweeter_twit_changelist"),
+            {"action": "delete_selected", "_selected_action": [self.twit.pk]},
+        )
+        self.assertContains(response, "Comments: 3")
+        self.client.post(
+            reverse("admin:tweeter_twit_changelist"),
+            {
+                "action": "delete_selected",
+                "_selected_action": [self.twit.pk],
+                "post": "yes",
+            },
+        )
+        self.assertFalse(Twit.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Twit.likes.through.objects.exists())
+        self.assertEqual(search_twits("moderate", 10), ([], None))
+        self.assertEqual(UserStats.objects.get(pk=self.user.pk).twit_count, 0)
+        self.assertEqual(UserStats.objects.get(pk=self.admin.pk).comment_count, 0)
+
+    def test_bulk_delete_comments(self):
+        """Test deleting comments recounts their twit and authors"""
+        comment_ids = list(
+            Comment.objects.filter(text__in=["Reply 0", "Reply 1"]).values_list(
+                "pk", flat=True
+            )
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                reverse("admin:tweeter_comment_changelist"),
+                {
+                    "action": "delete_selected",
+                    "_selected_action": comment_ids,
+                    "post": "yes",
+                },
+            )
+        deletes = [q for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 2)  # The comments, then the search row
+        self.twit.refresh_from_db()
+        self.assertEqual(self.twit.comment_count, 1)
+        self.assertEqual(UserStats.objects.get(pk=self.admin.pk).comment_count, 1)
+
+    def test_remove_images(self):
+        """Test the image action clears every selected twit"""
+        Twit.objects.update(image_url="https://example.com/a.png", image_digest="ab")
+        self.client.post(
+            reverse("admin:tweeter_twit_changelist"),
+            {"action": "remove_images", "_selected_action": [self.twit.pk]},
+        )
+        self.assertEqual(
+            list(Twit.objects.values_list("image_url", "image_digest")), [("", "")]
+        )
+
+    def test_remove_unfetched_image_refreshes_feed(self):
+        """Test a removed image leaves the cached feed and its ETag"""
+        cache.clear()
+        Twit.objects.update(image_url="https://example.com/a.png")
+        url = reverse("twit_list")
+        response = self.client.get(url)
+        self.assertContains(response, "https://example.com/a.png")
+        self.client.post(
+            reverse("admin:tweeter_twit_changelist"),
+            {"action": "remove_images", "_selected_action": [self.twit.pk]},
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "https://example.com/a.png")
+
+
+class TransferTests(TestCase):
+    """JSONL Export / Import Tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set Up Test Data"""
+        cls.user = get_user_model().objects.create_user(
+            username="testuser",
+            email="test@email.com",
+            password="secret",
+        )
+        cls.other_user = get_user_model().objects.create_user(
+            username="otheruser",
+            email="other@email.com",
+            password="secret",
+        )
+        for i in range(3):
+            twit = Twit.objects.create(body=f"Exported twit {i}", user=cls.user)
+            twit.likes.add(cls.user, cls.other_user)
+            Comment.objects.create(twit=twit, user=cls.other_user, text=f"Reply {i}")
+
+    def setUp(self):
+        """Export everything into a temporary directory"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "export.jsonl")
+        call_command("export_jsonl", self.path)
+        with open(self.path, encoding="utf-8") as stream:
+            self.lines = stream.readlines()
+
+    def import_file(self, **options):
+        """Run import_jsonl on the export"""
+        call_command("import_jsonl", self.path, stdout=StringIO(), **options)
+
+    def test_export_lines(self):
+        """Test every row is one line in import order"""
+        models = [json.loads(line)["model"] for line in self.lines]
+        self.assertEqual(
+            models, ["user"] * 2 + ["twit"] * 3 + ["comment"] * 3 + ["like"] * 6
+        )
+
+    def test_import_remaps_ids(self):
+        """Test an import into a database with other rows"""
+        get_user_model().objects.filter(username="otheruser").delete()
+        created_at = Twit.objects.get(body="Exported twit 0").created_at
+
+        self.import_file(batch_size=2)
+        self.assertEqual(get_user_model().objects.count(), 2)
+        self.assertEqual(Twit.objects.count(), 6)
+        self.assertEqual(Comment.objects.count(), 3)
+
+        copy = Twit.objects.filter(body="Exported twit 0").latest("pk")
+        self.assertEqual(copy.created_at, created_at)
+        self.assertEqual((copy.like_count, copy.comment_count), (2, 1))
+        self.assertEqual(copy.comments.get().user.username, "otheruser")
+        self.assertEqual(len(search_twits("reply", 10)[0]), 3)
+
+    def test_import_resumes_from_checkpoint(self):
+        """Test a failed import continues after the last finished batch"""
+        get_user_model().objects.all().delete()
+        broken = self.lines[:6] + ['{"model": "comment", "twit": 999}\n']
+        with open(self.path, "w", encoding="utf-8") as stream:
+            stream.writelines(broken + self.lines[6:])
+        with self.assertRaises(CommandError):
+            self.import_file(batch_size=2)
+        self.assertEqual(Twit.objects.count(), 3)
+
+        with open(self.path, "w", encoding="utf-8") as stream:
+            stream.writelines(broken[:6] + ["\n"] + self.lines[6:])
+        self.import_file(batch_size=2)
+        self.assertEqual(Twit.objects.count(), 3)
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertEqual(sum(Twit.objects.values_list("like_count", flat=True)), 6)
+
+    def test_resume_after_commit(self):
+        """Test a batch committed before its checkpoint is not imported twice"""
+        get_user_model().objects.all().delete()
+        advance = Checkpoint.advance
+        calls = []
+
+        def stop_after_twits(checkpoint):
+            calls.append(checkpoint)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            advance(checkpoint)
+
+        with mock.patch.object(Checkpoint, "advance", stop_after_twits):
+            with self.assertRaises(KeyboardInterrupt):
+                self.import_file(batch_size=2)
+        self.assertEqual(Twit.objects.count(), 2)
+
+        self.import_file(batch_size=2)
+        self.assertEqual(get_user_model().objects.count(), 2)
+        self.assertEqual(Twit.objects.count(), 3)
+        self.assertEqual(Comment.objects.count(), 3)
+
+
+class BenchmarkTests(TestCase):
+    """Seed Data / Benchmark Tests"""
+
+    def test_seed_and_benchmark(self):
+        """Test seeding a small data set and benchmarking every route"""
+        call_command("seed_data", twits=200, stdout=StringIO())
+        self.assertEqual(Twit.objects.count(), 200)
+        self.assertEqual(get_user_model().objects.count(), 10)
+        self.assertTrue(TimelineEntry.objects.exists())
+        with self.assertRaises(CommandError):
+            call_command("seed_data", twits=10, stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "benchmark.json")
+            out = StringIO()
+            call_command("benchmark", requests=2, output=path, stdout=out)
+            with open(path, encoding="utf-8") as stream:
+                results = json.load(stream)
+
+        self.assertNotIn("Not benchmarked", out.getvalue())
+        self.assertEqual(results["meta"]["twits"], 200)
+        self.assertEqual(results["routes"]["twit_list"]["status"], 200)
+        self.assertGreater(results["routes"]["twit_list"]["queries"], 0)
+        # Writes made while benchmarking are rolled back
+        self.assertEqual(Twit.objects.count(), 200)
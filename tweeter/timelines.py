@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from accounts.models import Follow
+
+from .models import TimelineEntry, Twit
+from .pagination import KeysetPage, KeysetPaginator
+
+
+def _is_high_fanout(user_id):
+    """Whether an author has too many followers to fan out on write"""
+    follower_count = (
+        get_user_model()
+        .objects.filter(pk=user_id)
+        .values_list("follower_count", flat=True)
+        .first()
+    )
+    return (follower_count or 0) > settings.TWEETER_FANOUT_FOLLOWER_LIMIT
+
+
+def fan_out(twit):
+    """Insert a new twit into its author's and followers' home timelines.
+
+    Authors over TWEETER_FANOUT_FOLLOWER_LIMIT only get the twit in their
+    own timeline; their followers pull it in when reading instead.
+    """
+    batch_size = settings.TWEETER_FANOUT_BATCH_SIZE
+    entries = [
+        TimelineEntry(
+            owner_id=twit.user_id,
+            twit=twit,
+            twit_created_at=twit.created_at,
+        )
+    ]
+    if not _is_high_fanout(twit.user_id):
+        follower_ids = (
+            Follow.objects.filter(followed_id=twit.user_id)
+            .values_list("follower_id", flat=True)
+            .iterator(chunk_size=batch_size)
+        )
+        for follower_id in follower_ids:
+            entries.append(
+                TimelineEntry(
+                    owner_id=follower_id,
+                    twit=twit,
+                    twit_created_at=twit.created_at,
+                )
+            )
+            if len(entries) >= batch_size:
+                TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill(owner, author):
+    """Copy an author's recent twits into a new follower's timeline"""
+    if _is_high_fanout(author.pk):
+        return
+    recent = Twit.objects.filter(user=author).values_list("pk", "created_at")
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner=owner, twit_id=pk, twit_created_at=created_at)
+            for pk, created_at in recent[: settings.TWEETER_TIMELINE_BACKFILL]
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_author(owner, author):
+    """Take an author's twits out of an ex-follower's timeline"""
+    TimelineEntry.objects.filter(owner=owner, twit__user=author).delete()
+
+
+def home_page(viewer, per_page, older=None, newer=None):
+    """Get one page of a user's home timeline.
+
+    The materialized entries are read with one range scan. Twits from
+    followed high fanout authors are read with the same cursor from the
+    twit table and merged in.
+    """
+    paginator = KeysetPaginator(per_page)
+    entries = KeysetPaginator(
+        per_page, date_field="twit_created_at", pk_field="twit_id"
+    ).page(
+        TimelineEntry.objects.filter(owner=viewer).only("twit_id", "twit_created_at"),
+        older=older,
+        newer=newer,
+    )
+    keys = {(entry.twit_created_at, entry.twit_id) for entry in entries}
+    has_older, has_newer = entries.has_older, entries.has_newer
+
+    pull_ids = list(
+        viewer.following.filter(
+            follower_count__gt=settings.TWEETER_FANOUT_FOLLOWER_LIMIT
+        ).values_list("pk", flat=True)
+    )
+    if pull_ids:
+        pulled = paginator.page(
+            Twit.objects.filter(user__in=pull_ids).only("pk", "created_at"),
+            older=older,
+            newer=newer,
+        )
+        keys.update((twit.created_at, twit.pk) for twit in pulled)
+        has_older = has_older or pulled.has_older
+        has_newer = has_newer or pulled.has_newer
+
+    keys = sorted(keys, reverse=True)
+    if newer:
+        # Keep the rows closest to the cursor, which are the oldest ones
+        has_newer = has_newer or len(keys) > per_page
+        keys = keys[-per_page:]
+    else:
+        has_older = has_older or len(keys) > per_page
+        keys = keys[:per_page]
+
+    twits = Twit.objects.for_feed(viewer).in_bulk([pk for _, pk in keys])
+    object_list = [twits[pk] for _, pk in keys if pk in twits]
+    return KeysetPage(object_list, paginator, has_older, has_newer)
@@ -0,0 +1,309 @@
+"""Streaming JSONL export and import of users, twits, comments and likes.
+
+Every line is one row tagged with its model. Exports write users, twits,
+comments and likes in that order, so each row only refers to rows above it.
+Imports load the rows in batches with bulk_create and give them new ids,
+keeping the map from exported to new ids and the position in the file in a
+side SQLite checkpoint rather than in memory.
+"""
+import datetime
+import sqlite3
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+
+from accounts.models import gravatar_hash
+
+from .models import Comment, Twit, UserStats
+from .search import index_twits
+
+USER_FIELDS = (
+    "username",
+    "password",
+    "email",
+    "first_name",
+    "last_name",
+    "date_of_birth",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+    "last_login",
+    "date_joined",
+)
+TWIT_FIELDS = ("user", "body", "image_url", "created_at", "updated_at")
+COMMENT_FIELDS = ("twit", "user", "text", "created_at", "updated_at")
+
+
+def export_rows():
+    """Get (model, rows) for every model, in the order they are imported"""
+    likes = Twit.likes.through.objects
+    return [
+        ("user", get_user_model().objects.order_by("pk").values("id", *USER_FIELDS)),
+        ("twit", Twit.objects.order_by("pk").values("id", *TWIT_FIELDS)),
+        ("comment", Comment.objects.order_by("pk").values("id", *COMMENT_FIELDS)),
+        ("like", likes.order_by("pk").values("twit", user=F("customuser"))),
+    ]
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    """JSON encoder that keeps the microseconds of datetimes"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Checkpoint:
+    """Progress of an import, kept in a side SQLite file.
+
+    Holds the byte offset of the first line not yet imported and the map
+    from exported ids to the ids the rows got here. A batch is first
+    recorded as pending, before its database transaction commits, and only
+    moves the offset once the commit is done. A batch still pending when an
+    import is resumed is checked against the database, see Importer.resume.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS id_map ("
+            "model TEXT, old_id INTEGER, new_id INTEGER, "
+            "PRIMARY KEY (model, old_id))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS progress ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), offset INTEGER)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), offset INTEGER, "
+            "model TEXT, new_id INTEGER, created_at TEXT)"
+        )
+
+    @property
+    def offset(self):
+        """Byte offset of the first line not yet imported"""
+        row = self.db.execute("SELECT offset FROM progress").fetchone()
+        return row[0] if row else 0
+
+    @property
+    def pending(self):
+        """The (model, new_id, created_at) marker of a pending batch, if any"""
+        return self.db.execute(
+            "SELECT model, new_id, created_at FROM pending"
+        ).fetchone()
+
+    def lookup(self, model, old_ids, chunk_size=500):
+        """Map exported ids of a model to the ids they were imported as"""
+        old_ids = list(old_ids)
+        new_ids = {}
+        for start in range(0, len(old_ids), chunk_size):
+            chunk = old_ids[start : start + chunk_size]
+            new_ids.update(
+                self.db.execute(
+                    "SELECT old_id, new_id FROM id_map WHERE model = ? "
+                    f"AND old_id IN ({', '.join('?' * len(chunk))})",
+                    [model, *chunk],
+                )
+            )
+        return new_ids
+
+    def prepare(self, offset, model, id_pairs, marker=(None, None)):
+        """Record a batch about to be committed and the ids of its rows.
+
+        marker is the (new_id, created_at) of one of its rows, used to tell
+        later whether the batch was committed.
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO id_map (model, old_id, new_id) VALUES (?, ?, ?)",
+            [(model, old_id, new_id) for old_id, new_id in id_pairs],
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO pending (id, offset, model, new_id, created_at) "
+            "VALUES (1, ?, ?, ?, ?)",
+            [offset, model, *marker],
+        )
+        self.db.commit()
+
+    def advance(self):
+        """Move past the pending batch once it has been committed"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO progress (id, offset) "
+            "SELECT 1, offset FROM pending"
+        )
+        self.discard()
+
+    def discard(self):
+        """Forget a pending batch that was not committed"""
+        self.db.execute("DELETE FROM pending")
+        self.db.commit()
+
+    def close(self):
+        """Close the checkpoint file"""
+        self.db.close()
+
+
+def bulk_create_with_timestamps(model, objs, **kwargs):
+    """bulk_create rows keeping the times given for auto_now fields.
+
+    bulk_create sets auto_now and auto_now_add fields to now, so the given
+    times are written back with bulk_update. Call it in a transaction.
+    """
+    fields = [
+        field.attname
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    given = [[getattr(obj, field) for field in fields] for obj in objs]
+    objs = model.objects.bulk_create(objs, **kwargs)
+    for obj, values in zip(objs, given):
+        for field, value in zip(fields, values):
+            setattr(obj, field, value)
+    model.objects.bulk_update(objs, fields, batch_size=kwargs.get("batch_size", 1000))
+    return objs
+
+
+class Importer:
+    """Load batches of exported rows of one model at a time"""
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+
+    def resolve(self, model, records, field):
+        """Map the `field` references of records to imported ids"""
+        new_ids = self.checkpoint.lookup(model, {record[field] for record in records})
+        for record in records:
+            if record[field] not in new_ids:
+                raise CommandError(
+                    f"{record.get('model')} {record.get('id', '')} refers to "
+                    f"{model} {record[field]}, which has not been imported"
+                )
+        return [new_ids[record[field]] for record in records]
+
+    def resume(self):
+        """Settle a batch left pending by an import that stopped.
+
+        Users and likes can be loaded twice, so their batch is loaded
+        again. Twits and comments keep their exported times, so the batch
+        was committed if one of its rows is here with the same time.
+        """
+        pending = self.checkpoint.pending
+        if pending is None:
+            return
+        model, new_id, created_at = pending
+        models = {"twit": Twit, "comment": Comment}
+        if (
+            model in models
+            and models[model].objects.filter(pk=new_id, created_at=created_at).exists()
+        ):
+            self.checkpoint.advance()
+        else:
+            self.checkpoint.discard()
+
+    def load(self, model, records, offset):
+        """Import a batch in one transaction, up to the offset after it"""
+        loader = getattr(self, f"load_{model}s", None)
+        if loader is None:
+            raise CommandError(f"Unknown model {model!r}")
+        with transaction.atomic():
+            id_pairs = loader(records)
+            marker = (None, None)
+            if id_pairs and "created_at" in records[-1]:
+                marker = (id_pairs[-1][1], records[-1]["created_at"])
+            self.checkpoint.prepare(offset, model, id_pairs, marker)
+        self.checkpoint.advance()
+
+    def load_users(self, records):
+        """Create users, reusing existing users with the same username"""
+        user_model = get_user_model()
+        usernames = dict(
+            user_model.objects.filter(
+                username__in=[record["username"] for record in records]
+            ).values_list("username", "pk")
+        )
+        # Date and time strings are parsed by the model fields on insert
+        users = user_model.objects.bulk_create(
+            [
+                user_model(
+                    **{field: record[field] for field in USER_FIELDS},
+                    avatar_hash=gravatar_hash(record["email"]),
+                )
+                for record in records
+                if record["username"] not in usernames
+            ]
+        )
+        UserStats.objects.bulk_create([UserStats(user=user) for user in users])
+        usernames.update((user.username, user.pk) for user in users)
+        return [(record["id"], usernames[record["username"]]) for record in records]
+
+    def load_twits(self, records):
+        """Create twits and add them to the search index"""
+        user_ids = self.resolve("user", records, "user")
+        twits = bulk_create_with_timestamps(
+            Twit,
+            [
+                Twit(
+                    user_id=user_id,
+                    body=record["body"],
+                    image_url=record["image_url"],
+                    created_at=record["created_at"],
+                    updated_at=record["updated_at"],
+                )
+                for record, user_id in zip(records, user_ids)
+            ],
+        )
+        index_twits(*[twit.pk for twit in twits])
+        UserStats.objects.filter(user__in=set(user_ids)).refresh(
+            fields=("twit_count", "last_active_at")
+        )
+        return [(record["id"], twit.pk) for record, twit in zip(records, twits)]
+
+    def load_comments(self, records):
+        """Create comments and recount and reindex their twits"""
+        twit_ids = self.resolve("twit", records, "twit")
+        user_ids = self.resolve("user", records, "user")
+        comments = bulk_create_with_timestamps(
+            Comment,
+            [
+                Comment(
+                    twit_id=twit_id,
+                    user_id=user_id,
+                    text=record["text"],
+                    created_at=record["created_at"],
+                    updated_at=record["updated_at"],
+                )
+                for record, twit_id, user_id in zip(records, twit_ids, user_ids)
+            ],
+        )
+        twit_ids = set(twit_ids)
+        Twit.objects.filter(pk__in=twit_ids).refresh_counters(fields=("comment_count",))
+        UserStats.objects.filter(user__in=set(user_ids)).refresh(
+            fields=("comment_count", "last_active_at")
+        )
+        index_twits(*twit_ids)
+        return [
+            (record["id"], comment.pk) for record, comment in zip(records, comments)
+        ]
+
+    def load_likes(self, records):
+        """Create likes and recount their twits"""
+        through = Twit.likes.through
+        twit_ids = self.resolve("twit", records, "twit")
+        user_ids = self.resolve("user", records, "user")
+        through.objects.bulk_create(
+            [
+                through(twit_id=twit_id, customuser_id=user_id)
+                for twit_id, user_id in zip(twit_ids, user_ids)
+            ],
+            ignore_conflicts=True,
+        )
+        twits = Twit.objects.filter(pk__in=set(twit_ids))
+        twits.refresh_counters(fields=("like_count",))
+        UserStats.objects.filter(user__in=twits.values("user")).refresh(
+            fields=("likes_received",)
+        )
+        return []
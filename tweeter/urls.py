@@ -1,14 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
+    AsyncTwitDetailCommentCreateView,
+    AsyncTwitLikeView,
+    AsyncTwitListView,
+    CommentExportView,
+    TwitExportView,
+    TwitCommentsView,
     TwitDetailCommentCreateView,
+    HomeTimelineView,
     TwitCreateView,
     TwitDeleteView,
+    TwitImageView,
     TwitListView,
+    TwitLiveView,
+    TwitSearchView,
     TwitUpdateView,
     TwitLikeView,
 )
 
+# The busiest views have async versions for when we are served over ASGI
+if settings.TWEETER_ASYNC_VIEWS:
+    TwitDetailCommentCreateView = AsyncTwitDetailCommentCreateView
+    TwitLikeView = AsyncTwitLikeView
+    TwitListView = AsyncTwitListView
+
 
 urlpatterns = [
     path(
@@ -16,9 +33,20 @@ urlpatterns = [
         TwitDetailCommentCreateView.as_view(),
         name="comment_new",
     ),
+    path("<int:pk>/comments/", TwitCommentsView.as_view(), name="twit_comments"),
     path("<int:pk>/edit/", TwitUpdateView.as_view(), name="twit_edit"),
     path("<int:pk>/delete/", TwitDeleteView.as_view(), name="twit_delete"),
     path("<int:pk>/like/", TwitLikeView.as_view(), name="twit_like"),
+    path(
+        "<int:pk>/image/<str:variant>/",
+        TwitImageView.as_view(),
+        name="twit_image",
+    ),
     path("new/", TwitCreateView.as_view(), name="twit_new"),
+    path("export/", TwitExportView.as_view(), name="twit_export"),
+    path("comments/export/", CommentExportView.as_view(), name="comment_export"),
+    path("search/", TwitSearchView.as_view(), name="twit_search"),
+    path("home/", HomeTimelineView.as_view(), name="home_timeline"),
+    path("live/", TwitLiveView.as_view(), name="twit_live"),
     path("", TwitListView.as_view(), name="twit_list"),
 ]
@@ -1,6 +1,20 @@
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import (
+    AccessMixin,
+    LoginRequiredMixin,
+    UserPassesTestMixin,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy, reverse
+from django.utils.dateparse import parse_datetime
 from django.views import View
 from django.views.generic import ListView, CreateView, DetailView, FormView
 from django.views.generic.detail import SingleObjectMixin
@@ -8,14 +22,83 @@ from django.views.generic.edit import UpdateView, DeleteView
 
 from tweeter.forms import CommentForm
 
-from .models import Twit
+from .conditional import ConditionalGetMixin
+from .fragments import discard_twit_box
+from .images import (
+    VARIANTS,
+    fetch_twit_image_later,
+    is_digest,
+    queue_twit_image_fetch,
+    sniff_content_type,
+    variant_bytes,
+)
+from .likebuffer import buffer_like
+from .live import LiveUpdatesMixin, comment_created, like_count_changed, twit_created
+from .models import Comment, Twit
+from .pagination import (
+    KeysetPaginationMixin,
+    KeysetPaginator,
+    decode_cursor,
+    encode_cursor,
+)
+from .search import index_twits, search_twits
+from .timelines import fan_out, home_page
+
+
+class TwitListView(
+    LoginRequiredMixin,
+    ConditionalGetMixin,
+    LiveUpdatesMixin,
+    KeysetPaginationMixin,
+    ListView,
+):
+    """Twit List View"""
 
+    model = Twit
+    template_name = "twit_list.html"
+    paginate_by = 20
+    live_new_twits = True
+
+    def get_queryset(self):
+        """Get the feed for the current user"""
+        return Twit.objects.for_feed(self.request.user)
+
+    def get_validator_twits(self):
+        """Get the metadata of the twits on the requested page"""
+        return self.get_keyset_paginator(self.paginate_by).page(
+            Twit.objects.for_validators(self.request.user),
+            older=self.request.GET.get(self.older_kwarg),
+            newer=self.request.GET.get(self.newer_kwarg),
+        )
 
-class TwitListView(LoginRequiredMixin, ListView):
-    """Twit List View"""
+    def get_validator_extra(self, twits):
+        """The pagination links depend on the pages around this one"""
+        return (twits.has_older, twits.has_newer)
+
+
+class HomeTimelineView(
+    LoginRequiredMixin, LiveUpdatesMixin, KeysetPaginationMixin, ListView
+):
+    """Home Timeline View"""
 
     model = Twit
     template_name = "twit_list.html"
+    paginate_by = 20
+    extra_context = {"feed_title": "Following"}
+
+    def get_queryset(self):
+        """Timeline pages are read by home_page instead of a queryset"""
+        return Twit.objects.none()
+
+    def paginate_queryset(self, queryset, page_size):
+        """Get a page of the materialized home timeline"""
+        page = home_page(
+            self.request.user,
+            page_size,
+            older=self.request.GET.get(self.older_kwarg),
+            newer=self.request.GET.get(self.newer_kwarg),
+        )
+        return (page.paginator, page, page.object_list, page.has_other_pages())
 
 
 class TwitUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
@@ -34,6 +117,15 @@ class TwitUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         obj = self.get_object()
         return obj.user == self.request.user
 
+    def form_valid(self, form):
+        """Form Valid"""
+        discard_twit_box(self.object)
+        response = super().form_valid(form)
+        index_twits(self.object.pk)
+        if "image_url" in form.changed_data:
+            fetch_twit_image_later(self.object)
+        return response
+
 
 class TwitDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     """Twit Delete View"""
@@ -47,6 +139,11 @@ class TwitDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         obj = self.get_object()
         return obj.user == self.request.user
 
+    def form_valid(self, form):
+        """Form Valid"""
+        discard_twit_box(self.object)
+        return super().form_valid(form)
+
 
 class TwitCreateView(LoginRequiredMixin, CreateView):
     """Twit Create View"""
@@ -62,17 +159,69 @@ class TwitCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         """Form Valid"""
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        fan_out(self.object)
+        index_twits(self.object.pk)
+        fetch_twit_image_later(self.object)
+        twit_created(self.object)
+        return response
+
 
+# Enough of a twit to add a comment and discard its cached box
+COMMENTED_TWIT_FIELDS = ("id", "updated_at", "comment_count", "image_digest")
 
-class CommentCreateGetView(DetailView):
+
+def is_xhr(request):
+    """Whether a request was sent by the page's scripts"""
+    return request.headers.get("X-Requested-With") == "XMLHttpRequest"
+
+
+def comment_json(comment, comment_count):
+    """Answer a comment posted from a feed with its row and the new count"""
+    return JsonResponse(
+        {
+            "success": True,
+            "id": comment.pk,
+            "twit": comment.twit_id,
+            "html": render_to_string("partials/_comment.html", {"comments": [comment]}),
+            "comment_count": comment_count,
+        }
+    )
+
+
+def comment_errors_json(form):
+    """Answer a comment posted from a feed that did not validate"""
+    return JsonResponse({"success": False, "errors": form.errors}, status=400)
+
+
+def attach_comment_page(twit):
+    """Load a twit's latest page of comments, linking to the earlier ones"""
+    page = KeysetPaginator(settings.TWEETER_COMMENT_PAGE_SIZE).page(
+        Comment.objects.filter(twit_id=twit.pk).select_related("user")
+    )
+    twit.comment_preview = page.object_list[::-1]
+    twit.earlier_comments_cursor = page.older_cursor if page.has_older else None
+
+
+class CommentCreateGetView(ConditionalGetMixin, DetailView):
     """Comment Create View"""
 
     model = Twit
     template_name = "comment_new.html"
     context_object_name = "twit"
 
+    def get_queryset(self):
+        """Get twits loaded for rendering"""
+        return Twit.objects.for_feed(self.request.user)
+
+    def get_validator_twits(self):
+        """Get the metadata of the twit being commented on"""
+        return list(
+            Twit.objects.for_validators(self.request.user).filter(pk=self.kwargs["pk"])
+        )
+
     def get_context_data(self, **kwargs):
+        attach_comment_page(self.object)
         context = super().get_context_data(**kwargs)
         context["form"] = CommentForm()
         return context
@@ -86,9 +235,14 @@ class CommentCreatePostView(SingleObjectMixin, FormView):
     template_name = "comment_new.html"
     context_object_name = "twit"
 
+    def get_queryset(self):
+        """Get twits loaded for rendering"""
+        return Twit.objects.for_feed(self.request.user)
+
     def post(self, request, *args, **kwargs):
         """Post request"""
-        self.object = self.get_object()
+        # The comments are only loaded if the form has to be shown again
+        self.object = self.get_object(Twit.objects.only(*COMMENTED_TWIT_FIELDS))
         return super().post(request, *args, **kwargs)
 
     def form_valid(self, form):
@@ -97,8 +251,26 @@ class CommentCreatePostView(SingleObjectMixin, FormView):
         comment.twit = self.object
         comment.user = self.request.user
         comment.save()
+        discard_twit_box(self.object)
+        index_twits(self.object.pk)
+        comment_created(comment)
+        if is_xhr(self.request):
+            comment_count = (
+                Twit.objects.filter(pk=self.object.pk)
+                .values_list("comment_count", flat=True)
+                .get()
+            )
+            return comment_json(comment, comment_count)
         return super().form_valid(form)
 
+    def form_invalid(self, form):
+        """Show the errors, with the twit and its comments on a full page"""
+        if is_xhr(self.request):
+            return comment_errors_json(form)
+        self.object = self.get_object()
+        attach_comment_page(self.object)
+        return super().form_invalid(form)
+
     def get_success_url(self):
         """Get success Url"""
         return reverse("twit_list")
@@ -118,33 +290,379 @@ class TwitDetailCommentCreateView(LoginRequiredMixin, View):
         return view(request, *args, **kwargs)
 
 
+class TwitSearchView(LoginRequiredMixin, ListView):
+    """Twit Search View"""
+
+    template_name = "twit_search.html"
+    context_object_name = "twit_list"
+    results_per_page = 20
+
+    def get_queryset(self):
+        """Get the twits matching the query, best match first"""
+        self.query = self.request.GET.get("q", "").strip()
+        rows, self.next_cursor = search_twits(
+            self.query,
+            self.results_per_page,
+            after=self.request.GET.get("after"),
+        )
+        twits = Twit.objects.for_feed(self.request.user).in_bulk(
+            [twit_id for twit_id, _ in rows]
+        )
+        return [twits[twit_id] for twit_id, _ in rows if twit_id in twits]
+
+    def get_context_data(self, **kwargs):
+        """Add the query and the cursor of the next page"""
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        context["next_cursor"] = self.next_cursor
+        return context
+
+
+class TwitCommentsView(LoginRequiredMixin, View):
+    """Twit Comments View"""
+
+    def get(self, request, *args, **kwargs):
+        """GET Request"""
+        if not Twit.objects.filter(pk=kwargs["pk"]).exists():
+            raise Http404("No twit found matching the query")
+
+        # Pages run newest first, so flip each one into display order
+        page = KeysetPaginator(settings.TWEETER_COMMENT_PAGE_SIZE).page(
+            Comment.objects.filter(twit_id=kwargs["pk"]).select_related("user"),
+            older=request.GET.get("older"),
+        )
+        html = render_to_string(
+            "partials/_comment.html",
+            {"comments": page.object_list[::-1]},
+        )
+
+        return JsonResponse(
+            {
+                "html": html,
+                "older_url": (
+                    f"{request.path}?older={page.older_cursor}"
+                    if page.has_older
+                    else None
+                ),
+            }
+        )
+
+
+class TwitLiveView(LoginRequiredMixin, View):
+    """Twit Live View
+
+    Over ASGI the live event stream is served by tweeter.live.LiveEventsApp
+    before requests reach Django. Anywhere else there is no stream, and a
+    204 tells the browser's EventSource not to reconnect.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """GET Request"""
+        return HttpResponse(status=204)
+
+
+class TwitImageView(LoginRequiredMixin, View):
+    """Twit Image View
+
+    Serves a variant of a twit's image from the local image cache. The
+    version in the query string is the digest of the original, so the
+    response never changes and can be cached for good. Images missing from
+    the cache redirect to their original, and evicted ones are fetched again.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """GET Request"""
+        variant = kwargs["variant"]
+        digest = request.GET.get("v", "")
+        if variant not in VARIANTS:
+            raise Http404("No such image variant")
+
+        # Anything else is never joined into a cache path
+        if not is_digest(digest):
+            digest = ""
+
+        data = None
+        if digest:
+            data = variant_bytes(digest, variant)
+        if data is None:
+            twit = Twit.objects.filter(pk=kwargs["pk"]).only(
+                "image_url", "image_digest"
+            )
+            twit = twit.first()
+            if twit is None or not twit.image_url:
+                raise Http404("No twit image found matching the query")
+            if twit.image_digest and twit.image_digest != digest:
+                url = reverse("twit_image", args=[twit.pk, variant])
+                return redirect(f"{url}?v={twit.image_digest}")
+            if twit.image_digest:
+                # Evicted from the cache, fetched again outside the request
+                queue_twit_image_fetch(twit.pk)
+            # Until the image is in the cache, the original is linked
+            return redirect(twit.image_url)
+
+        content_type = sniff_content_type(data)
+        if content_type is None:
+            raise Http404("No twit image found matching the query")
+        response = HttpResponse(data, content_type=content_type)
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
+
 class TwitLikeView(LoginRequiredMixin, View):
-    """Article Like View"""
+    """Twit Like View"""
+
+    def post(self, request, *args, **kwargs):
+        """POST Request"""
+
+        # Get out the data from the POST request
+        twit_action = request.POST.get("twit_action", None)
+
+        if twit_action not in ("like", "unlike"):
+            return JsonResponse(
+                {
+                    "success": False,
+                },
+                status=400,
+            )
+
+        liked = twit_action == "like"
+        set_like = (
+            buffer_like if settings.TWEETER_LIKE_BUFFER else Twit.objects.set_like
+        )
+        try:
+            like_count = set_like(kwargs["pk"], request.user.pk, liked)
+        except Twit.DoesNotExist as exc:
+            raise Http404("No twit found matching the query") from exc
+        like_count_changed(kwargs["pk"], like_count)
+
+        return JsonResponse(
+            {
+                "success": True,
+                "liked": liked,
+                "like_count": like_count,
+            }
+        )
+
+
+class NDJSONExportView(LoginRequiredMixin, View):
+    """Stream rows as newline delimited JSON, oldest first.
+
+    Rows are read through a server-side cursor in chunks and written out as
+    they arrive, so memory use stays flat however many rows match. Each row
+    carries a cursor that can be passed back as `after` to resume.
+    """
+
+    model = None
+    fields = ()
+    filters = {"user": "user_id"}
+
+    def get_queryset(self):
+        """Get the rows to stream, filtered by the query string"""
+        queryset = self.model.objects.order_by("created_at", "id")
+        for param, lookup in self.filters.items():
+            value = self.request.GET.get(param)
+            if value is not None:
+                if not value.isdigit():
+                    raise ValueError(f"{param} must be an id")
+                queryset = queryset.filter(**{lookup: value})
+
+        for param, lookup in (
+            ("since", "created_at__gte"),
+            ("until", "created_at__lt"),
+        ):
+            value = self.request.GET.get(param)
+            if value is not None:
+                moment = parse_datetime(value)
+                if moment is None:
+                    raise ValueError(f"{param} must be an ISO 8601 datetime")
+                queryset = queryset.filter(**{lookup: moment})
+
+        after = self.request.GET.get("after")
+        if after:
+            created_at, pk = decode_cursor(after)
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+            )
+        return queryset.values(*self.fields)
 
     def get(self, request, *args, **kwargs):
         """GET Request"""
+        try:
+            rows = self.get_queryset()
+        except ValueError as exc:
+            return JsonResponse({"success": False, "error": str(exc)}, status=400)
+
+        return StreamingHttpResponse(
+            self.stream(rows), content_type="application/x-ndjson"
+        )
+
+    @staticmethod
+    def stream(rows):
+        """Yield one JSON line per row"""
+        for row in rows.iterator(chunk_size=settings.TWEETER_EXPORT_CHUNK_SIZE):
+            row["cursor"] = encode_cursor(row["created_at"], row["id"])
+            yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+class TwitExportView(NDJSONExportView):
+    """Twit Export View"""
+
+    model = Twit
+    fields = (
+        "id",
+        "user_id",
+        "user__username",
+        "body",
+        "image_url",
+        "like_count",
+        "comment_count",
+        "created_at",
+        "updated_at",
+    )
+
+
+class CommentExportView(NDJSONExportView):
+    """Comment Export View"""
+
+    model = Comment
+    fields = (
+        "id",
+        "twit_id",
+        "user_id",
+        "user__username",
+        "text",
+        "created_at",
+        "updated_at",
+    )
+    filters = {"user": "user_id", "twit": "twit_id"}
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin for views with async handlers.
+
+    The session and user are loaded in a worker thread, since the lazy
+    request.user cannot run queries from the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        """Dispatch to the handler if the user is logged in"""
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def aget_twit_or_404(queryset, pk):
+    """Get a twit with the async ORM or raise Http404"""
+    try:
+        return await queryset.aget(pk=pk)
+    except Twit.DoesNotExist as exc:
+        raise Http404("No twit found matching the query") from exc
+
+
+class AsyncTwitListView(AsyncLoginRequiredMixin, TwitListView):
+    """Async Twit List View"""
+
+    async def get(self, request, *args, **kwargs):
+        """GET Request"""
+        validators = await sync_to_async(self.get_validators)()
+        response = self.get_not_modified(*validators)
+        if response is None:
+            self.object_list = self.get_queryset()
+            self.page = await self.get_keyset_paginator(self.paginate_by).apage(
+                self.object_list,
+                older=request.GET.get(self.older_kwarg),
+                newer=request.GET.get(self.newer_kwarg),
+            )
+            response = self.render_to_response(self.get_context_data())
+        return self.set_validators(response, *validators)
+
+    def paginate_queryset(self, queryset, page_size):
+        """Use the page already fetched by get"""
+        page = self.page
+        return (page.paginator, page, page.object_list, page.has_other_pages())
 
-        # Get out the data from the GET request
-        twit_id = request.GET.get("twit_id", None)
-        twit_action = request.GET.get("twit_action", None)
 
-        if not twit_id or not twit_action:
+class AsyncTwitLikeView(AsyncLoginRequiredMixin, View):
+    """Async Twit Like View"""
+
+    async def post(self, request, *args, **kwargs):
+        """POST Request"""
+        twit_action = request.POST.get("twit_action", None)
+
+        if twit_action not in ("like", "unlike"):
             return JsonResponse(
                 {
                     "success": False,
-                }
+                },
+                status=400,
             )
 
-        twit = Twit.objects.get(id=twit_id)
-        if twit_action == "like":
-            # Do like stuff
-            twit.likes.add(request.user)
-        else:
-            # Do unlike stuff
-            twit.likes.remove(request.user)
+        liked = twit_action == "like"
+        set_like = (
+            buffer_like if settings.TWEETER_LIKE_BUFFER else Twit.objects.set_like
+        )
+        try:
+            # The like runs in one transaction, which has to be synchronous
+            like_count = await sync_to_async(set_like)(
+                kwargs["pk"], request.user.pk, liked
+            )
+        except Twit.DoesNotExist as exc:
+            raise Http404("No twit found matching the query") from exc
+        await sync_to_async(like_count_changed)(kwargs["pk"], like_count)
 
         return JsonResponse(
             {
                 "success": True,
+                "liked": liked,
+                "like_count": like_count,
             }
         )
+
+
+class AsyncTwitDetailCommentCreateView(AsyncLoginRequiredMixin, View):
+    """Async Twit Detail / Comment Create View"""
+
+    template_name = "comment_new.html"
+
+    async def render_form(self, request, pk, form):
+        """Render the twit, its comments and the comment form"""
+        twit = await aget_twit_or_404(Twit.objects.for_feed(request.user), pk)
+        await sync_to_async(attach_comment_page)(twit)
+        return TemplateResponse(
+            request,
+            self.template_name,
+            {"twit": twit, "object": twit, "form": form},
+        )
+
+    async def get(self, request, *args, **kwargs):
+        """Get request"""
+        return await self.render_form(request, kwargs["pk"], CommentForm())
+
+    async def post(self, request, *args, **kwargs):
+        """Post request"""
+        form = CommentForm(request.POST)
+        if not form.is_valid():
+            if is_xhr(request):
+                return comment_errors_json(form)
+            return await self.render_form(request, kwargs["pk"], form)
+
+        twit = await aget_twit_or_404(
+            Twit.objects.only(*COMMENTED_TWIT_FIELDS), kwargs["pk"]
+        )
+        comment = await Comment.objects.acreate(
+            twit=twit,
+            user=request.user,
+            text=form.cleaned_data["text"],
+        )
+        await sync_to_async(discard_twit_box)(twit)
+        await sync_to_async(index_twits)(twit.pk)
+        await sync_to_async(comment_created)(comment)
+        if is_xhr(request):
+            comment_count = (
+                await Twit.objects.filter(pk=twit.pk)
+                .values_list("comment_count", flat=True)
+                .aget()
+            )
+            return await sync_to_async(comment_json)(comment, comment_count)
+        return redirect("twit_list")
@@ -0,0 +1,98 @@
+"""Work done before a server process takes its first request.
+
+Templates are parsed and URL patterns compiled lazily, on the first request
+that needs them, and database connections are opened by the first query.
+warm_up does all of that up front. gunicorn.conf.py runs the template and
+URL steps in the master after preloading the app, so the forked workers
+share the result, and opens the database connections in each worker.
+"""
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.utils import get_app_template_dirs
+from django.urls import NoReverseMatch, Resolver404, get_resolver, resolve, reverse
+
+
+def template_names():
+    """Names of the project templates and of the crispy forms pack in use"""
+    engine = engines["django"].engine
+    project_dirs = [Path(directory) for directory in engine.dirs]
+    pack = f"{settings.CRISPY_TEMPLATE_PACK}/"
+    names = set()
+    for directory in [*project_dirs, *get_app_template_dirs("templates")]:
+        for path in Path(directory).rglob("*.html"):
+            name = path.relative_to(directory).as_posix()
+            if Path(directory) in project_dirs or name.startswith(pack):
+                names.add(name)
+    return sorted(names)
+
+
+def compile_templates():
+    """Load every template once so the cached loader keeps it compiled"""
+    engine = engines["django"].engine
+    names = template_names()
+    for name in names:
+        engine.get_template(name)
+    return len(names)
+
+
+def named_urls(resolver=None, namespace=""):
+    """Get (name, parameters) of every named URL, namespaces included"""
+    resolver = resolver or get_resolver()
+    for name in resolver.reverse_dict:
+        if isinstance(name, str):
+            possibilities = resolver.reverse_dict.getlist(name)[0][0]
+            yield f"{namespace}{name}", possibilities[0][1]
+    for prefix, (_, child) in resolver.namespace_dict.items():
+        yield from named_urls(child, f"{namespace}{prefix}:")
+
+
+def resolve_urls():
+    """Reverse and resolve every named URL, compiling all the patterns.
+
+    Parameters are filled in with 1, which is enough for the int and str
+    converters used here. Names that still cannot be reversed are skipped.
+    """
+    resolved = 0
+    for name, params in named_urls():
+        try:
+            resolve(reverse(name, kwargs={param: 1 for param in params}))
+        except (NoReverseMatch, Resolver404):
+            continue
+        resolved += 1
+    return resolved
+
+
+def open_connections():
+    """Connect to every configured database"""
+    for connection in connections.all():
+        connection.ensure_connection()
+    return len(connections.all())
+
+
+STEPS = {
+    "templates": compile_templates,
+    "urls": resolve_urls,
+    "database": open_connections,
+}
+
+
+def warm_up(steps=tuple(STEPS)):
+    """Run warm-up steps and return {step: (count, seconds)}"""
+    timings = {}
+    for step in steps:
+        started = time.perf_counter()
+        count = STEPS[step]()
+        timings[step] = (count, time.perf_counter() - started)
+    return timings
+
+
+def describe(timings):
+    """Summarise warm-up timings on one line"""
+    return ", ".join(
+        f"{step} {count} in {seconds * 1000:.0f}ms"
+        for step, (count, seconds) in timings.items()
+    )